@@ -1,8 +1,41 @@
-from .client import OctoClient
-from .xhrstreaminggenerator import XHRStreamingGenerator
-from .xhrstreaming import XHRStreamingEventHandler
-from .websocket import WebSocketEventHandler
+import importlib
+import sys
 
 
-__all__ = ['OctoClient', 'XHRStreamingGenerator',
-           'XHRStreamingEventHandler', 'WebSocketEventHandler']
+# Public names and the modules they live in, the modules are only imported
+# on first access, so importing the package does not pull in requests or
+# websocket-client
+_LAZY = {
+    'OctoClient': '.client',
+    'Fleet': '.fleet',
+    'XHRStreamingGenerator': '.xhrstreaminggenerator',
+    'XHRStreamingEventHandler': '.xhrstreaming',
+    'WebSocketEventHandler': '.websocket',
+    'AutoEventHandler': '.transport',
+}
+
+
+__all__ = ['OctoClient', 'Fleet', 'XHRStreamingGenerator',
+           'XHRStreamingEventHandler', 'WebSocketEventHandler',
+           'AutoEventHandler']
+
+
+def __getattr__(name):
+    try:
+        module = _LAZY[name]
+    except KeyError:
+        msg = 'module {!r} has no attribute {!r}'
+        raise AttributeError(msg.format(__name__, name)) from None
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+if sys.version_info < (3, 7):
+    # module level __getattr__ is not supported here (PEP 562)
+    for _name in __all__:
+        __getattr__(_name)
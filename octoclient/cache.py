@@ -0,0 +1,173 @@
+'''
+Persistent metadata cache
+
+Keeps the raw responses of the slowly changing resources (files with their
+gcodeAnalysis, settings, version) of many printers in one SQLite database,
+so a restarted service does not have to download them all again.
+Entries are revalidated with conditional requests, see OctoClient(cache=...).
+'''
+import hashlib
+import sqlite3
+import threading
+import time
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    url TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    body BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    hash TEXT NOT NULL,
+    stored REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (url, resource)
+)
+'''
+
+
+class CacheEntry:
+    '''
+    One cached response
+    '''
+    __slots__ = ('body', 'etag', 'last_modified', 'hash', 'stored')
+
+    def __init__(self, body, etag, last_modified, hash, stored):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.hash = hash
+        self.stored = stored
+
+    def age(self, now=None):
+        return (time.time() if now is None else now) - self.stored
+
+
+class MetadataCache:
+    '''
+    SQLite backed cache of raw responses keyed by printer URL and resource
+
+    The database is in WAL mode, so many threads and processes can read it
+    while one writes. Every thread gets its own connection.
+
+    max_size bounds the total size of the cached bodies in bytes,
+    the least recently used entries are evicted when it is exceeded.
+    max_age is the number of seconds an entry is used without asking
+    the printer at all, older entries are revalidated (the default 0
+    revalidates every time, which is still cheap for unchanged resources).
+    '''
+
+    def __init__(self, path, *, max_size=64 * 1024 * 1024, max_age=0):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self._local = threading.local()
+        self.connection.executescript(_SCHEMA)
+
+    @property
+    def connection(self):
+        '''
+        The sqlite3 connection of the current thread
+        '''
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, url, resource):
+        '''
+        Returns the CacheEntry for given printer URL and resource,
+        or None if there is none
+        '''
+        row = self.connection.execute(
+            'SELECT body, etag, last_modified, hash, stored FROM entries '
+            'WHERE url = ? AND resource = ?', (url, resource)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute(
+            'UPDATE entries SET accessed = ? WHERE url = ? AND resource = ?',
+            (time.time(), url, resource))
+        return CacheEntry(bytes(row[0]), *row[1:])
+
+    def put(self, url, resource, body, etag=None, last_modified=None):
+        '''
+        Stores a response body with its validators,
+        evicting old entries if the cache grows over max_size
+
+        Returns the new CacheEntry
+        '''
+        now = time.time()
+        digest = hashlib.sha1(body).hexdigest()
+        connection = self.connection
+        updated = connection.execute(
+            'UPDATE entries SET etag = ?, last_modified = ?, stored = ?, '
+            'accessed = ? WHERE url = ? AND resource = ? AND hash = ?',
+            (etag, last_modified, now, now, url, resource, digest)).rowcount
+        if not updated:
+            # a changed body, the unchanged ones are not written again
+            connection.execute(
+                'INSERT OR REPLACE INTO entries VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, resource, body, etag, last_modified, digest, now, now,
+                 len(body)))
+            self._evict()
+        return CacheEntry(body, etag, last_modified, digest, now)
+
+    def touch(self, url, resource):
+        '''
+        Marks an entry as fresh, after the printer said it did not change
+        '''
+        now = time.time()
+        self.connection.execute(
+            'UPDATE entries SET stored = ?, accessed = ? '
+            'WHERE url = ? AND resource = ?', (now, now, url, resource))
+
+    def _evict(self):
+        rows = self.connection.execute(
+            'SELECT rowid, size FROM entries ORDER BY accessed DESC')
+        total, evicted = 0, []
+        for rowid, size in rows:
+            total += size
+            if total > self.max_size:
+                evicted.append((rowid,))
+        if evicted:
+            self.connection.executemany(
+                'DELETE FROM entries WHERE rowid = ?', evicted)
+
+    def size(self):
+        '''
+        Total size of the cached bodies in bytes
+        '''
+        return self.connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def clear(self, url=None, prefix=''):
+        '''
+        Removes all the entries, or those of the printer with given URL
+        (and with resources starting with prefix)
+        '''
+        if url is None:
+            self.connection.execute('DELETE FROM entries')
+        else:
+            self.connection.execute(
+                'DELETE FROM entries WHERE url = ? AND '
+                'substr(resource, 1, ?) = ?', (url, len(prefix), prefix))
+
+    def close(self):
+        '''
+        Closes the connection of the current thread
+        '''
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
@@ -0,0 +1,153 @@
+'''
+The octoclient command
+
+Talks to a running octoclient daemon over a Unix socket when there is one,
+so it does not pay for the connection setup every time,
+falls back to talking to the printers directly otherwise.
+Keep the imports here light, the command is meant to start fast.
+'''
+import argparse
+import configparser
+import json
+import os
+import socket
+import sys
+
+
+def default_config():
+    return os.environ.get('OCTOCLIENT_CONFIG', os.path.join(
+        os.path.expanduser('~'), '.config', 'octoclient', 'printers.ini'))
+
+
+def default_socket():
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, 'octoclient.sock')
+    return '/tmp/octoclient-{}.sock'.format(os.getuid())
+
+
+def load_printers(path):
+    '''
+    Reads printers from an INI file,
+    every section is one printer with url and apikey keys
+
+    Returns a dict mapping printer names to (url, apikey) tuples
+    '''
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        raise SystemExit('Config file {} not found'.format(path))
+    return {name: (config[name]['url'], config[name]['apikey'])
+            for name in config.sections()}
+
+
+def request(socket_path, message, timeout=30):
+    '''
+    Sends one request to the daemon, returns its result
+
+    Raises FileNotFoundError or ConnectionRefusedError if there is
+    no daemon listening, socket.timeout if it does not answer in time
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as reply:
+            reply = json.loads(reply.readline().decode('utf-8'))
+    if 'error' in reply:
+        raise RuntimeError(reply['error'])
+    return reply['result']
+
+
+def _format_status(name, row):
+    if 'error' in row:
+        return '{}\terror: {}'.format(name, row['error'])
+    progress = row.get('progress')
+    progress = '-' if progress is None else '{:.1f}%'.format(progress)
+    temps = ' '.join('{}:{}/{}'.format(k, v['actual'], v['target'])
+                     for k, v in sorted(row['temperature'].items()))
+    return '\t'.join((name, row['state'], progress, row['file'] or '-',
+                      temps))
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='octoclient', description='Control OctoPrint instances')
+    parser.add_argument('--config', default=default_config(),
+                        help='INI file with printers (default: %(default)s)')
+    parser.add_argument('--socket', default=default_socket(),
+                        help='daemon socket (default: %(default)s)')
+    parser.add_argument('--json', action='store_true',
+                        help='print raw JSON results')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    for command, help in (('status', 'show printer state and temperatures'),
+                          ('job', 'show current job information')):
+        sub = commands.add_parser(command, help=help)
+        sub.add_argument('printers', nargs='*', help='printer names')
+        sub.add_argument('--all', action='store_true',
+                         help='all configured printers (the default)')
+    commands.add_parser('printers', help='list configured printers')
+    daemon = commands.add_parser('daemon', help='run the daemon')
+    daemon.add_argument('--no-push', action='store_true',
+                        help='do not keep push streams open')
+    daemon.add_argument('--max-age', type=float, default=10,
+                        help='max age of push state in seconds')
+    commands.add_parser('stop', help='stop the running daemon')
+    return parser
+
+
+def _handle(args, message):
+    try:
+        return request(args.socket, message)
+    except (FileNotFoundError, ConnectionRefusedError):
+        if args.command == 'stop':
+            raise RuntimeError('No daemon running')
+    except socket.timeout:
+        # a daemon is there but busy, doing the work here would not help
+        raise RuntimeError('The daemon did not answer in time')
+    # No daemon, do the work in this process
+    from .daemon import Daemon
+    daemon = Daemon(load_printers(args.config), args.socket, push=False)
+    return daemon.handle(message)
+
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+
+    if args.command == 'daemon':
+        from .daemon import Daemon
+        daemon = Daemon(load_printers(args.config), args.socket,
+                        push=not args.no_push, max_age=args.max_age)
+        try:
+            daemon.serve_forever()
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            return 1
+        return 0
+
+    message = {'command': args.command,
+               'printers': getattr(args, 'printers', None) or None}
+    try:
+        result = _handle(args, message)
+    except (RuntimeError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    if args.json or args.command == 'job':
+        print(json.dumps(result, indent=2, sort_keys=True))
+    elif args.command == 'status':
+        for name, row in sorted(result.items()):
+            print(_format_status(name, row))
+    elif args.command == 'printers':
+        for name, url in sorted(result.items()):
+            print('{}\t{}'.format(name, url))
+    else:
+        print(result)
+    if isinstance(result, dict) and args.command in ('status', 'job'):
+        return int(any('error' in row for row in result.values()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+import hashlib
+import json
 import os
+import threading
+import time
+import uuid
 from urllib import parse as urlparse
 
 import requests
 
+from .metrics import RequestEvent, endpoint
+from .models import ConnectionInfo, FileEntry, JobInfo, PrinterState
+
 
 class OctoClient:
     '''
     Encapsulates communication with one OctoPrint instance
     '''
 
-    def __init__(self, *, url=None, apikey=None, session=None):
+    PRINTER_PARTS = ('sd', 'temperature', 'state')
+    SNAPSHOT_PARTS = ('job', 'connection') + PRINTER_PARTS
+    # first component of fetch() fields -> snapshot part it comes from
+    FETCH_ROOTS = dict({'job': 'job', 'progress': 'job',
+                        'connection': 'connection'},
+                       **{p: p for p in PRINTER_PARTS})
+
+    # connections kept open to the printer at most
+    POOL_SIZE = 16
+
+    # state flags of a printer that is not operational, see snapshot()
+    OFFLINE_FLAGS = {'operational': False, 'printing': False,
+                     'paused': False, 'ready': False, 'sdReady': False,
+                     'closedOrError': True}
+
+    # resources kept in the cache, if there is one
+    CACHED = ('/api/files', '/api/settings', '/api/version')
+
+    def __init__(self, *, url=None, apikey=None, session=None, hooks=None,
+                 cache=None, limiter=None):
         '''
         Initialize the object with URL and API key
 
-        If a session is provided, it will be used (mostly for testing)
+        If a session is provided, it will be used (mostly for testing),
+        requests using it are serialized, because its adapters may not be
+        thread-safe. Otherwise the client creates one session with
+        a connection pool of POOL_SIZE connections, shared by all
+        the threads, so the object can be shared between threads
+        and keep-alive connections are reused by all of them.
+        Settings of the session (verify, proxies, headers...) apply
+        to all the requests, but change them before sharing the client.
+
+        hooks is an optional list of callables, each is called with
+        an octoclient.metrics.RequestEvent after every request
+        (see octoclient.metrics.RESTMetrics and span_hook)
+
+        cache is an optional octoclient.cache.MetadataCache, files, settings
+        and version responses are then served from it and revalidated
+        with conditional requests (ETag and Last-Modified)
+
+        limiter is an optional octoclient.ratelimit.RateLimiter, requests
+        then wait for its tokens and adjust its rates, except for the print
+        critical commands (cancel and pause), which are never held back
         '''
         if not url:
             raise TypeError('Required argument \'url\' not found or emtpy')
@@ -29,13 +76,111 @@ class OctoClient:
 
         self.url = '{}://{}'.format(parsed.scheme, parsed.netloc)
 
-        self.session = session or requests.Session()
-        self.session.headers.update({'X-Api-Key': apikey})
+        self._headers = {'X-Api-Key': apikey}
+        self._lock = threading.Lock()
+        self._serialize = session is not None
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=self.POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self._executor = None
+        self._log_offsets = {}
+        self.hooks = list(hooks or [])
+        self.cache = cache
+        self.limiter = limiter
+        session.headers.update(self._headers)
 
         # Try a simple request to see if the API key works
         # Keep the info, in case we need it later
         self.version = self.version()
 
+    def _request(self, method, path, *, bypass=False, **kwargs):
+        '''
+        Perform HTTP request with given method on given path
+
+        Path shall be the ending part of the URL,
+        i.e. it should not be full URL
+
+        With bypass, the request does not wait for the limiter
+
+        Raises a RuntimeError when not 20x OK-ish
+
+        Returns the response
+        '''
+        url = urlparse.urljoin(self.url, path)
+        limited = self.limiter is not None and not bypass
+        if limited:
+            kind = self.limiter.kind(method)
+            self.limiter.acquire(self.url, kind)
+        elif not self.hooks:
+            return self._check_response(self._send(method, url, **kwargs))
+
+        start, clock = time.time(), time.perf_counter()
+        response = exception = None
+        try:
+            response = self._send(method, url, **kwargs)
+            return self._check_response(response)
+        except Exception as e:
+            exception = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - clock
+            status = response.status_code if response is not None else None
+            if limited:
+                # the time to send a file is not the server's latency
+                latency = None if self._uploads(kwargs) else elapsed
+                self.limiter.record(self.url, kind, latency, status)
+            if self.hooks:
+                self._emit(RequestEvent(
+                    url=self.url, method=method, path=path,
+                    endpoint=endpoint(path), start=start, elapsed=elapsed,
+                    request_bytes=self._body_size(response),
+                    response_bytes=self._content_size(response, kwargs),
+                    status=status, exception=exception))
+
+    def _send(self, method, url, **kwargs):
+        '''
+        Helper method for _request(), sends the request with the session
+
+        The own session is not locked, sending only reads its settings
+        and the cookie jar has a lock of its own
+        '''
+        if not self._serialize:
+            return self.session.request(method, url, **kwargs)
+        with self._lock:
+            return self.session.request(method, url, **kwargs)
+
+    def _emit(self, event):
+        for hook in self.hooks:
+            hook(event)
+
+    @classmethod
+    def _uploads(cls, kwargs):
+        '''
+        Whether the request sends files or a streamed body
+        '''
+        data = kwargs.get('data')
+        return bool(kwargs.get('files')) or not (
+            data is None or isinstance(data, (bytes, str, dict)))
+
+    @classmethod
+    def _body_size(cls, response):
+        body = response.request.body if response is not None else None
+        if not isinstance(body, (bytes, str)):
+            return 0  # no body or a streamed one
+        return len(body)
+
+    @classmethod
+    def _content_size(cls, response, kwargs):
+        if response is None:
+            return 0
+        if kwargs.get('stream'):
+            return int(response.headers.get('Content-Length') or 0)
+        return len(response.content)
+
     def _get(self, path, params=None):
         '''
         Perform HTTP GET on given path with the auth header
@@ -47,27 +192,72 @@ class OctoClient:
 
         Returns JSON decoded data
         '''
-        url = urlparse.urljoin(self.url, path)
-        response = self.session.get(url, params=params)
-        self._check_response(response)
+        if self._cacheable(path):
+            return json.loads(self._cached_get(path, params).decode('utf-8'))
+        return self._request('GET', path, params=params).json()
+
+    def _get_raw(self, path, params=None):
+        '''
+        Perform HTTP GET on given path with the auth header
+
+        Returns the raw response body (bytes)
+        '''
+        if self._cacheable(path):
+            return self._cached_get(path, params)
+        return self._request('GET', path, params=params).content
+
+    def _cacheable(self, path):
+        return self.cache is not None and path.startswith(self.CACHED)
+
+    def _invalidate(self, prefix):
+        '''
+        Drops cached resources starting with prefix, after changing them
+        '''
+        if self.cache is not None:
+            self.cache.clear(self.url, prefix)
+
+    def _cached_get(self, path, params=None):
+        '''
+        Helper method for _get() and _get_raw() with a cache,
+        returns the cached body if it is fresh or still valid,
+        fetches and caches it otherwise
+        '''
+        resource = path
+        if params:
+            resource += '?' + urlparse.urlencode(sorted(params.items()))
+        entry = self.cache.get(self.url, resource)
+        if entry is not None and entry.age() < self.cache.max_age:
+            return entry.body
 
-        return response.json()
+        headers = {}
+        if entry is not None and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        response = self._request('GET', path, params=params, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            self.cache.touch(self.url, resource)
+            return entry.body
+        return self.cache.put(self.url, resource, response.content,
+                              response.headers.get('ETag'),
+                              response.headers.get('Last-Modified')).body
 
-    def _post(self, path, data=None, files=None, json=None, ret=True):
+    def _post(self, path, data=None, files=None, json=None, ret=True,
+              bypass=False):
         '''
         Perform HTTP POST on given path with the auth header
 
         Path shall be the ending part of the URL,
         i.e. it should not be full URL
 
+        With bypass, the request does not wait for the limiter
+
         Raises a RuntimeError when not 20x OK-ish
 
         Returns JSON decoded data
         '''
-        url = urlparse.urljoin(self.url, path)
-        response = self.session.post(url, data=data, files=files, json=json)
-        self._check_response(response)
-
+        response = self._request('POST', path, bypass=bypass,
+                                 data=data, files=files, json=json)
         if ret:
             return response.json()
 
@@ -82,19 +272,25 @@ class OctoClient:
 
         Returns nothing
         '''
-        url = urlparse.urljoin(self.url, path)
-        response = self.session.delete(url)
-        self._check_response(response)
+        self._request('DELETE', path)
 
     def _check_response(self, response):
         '''
         Make sure the response status code was 20x, raise otherwise
+
+        304 Not Modified passes too, only conditional requests get it
+
+        The raised RuntimeError has the response in its response attribute
         '''
+        if response.status_code == 304:
+            return response
         if not (200 <= response.status_code < 210):
             error = response.text
             msg = 'Reply for {} was not OK: {} ({})'
             msg = msg.format(response.url, error, response.status_code)
-            raise RuntimeError(msg)
+            error = RuntimeError(msg)
+            error.response = response
+            raise error
         return response
 
     def version(self):
@@ -108,7 +304,7 @@ class OctoClient:
             return 'local/' + location
         return location
 
-    def files(self, location=None):
+    def files(self, location=None, *, model=False):
         '''
         Retrieve information regarding all files currently available and
         regarding the disk space still available locally in the system
@@ -119,11 +315,21 @@ class OctoClient:
         system
 
         If location is a file, retrieves the selected file''s information
+
+        If model is True, returns a list of octoclient.models.FileEntry
+        (or one FileEntry if location is a file) instead of raw dicts
         '''
+        path = '/api/files'
         if location:
             location = self._prepend_local(location)
-            return self._get('/api/files/{}'.format(location))
-        return self._get('/api/files')
+            path = '/api/files/{}'.format(location)
+        if not model:
+            return self._get(path)
+        raw = self._get_raw(path)
+        document = json.loads(raw.decode('utf-8'))
+        if 'name' in document:  # a single file, not a listing
+            return FileEntry.parsed(raw, document)
+        return FileEntry.listing(raw, document)
 
     @contextmanager
     def _file_tuple(self, file):
@@ -147,19 +353,173 @@ class OctoClient:
             yield file + (mime,)
 
     def upload(self, file, *, location='local',
-               select=False, print=False, userdata=None):
+               select=False, print=False, userdata=None, minify=False):
         '''
         Upload a given file
         It can be a path or a tuple with a filename and a file-like object
+
+        minify: Optional, True or a Minifier instance to strip comments and
+        redundant data from the G-code while it is being uploaded,
+        pass an instance to read how many bytes were saved afterwards
         '''
         with self._file_tuple(file) as file_tuple:
-            files = {'file': file_tuple}
             data = {'select': str(select).lower(), 'print': str(print).lower()}
             if userdata:
                 data['userdata'] = userdata
+            path = '/api/files/{}'.format(location)
+            try:
+                if not minify:
+                    files = {'file': file_tuple}
+                    return self._post(path, files=files, data=data)
+
+                if minify is True:
+                    from .minify import Minifier
+                    minify = Minifier()
+                boundary = uuid.uuid4().hex
+                body = self._multipart(boundary, data, file_tuple,
+                                       minify.stream(file_tuple[1]))
+                headers = {'Content-Type': 'multipart/form-data; '
+                           'boundary={}'.format(boundary)}
+                return self._request('POST', path, data=body,
+                                     headers=headers).json()
+            finally:
+                self._invalidate('/api/files')
 
-            return self._post('/api/files/{}'.format(location),
-                              files=files, data=data)
+    @classmethod
+    def _multipart(cls, boundary, data, file_tuple, chunks):
+        '''
+        Helper method for upload(), generator of a multipart/form-data body
+        with given fields and a file streamed from chunks
+        '''
+        delimiter = '--{}\r\n'.format(boundary).encode('utf-8')
+        for name, value in data.items():
+            yield delimiter
+            yield ('Content-Disposition: form-data; name="{}"\r\n\r\n'
+                   '{}\r\n'.format(name, value)).encode('utf-8')
+        filename, _, mime = file_tuple
+        yield delimiter
+        yield ('Content-Disposition: form-data; name="file"; '
+               'filename="{}"\r\nContent-Type: {}\r\n\r\n'
+               .format(filename, mime)).encode('utf-8')
+        yield from chunks
+        yield '\r\n--{}--\r\n'.format(boundary).encode('utf-8')
+
+    def _download_source(self, location):
+        '''
+        Helper method for download()
+
+        Returns a tuple of the path to download from,
+        the expected size and SHA1 hash (None if unknown)
+        '''
+        if location.startswith(('/', 'http://', 'https://')):
+            parsed = urlparse.urlparse(location)
+            path = parsed.path + ('?' + parsed.query if parsed.query else '')
+            return path, None, None
+        entry = self.files(location)
+        download = entry.get('refs', {}).get('download')
+        if not download:
+            msg = 'File {} cannot be downloaded'
+            raise RuntimeError(msg.format(location))
+        path, _, _ = self._download_source(download)
+        return path, entry.get('size'), entry.get('hash')
+
+    def _throttle(self, started, transferred, rate):
+        if rate:
+            ahead = transferred / rate - (time.perf_counter() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def download(self, location, dest, *, rate=None, retries=3,
+                 chunk_size=64 * 1024):
+        '''
+        Download a file, streaming it to disk in chunks
+
+        Location is target/filename (defaults to local/filename),
+        or a download path or URL (e.g. of a timelapse), in that case the size
+        and hash are not known and cannot be verified.
+
+        Dest is the destination path or an existing directory.
+        The data is written to dest.part first, an interrupted download
+        is resumed from there with an HTTP Range request, either right away
+        (up to retries times) or by calling download() again.
+
+        rate: Optional, bandwidth cap in bytes per second.
+
+        The downloaded file is verified against the size and SHA1 hash
+        listed by files(), the partial file is removed and RuntimeError
+        raised when it does not match.
+
+        Returns the destination path.
+        '''
+        path, size, sha1 = self._download_source(location)
+        if os.path.isdir(dest):
+            name = urlparse.unquote(path.split('?')[0].rsplit('/', 1)[-1])
+            dest = os.path.join(dest, name)
+        part = dest + '.part'
+
+        for attempt in range(retries + 1):
+            try:
+                self._download_part(path, part, size, rate, chunk_size)
+                break
+            except requests.exceptions.RequestException:
+                if attempt == retries:
+                    raise
+
+        actual = os.path.getsize(part)
+        if size is not None and actual != size:
+            os.unlink(part)
+            msg = 'Downloaded {} has {} bytes instead of {}'
+            raise RuntimeError(msg.format(path, actual, size))
+        if sha1 is not None:
+            digest = hashlib.sha1()
+            with open(part, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            if digest.hexdigest() != sha1:
+                os.unlink(part)
+                msg = 'Downloaded {} does not match its hash'
+                raise RuntimeError(msg.format(path))
+        os.replace(part, dest)
+        return dest
+
+    def _download_part(self, path, part, size, rate, chunk_size):
+        '''
+        Helper method for download(), appends the missing data to part
+
+        When the size is not known, the server tells whether part is
+        complete: 416 with the length of part in Content-Range means it is,
+        a 200 response instead of 206 means the download starts over.
+        '''
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if size is not None and offset > size:
+            offset = 0  # cannot resume safely
+        if size is not None and offset == size:
+            return
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        try:
+            response = self._request('GET', path, headers=headers,
+                                     stream=True)
+        except RuntimeError as error:
+            response = getattr(error, 'response', None)
+            if not offset or response is None or \
+                    response.status_code != 416:
+                raise
+            length = response.headers.get('Content-Range', '')
+            if length.rsplit('/', 1)[-1] == str(offset):
+                return  # part is complete
+            offset = 0  # part does not match the file, start over
+            response = self._request('GET', path, stream=True)
+        with response:
+            if response.status_code != 206:
+                offset = 0  # the whole file is coming
+            with open(part, 'r+b' if offset else 'wb') as f:
+                f.seek(offset)
+                f.truncate()
+                started, transferred = time.perf_counter(), 0
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+                    transferred += len(chunk)
+                    self._throttle(started, transferred, rate)
 
     def delete(self, location):
         '''
@@ -168,7 +528,10 @@ class OctoClient:
         Location is target/filename, defaults to local/filename
         '''
         location = self._prepend_local(location)
-        self._delete('/api/files/{}'.format(location))
+        try:
+            self._delete('/api/files/{}'.format(location))
+        finally:
+            self._invalidate('/api/files')
 
     def select(self, location, *, print=False):
         '''
@@ -196,7 +559,10 @@ class OctoClient:
         '''
         A shortcut to get the current state.
         '''
-        return self.connection_info()['current']['state']
+        # only the current member is parsed, not the lists of options
+        info = ConnectionInfo(self._get_raw('/api/connection'))
+        current = info.member('current')
+        return current.get('state') if isinstance(current, dict) else None
 
     def connect(self, *, port=None, baudrate=None,
                 printer_profile=None, save=None, autoconnect=None):
@@ -253,10 +619,14 @@ class OctoClient:
         data = {'command': 'fake_ack'}
         self._post('/api/connection', json=data, ret=False)
 
-    def job_info(self):
+    def job_info(self, *, model=False):
         '''
         Retrieve information about the current job (if there is one)
+
+        If model is True, returns octoclient.models.JobInfo
         '''
+        if model:
+            return JobInfo(self._get_raw('/api/job'))
         return self._get('/api/job')
 
     def print(self):
@@ -275,7 +645,7 @@ class OctoClient:
         There must be an active print job for this to work
         '''
         data = {'command': 'pause'}
-        self._post('/api/job', json=data, ret=False)
+        self._post('/api/job', json=data, ret=False, bypass=True)
 
     def restart(self):
         '''
@@ -294,7 +664,7 @@ class OctoClient:
         There must be an active print job for this to work
         '''
         data = {'command': 'cancel'}
-        self._post('/api/job', json=data, ret=False)
+        self._post('/api/job', json=data, ret=False, bypass=True)
 
     def logs(self):
         '''
@@ -310,9 +680,77 @@ class OctoClient:
         '''
         self._delete('/api/logs/{}'.format(filename))
 
+    def _log_size(self, name):
+        for log in self.logs()['files']:
+            if log['name'] == name:
+                return log['size']
+        return None
+
+    def tail_log(self, name, *, follow=True, interval=1.0, offset=None,
+                 chunk_size=64 * 1024, max_line=64 * 1024):
+        '''
+        Generator yielding lines (without line endings) of the log file
+        with name name, fetching only the new bytes with Range requests
+
+        The offset of the last yielded line is remembered per log name,
+        so the next call continues where the previous one stopped,
+        pass offset to start elsewhere (e.g. 0 for the beginning).
+
+        If follow is True, the log is polled for new data every interval
+        seconds forever, otherwise the generator stops at the end of it.
+        A last line without a newline is not yielded (and its bytes are
+        read again next time) until the line is completed.
+        When the log gets smaller than the offset (rotated or truncated),
+        it is read again from the beginning.
+
+        Lines longer than max_line bytes are split, to keep memory bounded.
+        '''
+        path = '/downloads/logs/{}'.format(urlparse.quote(name))
+        if offset is None:
+            offset = self._log_offsets.get(name, 0)
+        pending = b''
+        while True:
+            size = self._log_size(name)
+            if size is not None and size < offset + len(pending):
+                offset, pending = 0, b''  # rotated or truncated
+            if size is None or size > offset + len(pending):
+                start = offset + len(pending)
+                headers = {}
+                if start:
+                    headers['Range'] = 'bytes={}-'.format(start)
+                response = self._request('GET', path, headers=headers,
+                                         stream=True)
+                with response:
+                    skip = start if response.status_code != 206 else 0
+                    for chunk in response.iter_content(chunk_size):
+                        if skip:
+                            # the server ignored Range
+                            dropped = min(skip, len(chunk))
+                            chunk, skip = chunk[dropped:], skip - dropped
+                        lines = (pending + chunk).split(b'\n')
+                        pending = lines.pop()
+                        for line in lines:
+                            offset += len(line) + 1
+                            self._log_offsets[name] = offset
+                            yield self._log_line(line)
+                        if len(pending) > max_line:
+                            offset += len(pending)
+                            self._log_offsets[name] = offset
+                            yield self._log_line(pending)
+                            pending = b''
+            if not follow:
+                break
+            time.sleep(interval)
+
+    @classmethod
+    def _log_line(cls, line):
+        return line.rstrip(b'\r').decode('utf-8', 'replace')
+
     def _hwinfo(self, url, **kwargs):
         '''
         Helper method for printer(), tool(), bed() and sd()
+
+        If model is given, returns it wrapping the raw response
         '''
         params = {}
         if kwargs.get('exclude'):
@@ -321,9 +759,12 @@ class OctoClient:
             params['history'] = 'true'
         if kwargs.get('limit'):
             params['limit'] = kwargs['limit']
+        if kwargs.get('model'):
+            return kwargs['model'](self._get_raw(url, params=params))
         return self._get(url, params=params)
 
-    def printer(self, *, exclude=None, history=False, limit=None):
+    def printer(self, *, exclude=None, history=False, limit=None,
+                model=False):
         '''
         Retrieves the current state of the printer
 
@@ -340,9 +781,165 @@ class OctoClient:
 
         Clients can specify a list of attributes to not return in the response
         (e.g. if they don't need it) via the exclude argument.
+
+        If model is True, returns octoclient.models.PrinterState
         '''
         return self._hwinfo('/api/printer', exclude=exclude,
-                            history=history, limit=limit)
+                            history=history, limit=limit,
+                            model=PrinterState if model else None)
+
+    def _gather(self, calls):
+        '''
+        Helper method for snapshot()
+
+        Calls all the callables from the given dict concurrently,
+        returns a dict with the same keys and the results as values
+        '''
+        if len(calls) < 2:
+            return {key: call() for key, call in calls.items()}
+        futures = {key: self.executor.submit(call)
+                   for key, call in calls.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+    @property
+    def executor(self):
+        '''
+        Thread pool of the client for concurrent requests,
+        created on first use and kept until close()
+        '''
+        with self._lock:
+            if self._executor is None:
+                # job, connection and printer at once, see snapshot()
+                self._executor = ThreadPoolExecutor(
+                    max_workers=3, thread_name_prefix='octoclient')
+            return self._executor
+
+    def close(self):
+        '''
+        Stops the thread pool and closes the connections of the client
+        '''
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+        self.session.close()
+
+    def snapshot(self, parts=None):
+        '''
+        Retrieves the current job, printer and connection state at once
+
+        All the needed requests are issued concurrently, the printer parts
+        are retrieved with one request excluding the parts not asked for.
+
+        parts: Optional, a list of parts to retrieve, valid values are one or
+        more of 'job', 'connection', 'sd', 'temperature' and 'state'.
+        Defaults to all.
+
+        Returns one dict with the requested parts as keys
+        (the 'job' and 'connection' values are the same as returned by
+        job_info() and connection_info()) and a 'timestamp' key with the
+        time.time() value from just before the requests were issued.
+
+        When the printer is not operational (OctoPrint answers 409 for its
+        printer parts), the other parts are returned as usual, 'state' is
+        made up from the connection state (with OFFLINE_FLAGS) and
+        'sd' and 'temperature' are None.
+        '''
+        parts = set(parts or self.SNAPSHOT_PARTS)
+        unknown = parts - set(self.SNAPSHOT_PARTS)
+        if unknown:
+            msg = 'Unknown snapshot parts: {}'
+            raise ValueError(msg.format(', '.join(sorted(unknown))))
+
+        calls = {}
+        if 'job' in parts:
+            calls['job'] = self.job_info
+        if 'connection' in parts:
+            calls['connection'] = self.connection_info
+        exclude = [p for p in self.PRINTER_PARTS if p not in parts]
+        if len(exclude) < len(self.PRINTER_PARTS):
+            calls['printer'] = lambda: self._printer_parts(exclude)
+
+        snapshot = {'timestamp': time.time()}
+        results = self._gather(calls)
+        printer = results.pop('printer', {})
+        if printer is None:
+            printer = self._offline_parts(parts, results.get('connection'))
+        snapshot.update(printer)
+        snapshot.update(results)
+        return snapshot
+
+    def _printer_parts(self, exclude):
+        '''
+        Helper method for snapshot(), printer() or None
+        when the printer is not operational (409 Conflict)
+        '''
+        try:
+            return self.printer(exclude=exclude)
+        except RuntimeError as e:
+            response = getattr(e, 'response', None)
+            if response is not None and response.status_code == 409:
+                return None
+            raise
+
+    def _offline_parts(self, parts, connection):
+        '''
+        Helper method for snapshot(), the printer parts of a printer
+        that is not operational: the state as reported by the connection
+        (retrieved if not given), None for the other parts
+        '''
+        offline = {p: None for p in self.PRINTER_PARTS if p in parts}
+        if 'state' in parts:
+            if connection is None:
+                connection = self.connection_info()
+            text = (connection.get('current') or {}).get('state')
+            offline['state'] = {
+                'text': text or 'Offline',
+                'flags': dict(self.OFFLINE_FLAGS,
+                              error=bool(text and text.startswith('Error'))),
+            }
+        return offline
+
+    def fetch(self, fields):
+        '''
+        Retrieves only the given fields, with as few requests as possible
+
+        fields: A list of dotted paths, e.g. 'state.text',
+        'temperature.tool0.actual' or 'progress.completion'.
+        The first component is one of the sections of printer()
+        ('state', 'temperature', 'sd'), of job_info() ('job', 'progress')
+        or 'connection' for connection_info().
+
+        The minimal set of endpoints is requested concurrently, with the
+        unneeded printer sections excluded (see snapshot()).
+
+        Returns a dict mapping the fields to their values,
+        None for fields not present in the responses.
+        '''
+        paths = {}
+        for field in fields:
+            root = field.split('.')[0]
+            if root not in self.FETCH_ROOTS:
+                raise ValueError('Unknown field: {}'.format(field))
+            paths[field] = field.split('.')
+        if not paths:
+            return {}  # snapshot() would fetch all the parts
+
+        snapshot = self.snapshot({self.FETCH_ROOTS[p[0]]
+                                  for p in paths.values()})
+        values = {}
+        for field, path in paths.items():
+            if self.FETCH_ROOTS[path[0]] == 'job':
+                value = snapshot['job']
+            else:
+                value = snapshot
+                if path[0] == 'connection':
+                    path = path[1:]
+                    value = snapshot['connection']
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            values[field] = value
+        return values
 
     def tool(self, *, history=False, limit=None):
         '''
@@ -595,6 +1192,46 @@ class OctoClient:
         http://docs.octoprint.org/en/master/configuration/config_yaml.html#config-yaml
         '''
         if settings:
-            return self._post('/api/settings', json=settings, ret=True)
+            try:
+                return self._post('/api/settings', json=settings, ret=True)
+            finally:
+                self._invalidate('/api/settings')
         else:
             return self._get('/api/settings')
+
+    @classmethod
+    def _settings_patch(cls, current, desired):
+        '''
+        The smallest partial settings tree that turns current into desired
+
+        Only dicts are descended into, lists and other values
+        are compared as a whole
+        '''
+        patch = {}
+        for key, value in desired.items():
+            old = current.get(key)
+            if isinstance(value, dict) and isinstance(old, dict):
+                sub = cls._settings_patch(old, value)
+                if sub:
+                    patch[key] = sub
+            elif key not in current or old != value:
+                patch[key] = value
+        return patch
+
+    def apply_settings(self, desired, *, dry_run=False):
+        '''
+        Makes the printer settings match desired (a full or partial tree)
+
+        Only the settings that differ from the current ones are posted,
+        nothing at all if the printer already complies. The current
+        settings come from the cache, if there is one.
+
+        dry_run: Optional, only computes what would be posted
+
+        Returns the partial tree that was (or would be) posted,
+        an empty dict if nothing was
+        '''
+        patch = self._settings_patch(self.settings(), desired)
+        if patch and not dry_run:
+            self.settings(patch)
+        return patch
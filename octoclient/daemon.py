@@ -0,0 +1,238 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from .client import OctoClient
+
+
+def status_from_snapshot(snapshot):
+    '''
+    Makes a status row (as returned by Daemon.status()) from
+    OctoClient.snapshot(['job', 'state', 'temperature'])
+    '''
+    temperature = snapshot.get('temperature') or {}
+    return {
+        'state': snapshot['state']['text'],
+        'progress': snapshot['job']['progress']['completion'],
+        'file': (snapshot['job']['job'].get('file') or {}).get('name'),
+        'temperature': {k: {'actual': v.get('actual'),
+                            'target': v.get('target')}
+                        for k, v in temperature.items()
+                        if isinstance(v, dict)},
+        'timestamp': snapshot['timestamp'],
+        'source': 'rest',
+    }
+
+
+def status_from_current(current, timestamp):
+    '''
+    Makes a status row (as returned by Daemon.status()) from the value
+    of a current push message received at given time
+    '''
+    temps = current.get('temps') or [{}]
+    return {
+        'state': current['state']['text'],
+        'progress': (current.get('progress') or {}).get('completion'),
+        'file': ((current.get('job') or {}).get('file') or {}).get('name'),
+        'temperature': {k: {'actual': v.get('actual'),
+                            'target': v.get('target')}
+                        for k, v in temps[-1].items()
+                        if isinstance(v, dict)},
+        'timestamp': timestamp,
+        'source': 'push',
+    }
+
+
+def _listening(socket_path):
+    '''
+    Whether something accepts connections on the Unix socket on given path
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+    return True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            request = {}
+            try:
+                request = json.loads(line.decode('utf-8'))
+                reply = {'result': self.server.owner.handle(request)}
+            except Exception as e:
+                reply = {'error': str(e)}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+            if request.get('command') == 'stop':
+                threading.Thread(target=self.server.shutdown).start()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Daemon:
+    '''
+    Long-lived process holding warm OctoClient instances (and optionally
+    push streams) for configured printers, serving requests of the
+    octoclient command over a Unix socket
+
+    printers is a dict mapping printer names to (url, apikey) tuples
+
+    The protocol is one JSON object per line in both directions,
+    requests have a 'command' key ('status', 'job', 'printers' or 'stop')
+    and optionally a 'printers' key with a list of names (defaults to all),
+    replies have either a 'result' or an 'error' key.
+    '''
+
+    def __init__(self, printers, socket_path, *, push=True, max_age=10):
+        '''
+        If push is True, a WebSocketEventHandler is kept open for every
+        printer and status is served from the last current push message,
+        as long as it is not older than max_age seconds
+        '''
+        self.printers = dict(printers)
+        self.socket_path = socket_path
+        self.push = push
+        self.max_age = max_age
+        self.clients = {}
+        # one pool for the lifetime of the daemon, the clients keep
+        # their connections warm across requests
+        self.executor = ThreadPoolExecutor(max_workers=16)
+        self.handlers = {}
+        self.current = {}  # name -> (current message, time received)
+        self._lock = threading.Lock()
+        self.server = None
+
+    def client(self, name):
+        '''
+        Returns a (cached) OctoClient for the printer with given name
+        '''
+        with self._lock:
+            client = self.clients.get(name)
+        if client is None:
+            url, apikey = self.printers[name]
+            client = OctoClient(url=url, apikey=apikey)
+            with self._lock:
+                client = self.clients.setdefault(name, client)
+        return client
+
+    def _on_message(self, name):
+        def on_message(api, message):
+            if 'current' in message:
+                with self._lock:
+                    self.current[name] = (message['current'], time.time())
+        return on_message
+
+    def _start_push(self):
+        from .websocket import WebSocketEventHandler
+        for name, (url, _) in self.printers.items():
+            handler = WebSocketEventHandler(
+                url, on_message=self._on_message(name))
+            handler.run()
+            self.handlers[name] = handler
+
+    def _names(self, names):
+        names = names or sorted(self.printers)
+        unknown = [n for n in names if n not in self.printers]
+        if unknown:
+            raise ValueError('Unknown printers: {}'.format(', '.join(unknown)))
+        return names
+
+    def _fleet_map(self, names, function):
+        '''
+        Calls function with the client of every named printer concurrently,
+        returns a dict mapping names to results or {'error': message}
+        '''
+        def call(name):
+            try:
+                return function(self.client(name))
+            except Exception as e:
+                return {'error': str(e)}
+
+        if not names:
+            return {}
+        return dict(zip(names, self.executor.map(call, names)))
+
+    def status(self, names=None):
+        '''
+        Returns a dict mapping printer names to status rows
+        '''
+        names = self._names(names)
+        rows, missing = {}, []
+        now = time.time()
+        with self._lock:
+            for name in names:
+                current, received = self.current.get(name, (None, 0))
+                if current is not None and now - received <= self.max_age:
+                    rows[name] = status_from_current(current, received)
+                else:
+                    missing.append(name)
+        rows.update(self._fleet_map(missing, lambda c: status_from_snapshot(
+            c.snapshot(['job', 'state', 'temperature']))))
+        return rows
+
+    def handle(self, request):
+        '''
+        Handles one decoded request, returns the result
+        '''
+        command = request.get('command')
+        names = request.get('printers')
+        if command == 'status':
+            return self.status(names)
+        if command == 'job':
+            return self._fleet_map(self._names(names),
+                                   lambda c: c.job_info())
+        if command == 'printers':
+            return {n: u for n, (u, _) in sorted(self.printers.items())}
+        if command == 'stop':
+            return 'stopping'
+        raise ValueError('Unknown command: {}'.format(command))
+
+    def serve_forever(self):
+        '''
+        Binds the Unix socket and serves requests until stopped
+
+        Raises RuntimeError if another daemon is listening on the socket,
+        a stale socket file (of a daemon that died) is replaced
+        '''
+        if os.path.exists(self.socket_path):
+            if _listening(self.socket_path):
+                raise RuntimeError('A daemon is already running on {}'.format(
+                    self.socket_path))
+            os.unlink(self.socket_path)
+        self.server = _Server(self.socket_path, _Handler)
+        self.server.owner = self
+        os.chmod(self.socket_path, 0o600)
+        bound = os.stat(self.socket_path)
+        if self.push:
+            self._start_push()
+        try:
+            self.server.serve_forever(poll_interval=0.1)
+        finally:
+            for handler in self.handlers.values():
+                # not every handler can be closed (e.g. WebSocketEventHandler)
+                close = getattr(handler, 'close', None)
+                if close is not None:
+                    close()
+            self.server.server_close()
+            self.executor.shutdown()
+            for client in self.clients.values():
+                client.close()
+            # only our own socket, another daemon may have replaced it
+            try:
+                if os.path.samestat(os.stat(self.socket_path), bound):
+                    os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
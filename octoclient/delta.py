@@ -0,0 +1,164 @@
+'''
+Change detection for push messages
+
+OctoPrint sends the whole current document on every tick, even when
+nothing changed. DeltaTracker keeps the last document of every printer and
+reports only the paths that changed, e.g. {'state.text': 'Printing'}.
+'''
+import threading
+
+
+_MISSING = object()
+
+
+def _leaves(value, path, changes):
+    '''
+    Adds all the leaves of value (under path) to changes
+    '''
+    if isinstance(value, dict) and value:
+        for key, item in value.items():
+            _leaves(item, '{}.{}'.format(path, key), changes)
+    else:
+        changes[path] = value
+
+
+def diff(old, new, prefix='', removed=None):
+    '''
+    Returns a dict mapping dotted paths of the leaves that differ
+    between the two documents to their new values
+    (removed, None by default, for removed ones)
+
+    Equal subtrees are skipped with one comparison, so unchanged parts
+    of a document cost next to nothing. Lists are compared as a whole.
+    '''
+    changes = {}
+    _diff(old, new, prefix, changes, removed)
+    return changes
+
+
+def _diff(old, new, prefix, changes, removed):
+    for key, value in new.items():
+        previous = old.get(key, _MISSING)
+        if previous is value or previous == value:
+            continue
+        path = prefix + key
+        if isinstance(value, dict) and isinstance(previous, dict):
+            _diff(previous, value, path + '.', changes, removed)
+        else:
+            if isinstance(previous, dict):
+                leaves = {}
+                _leaves(previous, path, leaves)
+                changes.update(dict.fromkeys(leaves, removed))
+            _leaves(value, path, changes)
+    for key in old.keys() - new.keys():
+        leaves = {}
+        _leaves(old[key], prefix + key, leaves)
+        changes.update(dict.fromkeys(leaves, removed))
+
+
+class DeltaTracker:
+    '''
+    Keeps the last current document of every printer
+    and reports what changed in the next one
+
+    ignore is a collection of paths (and their subpaths) that are not
+    reported, serverTime by default, because it changes every time.
+
+    Callbacks subscribed to paths get the changes under them only,
+    see subscribe().
+
+    removed is the value reported for removed paths, None by default,
+    pass a sentinel to tell them apart from paths that became None.
+    '''
+
+    def __init__(self, ignore=('serverTime',), removed=None):
+        self.ignore = frozenset(ignore)
+        self.removed = removed
+        self.last = {}  # printer -> last current document
+        self._subscribers = {}  # path -> list of callbacks, '' for all
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _prefixes(path):
+        '''
+        Yields '' and all the prefixes of path, including itself
+        '''
+        yield ''
+        start = 0
+        while True:
+            end = path.find('.', start)
+            if end < 0:
+                yield path
+                return
+            yield path[:end]
+            start = end + 1
+
+    def _ignored(self, path):
+        return any(p in self.ignore for p in self._prefixes(path))
+
+    def update(self, printer, current):
+        '''
+        Records the current document of given printer (name or URL)
+
+        Returns the changes as a dict of dotted paths to the new values,
+        everything is a change for the first document of a printer.
+        Subscribed callbacks are called with the printer and the changes
+        they subscribed to, if there are any.
+        '''
+        with self._lock:
+            old = self.last.get(printer, {})
+            self.last[printer] = current
+        changes = diff(old, current, removed=self.removed)
+        if self.ignore:
+            changes = {path: value for path, value in changes.items()
+                       if not self._ignored(path)}
+        if changes and self._subscribers:
+            self._notify(printer, changes)
+        return changes
+
+    def _notify(self, printer, changes):
+        with self._lock:
+            subscribers = {k: list(v) for k, v in self._subscribers.items()}
+        selected = {}  # callback -> its changes
+        for path, value in changes.items():
+            for prefix in self._prefixes(path):
+                for callback in subscribers.get(prefix, ()):
+                    selected.setdefault(callback, {})[path] = value
+        for callback, subset in selected.items():
+            callback(printer, subset)
+
+    def subscribe(self, callback, paths=None):
+        '''
+        Calls callback(printer, changes) whenever any of given paths
+        (or anything under them) changes, with those changes only
+
+        Without paths, the callback gets all the changes.
+        '''
+        with self._lock:
+            for path in paths or ('',):
+                self._subscribers.setdefault(path, []).append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            for callbacks in self._subscribers.values():
+                while callback in callbacks:
+                    callbacks.remove(callback)
+
+    def on_message(self, printer):
+        '''
+        Returns an on_message callback for a push event handler,
+        tracking the current messages of given printer
+        '''
+        def on_message(api, message):
+            if 'current' in message:
+                self.update(printer, message['current'])
+        return on_message
+
+    def forget(self, printer):
+        '''
+        Drops the last document of a printer, e.g. after a reconnect,
+        the next one is reported whole again
+        '''
+        with self._lock:
+            self.last.pop(printer, None)
@@ -0,0 +1,116 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+from urllib import parse as urlparse
+
+
+class Fleet:
+    '''
+    Encapsulates communication with several OctoPrint instances at once
+    '''
+
+    def __init__(self, clients, *, max_workers=16):
+        '''
+        Initialize the object with an iterable of OctoClient instances
+
+        max_workers limits the number of printers talked to concurrently
+        '''
+        self.clients = list(clients)
+        self.max_workers = max_workers
+
+    def _map(self, function, clients=None):
+        '''
+        Calls function with every client concurrently
+
+        Returns a dict mapping the client URLs to tuples of the result
+        and the exception (one of them is always None)
+        '''
+        clients = self.clients if clients is None else clients
+
+        def call(client):
+            try:
+                return function(client), None
+            except Exception as e:
+                return None, e
+
+        if not clients:
+            return {}
+        workers = min(len(clients), self.max_workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(call, clients)
+            return {c.url: r for c, r in zip(clients, results)}
+
+    def snapshot(self, parts=None):
+        '''
+        Retrieves OctoClient.snapshot() of all the printers concurrently
+
+        Returns a table as a dict mapping printer URLs to the snapshots,
+        a printer that failed to respond gets a dict with the 'timestamp'
+        and 'error' (the error message) keys instead
+        '''
+        table = {}
+        for url, (result, error) in self._map(
+                lambda c: c.snapshot(parts)).items():
+            if error is not None:
+                result = {'timestamp': time.time(), 'error': str(error)}
+            table[url] = result
+        return table
+
+    def download(self, location, directory, *, rate=None):
+        '''
+        Downloads the same file from all the printers concurrently,
+        see OctoClient.download()
+
+        Every printer gets its own subdirectory of directory,
+        named after its host (and port)
+
+        rate: Optional, bandwidth cap in bytes per second for each printer
+
+        Returns a dict mapping printer URLs to the downloaded paths,
+        or to the exceptions raised for printers that failed
+        '''
+        def download(client):
+            subdir = os.path.join(directory,
+                                  urlparse.urlparse(client.url).netloc)
+            os.makedirs(subdir, exist_ok=True)
+            return client.download(location, subdir, rate=rate)
+
+        return {url: result if error is None else error
+                for url, (result, error) in self._map(download).items()}
+
+    def apply_settings(self, desired, *, canary=1, dry_run=False):
+        '''
+        Rolls OctoClient.apply_settings() out to all the printers
+
+        The first canary printers are updated first and checked to
+        comply afterwards, the rest is only updated concurrently if all
+        of them do. Printers already complying are not posted to.
+
+        dry_run: Optional, only computes what would be posted
+
+        Returns a dict mapping printer URLs to the posted partial trees
+        (empty for printers that complied already), to the exceptions
+        raised for printers that failed, or to None for printers skipped
+        because the canary stage failed
+        '''
+        def apply(client):
+            patch = client.apply_settings(desired, dry_run=dry_run)
+            if patch and not dry_run and client in canaries:
+                left = client.apply_settings(desired, dry_run=True)
+                if left:
+                    msg = 'Settings not applied on {}: {}'
+                    raise RuntimeError(msg.format(client.url, left))
+            return patch
+
+        canaries = self.clients[:canary]
+        results = {url: result if error is None else error
+                   for url, (result, error)
+                   in self._map(apply, canaries).items()}
+        rest = self.clients[canary:]
+        if any(isinstance(r, Exception) for r in results.values()):
+            results.update((client.url, None) for client in rest)
+        else:
+            results.update(
+                (url, result if error is None else error)
+                for url, (result, error) in self._map(apply, rest).items())
+        return results
@@ -0,0 +1,330 @@
+'''
+Push ingest of a large fleet sharded across processes
+
+Decoding the push streams of hundreds of printers does not fit in one
+process because of the GIL. FleetRunner spreads the printers over worker
+processes, every worker runs the push connections of its shard, reduces
+the current messages to changes (see octoclient.delta) and sends them
+to the parent in batches over a pipe, coalesced per printer.
+'''
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import queue
+import threading
+
+from .delta import DeltaTracker
+
+
+CHANGES = 'changes'
+EVENT = 'event'
+OPEN = 'open'
+CLOSE = 'close'
+
+
+class _Removed:
+    '''
+    Type of REMOVED, stays the same object when pickled
+    '''
+
+    def __repr__(self):
+        return 'REMOVED'
+
+    def __reduce__(self):
+        return 'REMOVED'
+
+
+# the value of removed paths in changes, None is a value like any other
+REMOVED = _Removed()
+
+
+def auto_handler(url, on_open, on_close, on_message):
+    '''
+    Default handler factory of FleetRunner, an AutoEventHandler
+    '''
+    from .transport import AutoEventHandler
+    return AutoEventHandler(url, on_open=on_open, on_close=on_close,
+                            on_message=on_message)
+
+
+class _Shard:
+    '''
+    State of a worker process: handlers of its printers
+    and the updates not sent yet
+    '''
+
+    def __init__(self, handler_factory):
+        self.handler_factory = handler_factory
+        self.handlers = {}
+        self.tracker = DeltaTracker(removed=REMOVED)
+        self.changes = {}  # url -> coalesced changes
+        self.updates = []  # (url, kind, payload), in order
+        self.lock = threading.Lock()
+
+    def add(self, url):
+        if url in self.handlers:
+            return
+
+        def on_open(api):
+            self._update(url, OPEN, None)
+
+        def on_close(api):
+            self._update(url, CLOSE, None)
+
+        def on_message(api, message):
+            if url not in self.handlers:
+                return  # removed, but the connection is still winding down
+            if 'current' in message:
+                changes = self.tracker.update(url, message['current'])
+                if changes:
+                    with self.lock:
+                        if url not in self.changes:
+                            # keeps the order relative to the other updates
+                            self.changes[url] = {}
+                            self.updates.append((url, CHANGES,
+                                                 self.changes[url]))
+                        self.changes[url].update(changes)
+            elif 'event' in message:
+                self._update(url, EVENT, message['event'])
+
+        handler = self.handler_factory(url, on_open, on_close, on_message)
+        self.handlers[url] = handler
+        handler.run()
+
+    def remove(self, url):
+        handler = self.handlers.pop(url, None)
+        # not every handler can be closed (e.g. WebSocketEventHandler),
+        # their messages are ignored until the connection ends
+        close = getattr(handler, 'close', None)
+        if close is not None:
+            close()
+        self.tracker.forget(url)
+
+    def _update(self, url, kind, payload):
+        if url in self.handlers:
+            with self.lock:
+                self.updates.append((url, kind, payload))
+
+    def take(self):
+        with self.lock:
+            updates, self.updates, self.changes = self.updates, [], {}
+        return updates
+
+    def close(self):
+        for url in list(self.handlers):
+            self.remove(url)
+
+
+def _worker(connection, handler_factory, flush_interval):
+    '''
+    Main function of a worker process
+
+    Reads ('add', url), ('remove', url) and ('stop', None) commands
+    from connection and sends lists of updates back
+    '''
+    shard = _Shard(handler_factory)
+    try:
+        while True:
+            if connection.poll(flush_interval):
+                command, url = connection.recv()
+                if command == 'add':
+                    shard.add(url)
+                elif command == 'remove':
+                    shard.remove(url)
+                else:
+                    break
+            updates = shard.take()
+            if updates:
+                connection.send(updates)
+    except (EOFError, KeyboardInterrupt):
+        pass  # the parent is gone
+    finally:
+        shard.close()
+        connection.close()
+
+
+class FleetRunner:
+    '''
+    Runs the push connections of many printers in worker processes
+
+    urls - printers to start with, more can be add()ed and remove()d later,
+           the shards are rebalanced to differ by one printer at most
+    processes - number of worker processes, defaults to the CPU count
+    callback - called as callback(url, kind, payload) in a thread of the
+               parent for every update, kind is one of:
+               'changes' - payload is a dict of changed dotted paths of the
+                           current document to the new values (REMOVED
+                           for removed paths), all the changes since the
+                           last batch of the worker
+               'event' - payload is the event (type and payload)
+               'open', 'close' - the push connection opened or closed
+               without a callback, iterate over updates() instead
+    flush_interval - seconds a worker collects updates before sending them
+    handler_factory - picklable callable taking url, on_open, on_close and
+                      on_message, returning a push event handler that is
+                      not running yet, auto_handler() by default,
+                      the handler is closed on removal if it has close()
+    context - multiprocessing start method, spawn by default, because
+              forking a process with threads is not safe
+
+    The merged current documents (as flat dicts of dotted paths) are in
+    the current attribute, kept up to date by the updates.
+    '''
+
+    def __init__(self, urls=(), *, processes=None, callback=None,
+                 flush_interval=0.1, handler_factory=auto_handler,
+                 context='spawn'):
+        self.processes = processes or os.cpu_count() or 1
+        self.callback = callback
+        self.flush_interval = flush_interval
+        self.handler_factory = handler_factory
+        self.context = multiprocessing.get_context(context)
+        self.shards = [set() for _ in range(self.processes)]
+        self.assignment = {}  # url -> shard index
+        self.current = {}  # url -> flat current document
+        self.workers = []
+        self.connections = []
+        self.thread = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        for url in urls:
+            self.add(url)
+
+    def start(self):
+        '''
+        Starts the worker processes and the thread reading their updates
+        '''
+        for shard in self.shards:
+            parent, child = self.context.Pipe()
+            worker = self.context.Process(
+                target=_worker, daemon=True,
+                args=(child, self.handler_factory, self.flush_interval))
+            worker.start()
+            child.close()
+            self.workers.append(worker)
+            self.connections.append(parent)
+            for url in shard:
+                parent.send(('add', url))
+        self.thread = threading.Thread(target=self._read)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def _send(self, index, command, url=None):
+        if self.connections:
+            self.connections[index].send((command, url))
+
+    def add(self, url):
+        '''
+        Adds a printer to the smallest shard
+        '''
+        with self._lock:
+            if url in self.assignment:
+                return
+            index = min(range(self.processes),
+                        key=lambda i: len(self.shards[i]))
+            self.shards[index].add(url)
+            self.assignment[url] = index
+            self._send(index, 'add', url)
+
+    def remove(self, url):
+        '''
+        Removes a printer and rebalances the shards
+        '''
+        with self._lock:
+            index = self.assignment.pop(url, None)
+            if index is None:
+                return
+            self.shards[index].discard(url)
+            self.current.pop(url, None)
+            self._send(index, 'remove', url)
+            self._rebalance()
+
+    def _rebalance(self):
+        '''
+        Moves printers from the largest shards to the smallest ones
+        until they differ by one at most
+        '''
+        while True:
+            sizes = [len(s) for s in self.shards]
+            largest = sizes.index(max(sizes))
+            smallest = sizes.index(min(sizes))
+            if sizes[largest] - sizes[smallest] <= 1:
+                return
+            url = next(iter(self.shards[largest]))
+            self.shards[largest].discard(url)
+            self.shards[smallest].add(url)
+            self.assignment[url] = smallest
+            self._send(largest, 'remove', url)
+            self._send(smallest, 'add', url)
+
+    def _read(self):
+        connections = list(self.connections)
+        while connections:
+            for connection in wait(connections):
+                try:
+                    updates = connection.recv()
+                except (EOFError, OSError):
+                    connections.remove(connection)
+                    continue
+                for update in updates:
+                    self._deliver(*update)
+
+    def _deliver(self, url, kind, payload):
+        with self._lock:
+            if url not in self.assignment:
+                return
+            if kind == CHANGES:
+                current = self.current.setdefault(url, {})
+                for path, value in payload.items():
+                    if value is REMOVED:
+                        current.pop(path, None)
+                    else:
+                        current[path] = value
+        if self.callback is not None:
+            self.callback(url, kind, payload)
+        else:
+            self._queue.put((url, kind, payload))
+
+    def updates(self, timeout=None):
+        '''
+        Generator yielding (url, kind, payload) updates, see callback
+
+        Ends when no update came for timeout seconds (never by default)
+        or once the runner is stopped and all the updates were read
+        '''
+        while True:
+            try:
+                update = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                return
+            if update is None:
+                return
+            yield update
+
+    def stop(self, timeout=5):
+        '''
+        Stops the workers, closing all the push connections
+        '''
+        with self._lock:
+            for index in range(len(self.connections)):
+                try:
+                    self._send(index, 'stop')
+                except OSError:
+                    pass  # the worker is gone already
+        for worker in self.workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        for connection in self.connections:
+            connection.close()
+        self.workers, self.connections = [], []
+        self._queue.put(None)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,242 @@
+'''
+Local push fan-out gateway
+
+Every service opening its own push connection to every printer makes the
+printers serve the same stream many times. Gateway holds one upstream
+connection per printer and republishes the messages to any number of
+local consumers over a Unix socket, GatewayEventHandler is the consumer
+side with the same callbacks as the other event handlers.
+
+The protocol is one JSON object per line. A consumer first sends its
+subscription, {"printers": [names], "types": [message types]} (both
+optional, all by default), and then gets {"printer": name, "message":
+message} lines, e.g. with the current, event or history message type.
+The last current message of every subscribed printer is sent right after
+subscribing, so late joiners do not have to wait for the next one.
+'''
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+
+from .fleetrunner import auto_handler
+from .metrics import message_type
+from .sockjsclient import SockJSClient
+
+
+class _Consumer:
+    def __init__(self, printers, types, max_queue):
+        self.printers = frozenset(printers) if printers else None
+        self.types = frozenset(types) if types else None
+        self.queue = queue.Queue(max_queue)
+        self.dropped = False
+
+    def wants(self, printer, kind):
+        return ((self.printers is None or printer in self.printers) and
+                (self.types is None or kind in self.types))
+
+    def put(self, line):
+        '''
+        Queues a line, a consumer too slow to keep up is disconnected
+        rather than holding back the others
+        '''
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self.dropped = True
+            self.queue = queue.Queue()
+            self.queue.put(None)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        gateway = self.server.owner
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            consumer = gateway.subscribe(request.get('printers'),
+                                         request.get('types'))
+        except Exception as e:
+            reply = {'error': str(e)}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            return
+        try:
+            while True:
+                line = consumer.queue.get()
+                if line is None:
+                    return
+                self.wfile.write(line)
+                if consumer.queue.empty():
+                    self.wfile.flush()
+        except OSError:
+            pass  # the consumer went away
+        finally:
+            gateway.unsubscribe(consumer)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Gateway:
+    '''
+    Holds one push connection per printer and fans the messages out
+    to local consumers over a Unix socket
+
+    printers is a dict mapping printer names to URLs
+
+    handler_factory is a callable taking url, on_open, on_close and
+    on_message, returning a push event handler that is not running yet,
+    octoclient.fleetrunner.auto_handler() by default.
+    max_queue is the number of lines a consumer may lag behind,
+    slower consumers are disconnected.
+    '''
+
+    def __init__(self, printers, socket_path, *,
+                 handler_factory=auto_handler, max_queue=10000):
+        self.printers = dict(printers)
+        self.socket_path = socket_path
+        self.handler_factory = handler_factory
+        self.max_queue = max_queue
+        self.handlers = {}
+        self.consumers = set()
+        self.last = {}  # name -> encoded line of the last current message
+        self.published = 0
+        self._lock = threading.Lock()
+        self.server = None
+
+    def _on_message(self, name):
+        def on_message(api, message):
+            self.publish(name, message)
+        return on_message
+
+    def publish(self, name, message):
+        '''
+        Sends a message of given printer to the consumers that want it
+        '''
+        kind = message_type(message)
+        # encoded once, no matter how many consumers get it
+        line = json.dumps({'printer': name, 'message': message}).encode(
+            'utf-8') + b'\n'
+        with self._lock:
+            if kind == 'current':
+                self.last[name] = line
+            self.published += 1
+            for consumer in self.consumers:
+                if consumer.wants(name, kind):
+                    consumer.put(line)
+
+    def subscribe(self, printers=None, types=None):
+        '''
+        Registers a consumer, returns it with the last current messages
+        of its printers already queued
+        '''
+        unknown = [n for n in printers or () if n not in self.printers]
+        if unknown:
+            raise ValueError('Unknown printers: {}'.format(', '.join(unknown)))
+        consumer = _Consumer(printers, types, self.max_queue)
+        with self._lock:
+            # under the lock, nothing is published in between
+            for name, line in self.last.items():
+                if consumer.wants(name, 'current'):
+                    consumer.put(line)
+            self.consumers.add(consumer)
+        return consumer
+
+    def unsubscribe(self, consumer):
+        with self._lock:
+            self.consumers.discard(consumer)
+
+    def _start_upstream(self):
+        for name, url in self.printers.items():
+            handler = self.handler_factory(url, None, None,
+                                           self._on_message(name))
+            handler.run()
+            self.handlers[name] = handler
+
+    def serve_forever(self):
+        '''
+        Connects to the printers, binds the Unix socket
+        and serves consumers until stopped
+        '''
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = _Server(self.socket_path, _Handler)
+        self.server.owner = self
+        os.chmod(self.socket_path, 0o600)
+        self._start_upstream()
+        try:
+            self.server.serve_forever(poll_interval=0.1)
+        finally:
+            for handler in self.handlers.values():
+                # not every handler can be closed (e.g. WebSocketEventHandler)
+                close = getattr(handler, 'close', None)
+                if close is not None:
+                    close()
+            with self._lock:
+                for consumer in self.consumers:
+                    consumer.queue.put(None)
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+
+class GatewayEventHandler(SockJSClient):
+    """
+    Event handler receiving the messages of one printer from a Gateway
+
+    params:
+    socket_path - path of the Unix socket of the gateway
+    printer - name of the printer in the gateway
+    on_open, on_close, on_message - the same as for the other handlers,
+                                    api is this handler
+    types - optional list of message types to receive (e.g. ['current'])
+    """
+    def __init__(self, socket_path, printer, on_open=None, on_close=None,
+                 on_message=None, types=None):
+        super().__init__('unix://' + socket_path, on_open, on_close,
+                         on_message)
+        self.socket_path = socket_path
+        self.printer = printer
+        self.types = types
+
+    def _run(self):
+        with self.socket as sock, sock.makefile('rb') as reader:
+            self.on_open(self)
+            for line in reader:
+                data = json.loads(line.decode('utf-8'))
+                if 'error' in data:
+                    raise RuntimeError(data['error'])
+                self.on_message(self, data['message'])
+        self.on_close(self)
+
+    def run(self):
+        """
+        Connects to the gateway and receives the messages in a thread
+        """
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(self.socket_path)
+        request = {'printers': [self.printer], 'types': self.types}
+        self.socket.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        """
+        Disconnects from the gateway
+        """
+        self.socket.shutdown(socket.SHUT_RDWR)
+
+    def send(self, data):
+        """
+        The gateway only forwards messages from the printers
+        """
+        raise RuntimeError('Cannot send through a gateway')
@@ -0,0 +1,264 @@
+from collections import namedtuple
+import threading
+import time
+
+
+RequestEvent = namedtuple('RequestEvent', [
+    'url',             # base URL of the OctoPrint instance
+    'method',          # HTTP method
+    'path',            # requested path
+    'endpoint',        # path with file and log names collapsed
+    'start',           # time.time() when the request was issued
+    'elapsed',         # duration in seconds
+    'request_bytes',   # size of the request body
+    'response_bytes',  # size of the response body
+    'status',          # HTTP status code or None if there was no response
+    'exception',       # exception raised or None
+])
+
+# Paths under these prefixes end with file or log names,
+# they would blow up the number of label values
+_COLLAPSED = (
+    ('/api/files/local/', '{path}'),
+    ('/api/files/sdcard/', '{path}'),
+    ('/api/logs/', '{name}'),
+    ('/downloads/files/local/', '{path}'),
+    ('/downloads/files/sdcard/', '{path}'),
+    ('/downloads/logs/', '{name}'),
+    ('/downloads/timelapse/', '{name}'),
+)
+
+
+def endpoint(path):
+    '''
+    Returns the endpoint the given path belongs to,
+    i.e. the path without query and with file and log names collapsed
+    '''
+    path = path.split('?')[0]
+    for prefix, placeholder in _COLLAPSED:
+        if path.startswith(prefix) and len(path) > len(prefix):
+            return prefix + placeholder
+    return path
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _labels(*labels):
+    pairs = ('{}="{}"'.format(k, _escape(v)) for k, v in labels)
+    return '{' + ','.join(pairs) + '}'
+
+
+class RESTMetrics:
+    '''
+    Collects latency histograms, byte counts, status codes and exceptions
+    of OctoClient requests
+
+    Pass it in the hooks argument of OctoClient, one instance can be shared
+    by several clients. Use prometheus() to export the collected data.
+    '''
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(sorted(buckets or self.BUCKETS))
+        self._lock = threading.Lock()
+        self.histograms = {}  # key: [counts per bucket..., count, sum]
+        self.request_bytes = {}
+        self.response_bytes = {}
+        self.statuses = {}
+        self.exceptions = {}
+
+    def __call__(self, event):
+        key = (event.url, event.method, event.endpoint)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.buckets)
+                                                          + 2)
+            for n, bound in enumerate(self.buckets):
+                if event.elapsed <= bound:
+                    histogram[n] += 1
+            histogram[-2] += 1
+            histogram[-1] += event.elapsed
+
+            self.request_bytes[key] = (self.request_bytes.get(key, 0)
+                                       + event.request_bytes)
+            self.response_bytes[key] = (self.response_bytes.get(key, 0)
+                                        + event.response_bytes)
+            if event.status is not None:
+                skey = key + (event.status,)
+                self.statuses[skey] = self.statuses.get(skey, 0) + 1
+            if event.exception is not None:
+                ekey = key + (type(event.exception).__name__,)
+                self.exceptions[ekey] = self.exceptions.get(ekey, 0) + 1
+
+    def prometheus(self, prefix='octoclient'):
+        '''
+        Renders the collected data in the Prometheus text exposition format
+        '''
+        lines = []
+
+        def header(name, kind, help):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+
+        def labels(key, *extra):
+            return _labels(('url', key[0]), ('method', key[1]),
+                           ('endpoint', key[2]), *extra)
+
+        with self._lock:
+            header('request_duration_seconds', 'histogram',
+                   'Duration of HTTP requests to OctoPrint.')
+            for key, histogram in sorted(self.histograms.items()):
+                name = '{}_request_duration_seconds'.format(prefix)
+                for bound, count in zip(self.buckets, histogram):
+                    le = ('le', repr(float(bound)))
+                    lines.append('{}_bucket{} {}'.format(
+                        name, labels(key, le), count))
+                lines.append('{}_bucket{} {}'.format(
+                    name, labels(key, ('le', '+Inf')), histogram[-2]))
+                lines.append('{}_count{} {}'.format(name, labels(key),
+                                                    histogram[-2]))
+                lines.append('{}_sum{} {!r}'.format(name, labels(key),
+                                                    histogram[-1]))
+
+            for name, help, data in (
+                    ('request_bytes_total', 'Bytes sent in request bodies.',
+                     self.request_bytes),
+                    ('response_bytes_total',
+                     'Bytes received in response bodies.',
+                     self.response_bytes)):
+                header(name, 'counter', help)
+                for key, value in sorted(data.items()):
+                    lines.append('{}_{}{} {}'.format(prefix, name,
+                                                     labels(key), value))
+
+            header('responses_total', 'counter',
+                   'HTTP responses by status code.')
+            for key, value in sorted(self.statuses.items()):
+                lines.append('{}_responses_total{} {}'.format(
+                    prefix, labels(key, ('status', key[3])), value))
+
+            header('exceptions_total', 'counter',
+                   'Exceptions raised by requests.')
+            for key, value in sorted(self.exceptions.items()):
+                lines.append('{}_exceptions_total{} {}'.format(
+                    prefix, labels(key, ('exception', key[3])), value))
+
+        return '\n'.join(lines) + '\n'
+
+
+def span_hook(callback):
+    '''
+    Returns an OctoClient hook calling callback with an OpenTelemetry-style
+    span (a dict) for every request
+    '''
+    def hook(event):
+        attributes = {
+            'http.method': event.method,
+            'http.url': event.url + event.path,
+            'http.route': event.endpoint,
+            'http.request_content_length': event.request_bytes,
+            'http.response_content_length': event.response_bytes,
+        }
+        if event.status is not None:
+            attributes['http.status_code'] = event.status
+        callback({
+            'name': '{} {}'.format(event.method, event.endpoint),
+            'kind': 'CLIENT',
+            'start_time': event.start,
+            'end_time': event.start + event.elapsed,
+            'attributes': attributes,
+            'status': 'ERROR' if event.exception is not None else 'OK',
+            'exception': event.exception,
+        })
+    return hook
+
+
+def message_type(message):
+    '''
+    Returns the type of a push message, i.e. its only key
+    (current, history, event, plugin, ...)
+    '''
+    if isinstance(message, dict) and message:
+        return next(iter(message))
+    return type(message).__name__
+
+
+class StreamMetrics:
+    '''
+    Per-connection counters of a SockJS push stream
+
+    Pass an instance in the metrics argument of XHRStreamingGenerator,
+    XHRStreamingEventHandler or WebSocketEventHandler,
+    use stats() to get the collected data.
+    '''
+
+    def __init__(self):
+        self.started = time.time()
+        self.frames = {}  # frame type (o, h, a, m, c) -> count
+        self.messages = {}  # message type -> count
+        self.bytes = 0
+        self.decode_time = 0.0
+        self.callback_time = {}  # message type -> seconds
+        self.lag_count = 0
+        self.lag_sum = 0.0
+        self.lag_max = None
+        self.lag_last = None
+
+    def frame(self, kind, size, decode_time):
+        '''
+        Records a received frame of given type and size in bytes
+        and the time it took to decode it
+        '''
+        self.frames[kind] = self.frames.get(kind, 0) + 1
+        self.bytes += size
+        self.decode_time += decode_time
+
+    def message(self, message, dispatched, callback_time):
+        '''
+        Records a message dispatched at time dispatched (as in time.time())
+        and the time its callback took
+        '''
+        kind = message_type(message)
+        self.messages[kind] = self.messages.get(kind, 0) + 1
+        self.callback_time[kind] = (self.callback_time.get(kind, 0.0)
+                                    + callback_time)
+        if kind == 'current':
+            server_time = message['current'].get('serverTime')
+            if server_time is not None:
+                lag = dispatched - server_time
+                self.lag_count += 1
+                self.lag_sum += lag
+                self.lag_last = lag
+                if self.lag_max is None or lag > self.lag_max:
+                    self.lag_max = lag
+
+    def stats(self):
+        '''
+        Returns the counters and per-second rates as a dict
+        '''
+        elapsed = max(time.time() - self.started, 1e-9)
+        messages = dict(self.messages)
+        return {
+            'elapsed': elapsed,
+            'bytes': self.bytes,
+            'bytes_per_second': self.bytes / elapsed,
+            'frames': dict(self.frames),
+            'frames_per_second': {k: v / elapsed
+                                  for k, v in self.frames.items()},
+            'messages': messages,
+            'messages_per_second': {k: v / elapsed
+                                    for k, v in messages.items()},
+            'decode_time': self.decode_time,
+            'callback_time': dict(self.callback_time),
+            'lag': {
+                'count': self.lag_count,
+                'mean': (self.lag_sum / self.lag_count
+                         if self.lag_count else None),
+                'max': self.lag_max,
+                'last': self.lag_last,
+            },
+        }
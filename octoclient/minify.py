@@ -0,0 +1,133 @@
+'''
+Streaming G-code minification
+
+Slicer output carries lots of comments, indentation and numbers like
+X10.500, none of which the printer needs. The Minifier strips them line by
+line from a stream of chunks, so a file of any size can be minified while
+it is being uploaded, see OctoClient.upload(minify=...).
+'''
+import re
+
+
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(rb'[ \t]+')
+_NUMBER = re.compile(rb'(?<=[A-Za-z])[-+]?\d*\.\d*')
+_MOVE = re.compile(rb'G[0-3](?!\d)')
+_FEEDRATE = re.compile(rb'F([-+]?[\d.]+)')
+
+
+def _number(match):
+    number = match.group().lstrip(b'+')
+    number = number.rstrip(b'0').rstrip(b'.')
+    if number in (b'', b'-', b'-0'):
+        return b'0'
+    return number
+
+
+class Minifier:
+    '''
+    Removes comments, redundant whitespace and no-op lines from G-code
+    and shortens the numbers in G commands (X10.500 becomes X10.5)
+
+    Full line comments starting with one of the keep prefixes are kept
+    (e.g. ;LAYER: used by layer counting plugins).
+    Dropped lines are empty lines (after removing the comment),
+    G0/G1 without parameters and feedrate-only moves that set
+    the feedrate already in use.
+
+    bytes_in, bytes_out and lines_dropped are counted over everything
+    the instance processed, saved is the difference in bytes.
+    The feedrate in use is tracked per stream, every lines() or stream()
+    call starts from an unknown feedrate.
+    '''
+
+    def __init__(self, keep=(';LAYER:',)):
+        self.keep = tuple(k.encode('utf-8') if isinstance(k, str) else k
+                          for k in keep)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lines_dropped = 0
+        self._feedrate = None
+
+    @property
+    def saved(self):
+        return self.bytes_in - self.bytes_out
+
+    def line(self, line):
+        '''
+        Minifies one line (bytes, without the newline)
+
+        Returns the minified line, or None if it is dropped
+        '''
+        stripped = line.strip()
+        if stripped.startswith(b';'):
+            return stripped if stripped.startswith(self.keep) else None
+        code = stripped.split(b';', 1)[0].rstrip()
+        if not code:
+            return None
+        if not code.startswith(b'G'):
+            return code
+
+        code = _WHITESPACE.sub(b' ', code)
+        code = _NUMBER.sub(_number, code)
+        move = _MOVE.match(code)
+        if move:
+            params = code[move.end():].strip()
+            if not params:
+                return None
+            feedrate = _FEEDRATE.search(params)
+            if feedrate:
+                if (feedrate.group() == params and
+                        feedrate.group(1) == self._feedrate):
+                    return None
+                self._feedrate = feedrate.group(1)
+        return code
+
+    def lines(self, chunks):
+        '''
+        Generator minifying an iterable of chunks (bytes or str)
+        split at arbitrary places, yields minified lines with newlines
+        '''
+        self._feedrate = None
+        pending = b''
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            self.bytes_in += len(chunk)
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield from self._output(line)
+        if pending:
+            yield from self._output(pending)
+
+    def _output(self, line):
+        line = self.line(line)
+        if line is None:
+            self.lines_dropped += 1
+        else:
+            self.bytes_out += len(line) + 1
+            yield line + b'\n'
+
+    def stream(self, file, chunk_size=CHUNK_SIZE):
+        '''
+        Generator reading given file object in chunks and
+        yielding the minified data in chunks of about chunk_size bytes
+        '''
+        def chunks():
+            while True:
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+        buffered, size = [], 0
+        for line in self.lines(chunks()):
+            buffered.append(line)
+            size += len(line)
+            if size >= chunk_size:
+                yield b''.join(buffered)
+                buffered, size = [], 0
+        if buffered:
+            yield b''.join(buffered)
@@ -0,0 +1,280 @@
+'''
+Compact response models
+
+The models keep the raw JSON bytes of the response and parse it only when
+a field is first accessed. The document is parsed once, all the fields
+are stored in slots and the parsed document is dropped again. That keeps
+large caches of responses small, a parsed JSON document takes several
+times the memory of its text. Large parts of a document (temperatures,
+folder children, G-code analysis) are stored as JSON text slices of
+their own and decoded on every access, so reading a small field does not
+build them.
+'''
+import json
+
+
+def _compact(data):
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+class _lazy:
+    '''
+    Field of a model, the value at given path of keys of the document,
+    kept in given slot once the document is parsed
+
+    A sliced field keeps its value as compact JSON in the slot,
+    it is decoded (and converted) on every access.
+    '''
+
+    def __init__(self, slot, path, convert=None, doc=None, sliced=False):
+        self.slot = slot
+        self.path = path
+        self.convert = convert
+        self.sliced = sliced
+        self.__doc__ = doc
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        try:
+            value = getattr(instance, self.slot)
+        except AttributeError:
+            instance._fill(instance.to_dict())
+            value = getattr(instance, self.slot)
+        if self.sliced and value is not None:
+            value = self._converted(json.loads(value.decode('utf-8')))
+        return value
+
+    def _converted(self, value):
+        if self.convert is not None and value is not None:
+            value = self.convert(value)
+        return value
+
+    def extract(self, document):
+        value = document
+        for key in self.path:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        if self.sliced:
+            return None if value is None else _compact(value)
+        return self._converted(value)
+
+
+class _Model:
+    '''
+    Base class of the models, holds the raw JSON document
+    '''
+    __slots__ = ('_raw',)
+    _fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = tuple(v for v in vars(cls).values()
+                            if isinstance(v, _lazy))
+
+    def __init__(self, raw):
+        '''
+        raw is the JSON document as bytes or str
+        (or already decoded data, which gets encoded again)
+        '''
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        elif not isinstance(raw, bytes):
+            raw = _compact(raw)
+        self._raw = raw
+
+    @property
+    def raw(self):
+        '''
+        The raw JSON document as bytes
+        '''
+        return self._raw
+
+    def to_dict(self):
+        '''
+        Parses the whole document, the same as the non-model methods return
+        '''
+        return json.loads(self._raw.decode('utf-8'))
+
+    def member(self, key):
+        '''
+        The value of a top level member of the document, None if missing
+
+        The members are parsed in order and only up to the wanted one,
+        the document is not parsed whole (unless the member is the last).
+        '''
+        text = self._raw.decode('utf-8')
+        decoder = json.JSONDecoder()
+        end = _skip(text, 0)
+        if text[end:end + 1] != '{':
+            return None
+        end = _skip(text, end + 1)
+        while text[end:end + 1] == '"':
+            name, end = json.decoder.scanstring(text, end + 1)
+            end = _skip(text, _skip(text, end) + 1)  # the colon
+            value, end = decoder.raw_decode(text, end)
+            if name == key:
+                return value
+            end = _skip(text, end)
+            if text[end:end + 1] != ',':
+                break
+            end = _skip(text, end + 1)
+        return None
+
+    @classmethod
+    def parsed(cls, raw, document):
+        '''
+        Creates a model from the raw document and its already parsed form,
+        so it is not parsed again
+        '''
+        model = cls(raw)
+        model._fill(document)
+        return model
+
+    def _fill(self, document):
+        '''
+        Stores all the fields of the parsed document in their slots
+        '''
+        for field in self._fields:
+            setattr(self, field.slot, field.extract(document))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._raw == other._raw
+
+    def __hash__(self):
+        return hash(self._raw)
+
+    def __repr__(self):
+        return '<{} {} bytes>'.format(type(self).__name__, len(self._raw))
+
+
+def _skip(text, index):
+    '''
+    Index of the first non-whitespace character of text from index
+    '''
+    while text[index:index + 1] in (' ', '\t', '\n', '\r'):
+        index += 1
+    return index
+
+
+class TemperatureReading:
+    '''
+    Temperature of one tool or the bed
+    '''
+    __slots__ = ('name', 'actual', 'target', 'offset')
+
+    def __init__(self, name, actual=None, target=None, offset=None):
+        self.name = name
+        self.actual = actual
+        self.target = target
+        self.offset = offset
+
+    @classmethod
+    def from_dict(cls, name, data):
+        return cls(name, data.get('actual'), data.get('target'),
+                   data.get('offset'))
+
+    def __eq__(self, other):
+        return (isinstance(other, TemperatureReading) and
+                all(getattr(self, s) == getattr(other, s)
+                    for s in self.__slots__))
+
+    def __repr__(self):
+        return '<TemperatureReading {} {}/{}>'.format(self.name, self.actual,
+                                                      self.target)
+
+
+def _readings(temperature):
+    return {name: TemperatureReading.from_dict(name, data)
+            for name, data in temperature.items()
+            if name != 'history' and isinstance(data, dict)}
+
+
+class JobInfo(_Model):
+    '''
+    Response of OctoClient.job_info()
+    '''
+    __slots__ = ('_state', '_file', '_completion', '_print_time',
+                 '_print_time_left', '_estimated_print_time', '_filepos')
+
+    state = _lazy('_state', ('state',), doc='State as text')
+    file = _lazy('_file', ('job', 'file'), doc='Selected file as dict')
+    completion = _lazy('_completion', ('progress', 'completion'),
+                       doc='Completion in percent')
+    print_time = _lazy('_print_time', ('progress', 'printTime'))
+    print_time_left = _lazy('_print_time_left', ('progress', 'printTimeLeft'))
+    estimated_print_time = _lazy('_estimated_print_time',
+                                 ('job', 'estimatedPrintTime'))
+    filepos = _lazy('_filepos', ('progress', 'filepos'))
+
+
+class PrinterState(_Model):
+    '''
+    Response of OctoClient.printer()
+    '''
+    __slots__ = ('_text', '_flags', '_temperature', '_sd_ready')
+
+    text = _lazy('_text', ('state', 'text'), doc='State as text')
+    flags = _lazy('_flags', ('state', 'flags'), doc='State flags as dict')
+    temperature = _lazy('_temperature', ('temperature',), _readings,
+                        doc='Dict of tool/bed names to TemperatureReading',
+                        sliced=True)
+    sd_ready = _lazy('_sd_ready', ('sd', 'ready'))
+
+    def _flag(name):
+        return property(lambda self: bool((self.flags or {}).get(name)))
+
+    operational = _flag('operational')
+    printing = _flag('printing')
+    paused = _flag('paused')
+    ready = _flag('ready')
+    error = _flag('error')
+    del _flag
+
+
+class FileEntry(_Model):
+    '''
+    One file or folder entry of OctoClient.files()
+    '''
+    __slots__ = ('_name', '_path', '_type', '_origin', '_size', '_date',
+                 '_hash', '_download', '_analysis', '_children')
+
+    name = _lazy('_name', ('name',))
+    path = _lazy('_path', ('path',))
+    type = _lazy('_type', ('type',), doc='machinecode, model or folder')
+    origin = _lazy('_origin', ('origin',), doc='local or sdcard')
+    size = _lazy('_size', ('size',), doc='Size in bytes')
+    date = _lazy('_date', ('date',), doc='Upload time as a timestamp')
+    hash = _lazy('_hash', ('hash',))
+    download = _lazy('_download', ('refs', 'download'), doc='Download URL')
+    analysis = _lazy('_analysis', ('gcodeAnalysis',),
+                     doc='gcodeAnalysis as dict', sliced=True)
+    children = _lazy('_children', ('children',),
+                     lambda c: [FileEntry(_compact(e)) for e in c],
+                     doc='Entries of a folder as a list of FileEntry',
+                     sliced=True)
+
+    @classmethod
+    def listing(cls, raw, document=None):
+        '''
+        Splits a raw files listing (optionally already parsed as document)
+        into a list of FileEntry
+        '''
+        if document is None:
+            document = json.loads(raw.decode('utf-8'))
+        # the entries stay unparsed until used
+        return [cls(_compact(entry)) for entry in document.get('files', [])]
+
+
+class ConnectionInfo(_Model):
+    '''
+    Response of OctoClient.connection_info()
+    '''
+    __slots__ = ('_state', '_port', '_baudrate', '_printer_profile')
+
+    state = _lazy('_state', ('current', 'state'), doc='State as text')
+    port = _lazy('_port', ('current', 'port'))
+    baudrate = _lazy('_baudrate', ('current', 'baudrate'))
+    printer_profile = _lazy('_printer_profile',
+                            ('current', 'printerProfile'))
@@ -0,0 +1,166 @@
+'''
+Adaptive rate limiting of requests to OctoPrint
+
+OctoPrint usually runs on a Raspberry Pi that also feeds the printer over
+the serial line, too many requests at once make prints stutter. RateLimiter
+keeps token buckets per printer, one for reads (GET) and one for commands,
+and adjusts their rates AIMD style: the rate grows slowly while responses
+are fast and is cut in half when they get slow or fail with 5xx.
+See OctoClient(limiter=...).
+'''
+import threading
+import time
+
+
+READ = 'read'
+COMMAND = 'command'
+
+
+class AdaptiveBucket:
+    '''
+    Token bucket with a rate adjusted by the observed responses
+
+    rate - tokens (requests) per second to start with, also the maximum
+    burst - tokens the bucket holds at most, defaults to rate (at least 1)
+    min_rate - the rate is never cut below this
+    latency_target - responses slower than this many seconds count as
+                     overload, just like 5xx and failed requests
+    increase - requests per second added every second of fast responses
+    decrease - factor the rate is multiplied by on overload, at most once
+               per cooldown seconds, so the responses to requests sent
+               before the cut do not cut it again
+    '''
+
+    def __init__(self, rate, *, burst=None, min_rate=0.5, latency_target=1.0,
+                 increase=1.0, decrease=0.5, cooldown=1.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.max_rate = self.rate = float(rate)
+        self.burst = max(1.0, float(burst or rate))
+        self.min_rate = min(min_rate, self.max_rate)
+        self.latency_target = latency_target
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.burst
+        self.decreases = 0
+        self.waited = 0.0  # seconds spent waiting for tokens in total
+        self._updated = clock()
+        self._decreased = None
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=None):
+        '''
+        Takes a token, waits for one if needed
+
+        Returns False if there was none within timeout seconds
+        '''
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                delay = (1 - self.tokens) / self.rate
+            if deadline is not None:
+                if now >= deadline:
+                    return False
+                delay = min(delay, deadline - now)
+            self.sleep(delay)
+            with self._lock:
+                self.waited += delay
+
+    def record(self, elapsed, status):
+        '''
+        Adjusts the rate after a response that took elapsed seconds
+        with given status code (None when the request failed)
+
+        elapsed is None when the time does not tell how busy the server is
+        (e.g. it was spent uploading a file), only the status counts then
+        '''
+        overloaded = (status is None or status >= 500 or
+                      (elapsed is not None and
+                       elapsed > self.latency_target))
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            if overloaded:
+                if (self._decreased is None or
+                        now - self._decreased >= self.cooldown):
+                    self.rate = max(self.min_rate, self.rate * self.decrease)
+                    self._decreased = now
+                    self.decreases += 1
+            elif self.rate < self.max_rate:
+                # about self.increase more per second of requests at rate
+                self.rate = min(self.max_rate,
+                                self.rate + self.increase / self.rate)
+
+
+class RateLimiter:
+    '''
+    AdaptiveBucket for reads and one for commands of every printer
+
+    One limiter can be shared by many OctoClient instances (e.g. all the
+    clients of a Fleet and of other services in the same process),
+    printers are told apart by URL.
+
+    read_rate, command_rate - requests per second to start with
+    timeout - seconds to wait for a token at most, None waits forever
+    other keyword arguments are passed to AdaptiveBucket
+    '''
+
+    def __init__(self, *, read_rate=10.0, command_rate=2.0, timeout=None,
+                 **kwargs):
+        self.rates = {READ: read_rate, COMMAND: command_rate}
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self.buckets = {}  # (url, kind) -> AdaptiveBucket
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def kind(method):
+        '''
+        The budget a request with given HTTP method takes from
+        '''
+        return READ if method in ('GET', 'HEAD') else COMMAND
+
+    def bucket(self, url, kind):
+        with self._lock:
+            bucket = self.buckets.get((url, kind))
+            if bucket is None:
+                bucket = AdaptiveBucket(self.rates[kind], **self.kwargs)
+                self.buckets[(url, kind)] = bucket
+            return bucket
+
+    def acquire(self, url, kind):
+        '''
+        Waits for a token of given printer and kind
+
+        Raises RuntimeError if there was none within timeout
+        '''
+        if not self.bucket(url, kind).acquire(self.timeout):
+            msg = 'Rate limit of {} requests to {} exceeded'
+            raise RuntimeError(msg.format(kind, url))
+
+    def record(self, url, kind, elapsed, status):
+        self.bucket(url, kind).record(elapsed, status)
+
+    def stats(self):
+        '''
+        Returns the current rates as a dict of printer URLs
+        to dicts of kinds to requests per second
+        '''
+        with self._lock:
+            buckets = dict(self.buckets)
+        stats = {}
+        for (url, kind), bucket in buckets.items():
+            stats.setdefault(url, {})[kind] = bucket.rate
+        return stats
@@ -0,0 +1,116 @@
+import gzip
+import threading
+import time
+
+from octoclient.sockjsclient import SockJSClient
+
+
+def read_recording(path):
+    """
+    Generator yielding (timestamp, frame) tuples of a recording
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            timestamp, _, frame = line.rstrip('\n').partition('\t')
+            yield float(timestamp), frame
+
+
+class Recorder:
+    """
+    Writes raw SockJS frames with timestamps to a gzip compressed file
+
+    Pass an instance in the on_frame argument of XHRStreamingGenerator,
+    XHRStreamingEventHandler, WebSocketEventHandler or AutoEventHandler.
+    Every frame is one line of the file, the time it was received
+    (seconds since the epoch) and the frame separated by a tab.
+
+    The file is only ever appended to, recording to an existing file adds
+    a new gzip member to it. The data is flushed every flush_interval
+    seconds, so at most that much is lost if the process dies.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.frames = 0
+        self._file = gzip.open(path, 'ab')
+        self._lock = threading.Lock()
+        self._flushed = time.monotonic()
+
+    def __call__(self, frame):
+        line = '{!r}\t{}\n'.format(time.time(), frame).encode('utf-8')
+        with self._lock:
+            self._file.write(line)
+            self.frames += 1
+            now = time.monotonic()
+            if now - self._flushed >= self.flush_interval:
+                self._file.flush()
+                self._flushed = now
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ReplayEventHandler(SockJSClient):
+    """
+    Event handler feeding a recording made by Recorder through
+    the same decoding and dispatching as the live handlers
+
+    params:
+    path - path of the recording
+    on_open, on_close, on_message, metrics, on_frame - the same as for
+               the live handlers, api is this handler
+    speed - how many times faster than recorded to replay,
+            None replays as fast as possible
+    """
+    def __init__(self, path, on_open=None, on_close=None, on_message=None,
+                 metrics=None, on_frame=None, speed=1.0):
+        super().__init__(path, on_open, on_close, on_message, metrics,
+                         on_frame)
+        self.path = path
+        self.speed = speed
+        self.frames = 0
+
+    def play(self):
+        """
+        Replays the whole recording in the current thread
+
+        Returns the number of frames replayed
+        """
+        first = start = None
+        for timestamp, frame in read_recording(self.path):
+            if first is None:
+                first, start = timestamp, time.monotonic()
+            if self.speed:
+                delay = ((timestamp - first) / self.speed -
+                         (time.monotonic() - start))
+                if delay > 0:
+                    time.sleep(delay)
+            kind = self._dispatch(self, frame)
+            self.frames += 1
+            if kind == 'o':
+                self.on_open(self)
+            elif kind == 'c':
+                self.on_close(self)
+        return self.frames
+
+    def run(self):
+        """
+        Replays the recording in a thread
+        """
+        self.thread = threading.Thread(target=self.play)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, data):
+        """
+        Nothing to send to, a recording does not listen
+        """
+        raise RuntimeError('Cannot send to a recording')
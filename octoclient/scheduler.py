@@ -0,0 +1,342 @@
+'''
+Print farm job scheduler
+
+Keeps a queue of G-code jobs and starts them on idle printers of a fleet,
+uploading the file with select and print. Printer states come from polling
+/api/connection, or from push messages fed to Scheduler.update().
+'''
+from collections import deque
+from concurrent import futures
+import os
+import threading
+import time
+
+from .fleet import Fleet
+
+
+IDLE = 'Operational'
+# prefixes of OctoPrint states that mean the printer is busy with a job
+PRINTING = ('Printing', 'Pausing', 'Paused', 'Resuming', 'Cancelling',
+            'Finishing', 'Starting')
+
+
+def _file_size(file):
+    if isinstance(file, str):
+        return os.path.getsize(file)
+    try:
+        fileobj = file[1]
+        position = fileobj.tell()
+        size = fileobj.seek(0, os.SEEK_END) - position
+        fileobj.seek(position)
+        return size
+    except (AttributeError, OSError, IndexError):
+        return 0
+
+
+class Job:
+    '''
+    One queued print
+
+    file is a path or a (filename, file object) tuple, as for
+    OctoClient.upload(). profile optionally restricts the job to printers
+    with given printer profile id.
+
+    Once started, printer is the URL of the printer it was sent to and
+    started the time it was sent. error is the exception of a failed upload.
+    '''
+
+    def __init__(self, file, *, profile=None, location='local'):
+        self.file = file
+        self.profile = profile
+        self.location = location
+        self.size = _file_size(file)
+        self.name = (os.path.basename(file) if isinstance(file, str)
+                     else file[0])
+        self.submitted = None
+        self.started = None
+        self.finished = None  # when the upload finished
+        self.printer = None
+        self.error = None
+
+    @property
+    def wait(self):
+        '''
+        Seconds the job waited in the queue (None while queued)
+        '''
+        if self.started is None:
+            return None
+        return self.started - self.submitted
+
+    def __repr__(self):
+        return '<Job {} on {}>'.format(self.name, self.printer)
+
+
+class _Printer:
+    '''
+    What the scheduler knows about one printer
+    '''
+
+    def __init__(self, client, now, upload_rate):
+        self.client = client
+        self.state = None
+        self.profile = None
+        self.uploading = None  # the Job being uploaded
+        self.upload_rate = upload_rate  # bytes per second, measured
+        self.since = now  # time of the last state change accounting
+        self.observed = 0.0
+        self.printing = 0.0
+        self.upload_time = 0.0
+        self.jobs = 0
+
+    @property
+    def idle(self):
+        return self.state == IDLE and self.uploading is None
+
+    @property
+    def busy(self):
+        return bool(self.state) and self.state.startswith(PRINTING)
+
+    def account(self, now):
+        elapsed = now - self.since
+        self.since = now
+        self.observed += elapsed
+        if self.uploading is not None:
+            self.upload_time += elapsed
+        elif self.busy:
+            self.printing += elapsed
+
+
+class Scheduler:
+    '''
+    Assigns queued jobs to idle printers to keep the farm busy
+
+    Jobs are started in the order they were submitted, except that
+    a job that no idle printer can take (because of its profile) does not
+    hold the jobs behind it. A job goes to the compatible idle printer
+    with the shortest expected upload time (given the upload rate measured
+    for every printer, upload_rate bytes per second before the first one).
+    '''
+
+    def __init__(self, clients, *, upload_rate=1024 * 1024, max_workers=16,
+                 clock=time.monotonic):
+        self.fleet = Fleet(clients, max_workers=max_workers)
+        self.clock = clock
+        now = clock()
+        self.printers = {c.url: _Printer(c, now, upload_rate)
+                         for c in self.fleet.clients}
+        self.queue = deque()
+        self.started = []
+        self.failed = []
+        self._lock = threading.RLock()
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._uploads = []
+        self._stop = threading.Event()
+
+    def submit(self, file, *, profile=None, location='local'):
+        '''
+        Queues a job, see Job for the arguments
+
+        Returns the Job
+        '''
+        job = Job(file, profile=profile, location=location)
+        job.submitted = self.clock()
+        with self._lock:
+            self.queue.append(job)
+        return job
+
+    def update(self, url, state, profile=None):
+        '''
+        Records the state (text) and optionally the printer profile id
+        of the printer with given URL, e.g. from a push message
+        '''
+        with self._lock:
+            printer = self.printers[url]
+            printer.account(self.clock())
+            printer.state = state
+            if profile is not None:
+                printer.profile = profile
+
+    def on_message(self, url):
+        '''
+        Returns an on_message callback for a push event handler
+        of the printer with given URL, keeping its state updated
+        '''
+        def on_message(api, message):
+            if 'current' in message:
+                self.update(url, message['current']['state']['text'])
+        return on_message
+
+    def poll(self, urls=None):
+        '''
+        Refreshes the state and profile of printers (all by default)
+        from /api/connection, printers that fail to respond are considered
+        offline
+        '''
+        clients = [self.printers[url].client
+                   for url in (self.printers if urls is None else urls)]
+        for url, (info, error) in self.fleet._map(
+                lambda c: c.connection_info(), clients).items():
+            if error is not None:
+                self.update(url, 'Offline')
+                continue
+            current = info.get('current', {})
+            self.update(url, current.get('state'),
+                        current.get('printerProfile'))
+
+    def _upload_time(self, printer, job):
+        return job.size / printer.upload_rate
+
+    def _assign(self):
+        '''
+        Picks jobs for the idle printers, returns a list of (job, printer)
+        '''
+        idle = [p for p in self.printers.values() if p.idle]
+        assignments = []
+        for job in list(self.queue):
+            if not idle:
+                break
+            compatible = [p for p in idle
+                          if job.profile is None or job.profile == p.profile]
+            if not compatible:
+                continue
+            # fastest upload first, then the one idle for the longest
+            printer = min(compatible, key=lambda p: (
+                self._upload_time(p, job), p.since))
+            idle.remove(printer)
+            self.queue.remove(job)
+            assignments.append((job, printer))
+        return assignments
+
+    def _upload(self, job, printer):
+        started = time.perf_counter()
+        try:
+            printer.client.upload(job.file, location=job.location,
+                                  select=True, print=True)
+        except Exception as e:
+            with self._lock:
+                job.error = e
+                self.failed.append(job)
+                printer.account(self.clock())
+                printer.uploading = None
+                printer.state = None  # unknown until polled again
+            return
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            if job.size and elapsed > 0:
+                rate = job.size / elapsed
+                printer.upload_rate = (printer.upload_rate + rate) / 2
+            printer.account(self.clock())
+            printer.uploading = None
+            # until the next poll or push message says otherwise
+            printer.state = 'Starting'
+            job.finished = self.clock()
+
+    def step(self, poll=True):
+        '''
+        Refreshes printer states (unless poll is False and the states
+        come from update()) and starts uploads of jobs to idle printers
+
+        Returns the list of jobs started
+        '''
+        with self._lock:
+            unknown = [url for url, p in self.printers.items()
+                       if p.profile is None and p.uploading is None]
+        if poll:
+            self.poll([url for url, p in self.printers.items()
+                       if p.uploading is None])
+        elif unknown:
+            self.poll(unknown)
+
+        with self._lock:
+            assignments = self._assign()
+            now = self.clock()
+            for job, printer in assignments:
+                printer.account(now)
+                printer.uploading = job
+                printer.jobs += 1
+                job.printer = printer.client.url
+                job.started = now
+                self.started.append(job)
+        for job, printer in assignments:
+            self._uploads.append(
+                self._executor.submit(self._upload, job, printer))
+        return [job for job, _ in assignments]
+
+    @property
+    def pending(self):
+        '''
+        Number of jobs queued or being uploaded
+        '''
+        with self._lock:
+            return len(self.queue) + sum(
+                p.uploading is not None for p in self.printers.values())
+
+    def run(self, interval=5.0, *, until_empty=True):
+        '''
+        Calls step() every interval seconds until stop() is called,
+        or until all the jobs are started if until_empty is True
+        '''
+        self._stop.clear()
+        while not self._stop.is_set():
+            self.step()
+            if until_empty and not self.pending:
+                break
+            self._stop.wait(interval)
+
+    def stop(self):
+        self._stop.set()
+
+    def wait(self):
+        '''
+        Waits for the running uploads to finish
+        '''
+        uploads, self._uploads = self._uploads, []
+        futures.wait(uploads)
+
+    def close(self):
+        '''
+        Waits for the running uploads and stops the upload threads
+        '''
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        '''
+        Returns utilization and queue statistics as a dict
+
+        printers maps printer URLs to dicts with state, jobs (started),
+        printing and uploading (seconds) and utilization (the fraction
+        of the observed time spent printing). The farm-wide utilization,
+        numbers of queued, started and failed jobs and queue wait times
+        (seconds, of started jobs) are at the top level.
+        '''
+        with self._lock:
+            now = self.clock()
+            printers = {}
+            observed = printing = 0.0
+            for url, printer in self.printers.items():
+                printer.account(now)
+                observed += printer.observed
+                printing += printer.printing
+                printers[url] = {
+                    'state': printer.state,
+                    'jobs': printer.jobs,
+                    'printing': printer.printing,
+                    'uploading': printer.upload_time,
+                    'upload_rate': printer.upload_rate,
+                    'utilization': (printer.printing / printer.observed
+                                    if printer.observed else 0.0),
+                }
+            waits = [job.wait for job in self.started]
+            oldest = now - self.queue[0].submitted if self.queue else 0.0
+            return {
+                'printers': printers,
+                'utilization': printing / observed if observed else 0.0,
+                'queued': len(self.queue),
+                'started': len(self.started),
+                'failed': len(self.failed),
+                'queue_wait': {
+                    'mean': sum(waits) / len(waits) if waits else 0.0,
+                    'max': max(waits) if waits else 0.0,
+                    'oldest_queued': oldest,
+                },
+            }
@@ -1,9 +1,36 @@
+import json
 import random
 import string
+import time
 
 from urllib import parse as urlparse
 
 
+def decode_frame(frame, metrics=None, size=None):
+    """
+    Decodes one SockJS frame given as str
+
+    Returns a tuple of the frame type (its first character)
+    and a list of messages carried by it (empty for other than m and a)
+    If metrics (StreamMetrics) is given, the frame is recorded there,
+    size is the size of the frame in bytes if already known
+    """
+    kind = frame[:1]
+    if metrics is not None:
+        start = time.perf_counter()
+    if kind == 'a':
+        messages = json.loads(frame[1:])
+    elif kind == 'm':
+        messages = [json.loads(frame[1:])]
+    else:
+        messages = []
+    if metrics is not None:
+        if size is None:
+            size = len(frame.encode('utf-8'))
+        metrics.frame(kind, size, time.perf_counter() - start)
+    return kind, messages
+
+
 class SockJSClient:
     """
     Abstract class for SockJS client event handlers
@@ -18,12 +45,15 @@ class SockJSClient:
         letters = string.ascii_lowercase + string.digits
         return ''.join(random.choice(letters) for c in range(length))
 
-    def __init__(self, url, on_open=None, on_close=None, on_message=None):
+    def __init__(self, url, on_open=None, on_close=None, on_message=None,
+                 metrics=None, on_frame=None):
         self.on_open = on_open if callable(on_open) else lambda x: None
         self.on_close = on_close if callable(on_close) else lambda x: None
         self.on_message = \
             on_message if callable(on_message) else lambda x, y: None
 
+        self.metrics = metrics
+        self.on_frame = on_frame
         self.thread = None
         self.socket = None
 
@@ -37,6 +67,26 @@ class SockJSClient:
                    "/".join((self.base_url, "sockjs", server_id, session_id)) \
                    + "/{method}"
 
+    def _dispatch(self, api, frame, size=None):
+        """
+        Decodes a frame and executes on_message for every message in it
+        (on_frame, if given, is called with the raw frame first)
+
+        Returns the frame type
+        """
+        if self.on_frame is not None:
+            self.on_frame(frame)
+        kind, messages = decode_frame(frame, self.metrics, size)
+        for message in messages:
+            if self.metrics is None:
+                self.on_message(api, message)
+            else:
+                dispatched, start = time.time(), time.perf_counter()
+                self.on_message(api, message)
+                self.metrics.message(message, dispatched,
+                                     time.perf_counter() - start)
+        return kind
+
     def wait(self):
         self.thread.join()
 
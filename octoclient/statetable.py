@@ -0,0 +1,313 @@
+'''
+Fleet state table in shared memory
+
+One process (the writer) keeps the state of every printer in a NumPy
+structured array in multiprocessing.shared_memory, other processes on the
+same host attach to it by name and read it without any copying or
+connections of their own. Every row has a sequence number that is odd
+while the row is being written (a seqlock), so readers can tell a torn
+row and read it again. Requires NumPy.
+
+    # the writer
+    table = StateTable.create('octoprint-fleet', capacity=2048)
+    handler = AutoEventHandler(url, on_message=table.on_message(url))
+
+    # any reader
+    table = StateTable.attach('octoprint-fleet')
+    table.read(url)['progress']
+'''
+from multiprocessing import resource_tracker, shared_memory
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# state codes, see state_code()
+UNKNOWN = 0
+OFFLINE = 1
+OPERATIONAL = 2
+PRINTING = 3
+PAUSING = 4
+PAUSED = 5
+CANCELLING = 6
+ERROR = 7
+
+STATES = ('unknown', 'offline', 'operational', 'printing', 'pausing',
+          'paused', 'cancelling', 'error')
+
+# flags checked in this order, the first set one wins
+_FLAGS = (('cancelling', CANCELLING), ('pausing', PAUSING),
+          ('paused', PAUSED), ('printing', PRINTING), ('error', ERROR),
+          ('operational', OPERATIONAL))
+
+URL_SIZE = 128
+_MAGIC = 0x4f435354  # OCST
+
+if np is not None:
+    HEADER = np.dtype([('magic', '<u4'), ('capacity', '<u4'),
+                       ('count', '<u4'), ('reserved', '<u4')])
+    ROW = np.dtype([
+        ('seq', '<u8'),
+        ('url', 'S{}'.format(URL_SIZE)),
+        ('state', '<u1'),
+        ('progress', '<f8'),
+        ('tool_actual', '<f8'),
+        ('tool_target', '<f8'),
+        ('bed_actual', '<f8'),
+        ('bed_target', '<f8'),
+        ('updated', '<f8'),
+    ], align=True)
+
+
+def state_code(state):
+    '''
+    State code of a state document ({'text': ..., 'flags': {...}}
+    as in the current push message or printer())
+    '''
+    flags = (state or {}).get('flags')
+    if not flags:
+        return UNKNOWN
+    for flag, code in _FLAGS:
+        if flags.get(flag):
+            return code
+    return OFFLINE
+
+
+class StateTable:
+    '''
+    Rows of printer states in a shared memory block
+
+    Use create() in the writer and attach() in the readers. The rows
+    attribute is a zero-copy structured array view of the used rows,
+    with the columns seq, url, state (a code, see STATES), progress
+    (percent), tool_actual, tool_target, bed_actual, bed_target
+    (degrees, of tool0) and updated (seconds since the epoch).
+    Missing numbers are NaN.
+
+    Only one process may write, there is no locking between writers.
+    '''
+
+    def __init__(self, memory, writer=False):
+        if np is None:
+            raise RuntimeError('StateTable requires NumPy')
+        self.memory = memory
+        self.writer = writer
+        self.header = np.ndarray((1,), HEADER, buffer=memory.buf)
+        if self.header['magic'][0] != _MAGIC:
+            raise ValueError('{} is not a state table'.format(memory.name))
+        self.capacity = int(self.header['capacity'][0])
+        self._all = np.ndarray((self.capacity,), ROW, buffer=memory.buf,
+                               offset=self._offset())
+        self._index = {}  # url -> row
+
+    @staticmethod
+    def _offset():
+        # rows start aligned to 64 bytes
+        return -(-HEADER.itemsize // 64) * 64
+
+    @classmethod
+    def create(cls, name=None, capacity=1024):
+        '''
+        Creates a new table for up to capacity printers, the writer
+
+        name is the shared memory name readers attach() to,
+        a random one is used if not given (see the name attribute)
+        '''
+        if np is None:
+            raise RuntimeError('StateTable requires NumPy')
+        size = cls._offset() + ROW.itemsize * capacity
+        memory = shared_memory.SharedMemory(name, create=True, size=size)
+        header = np.ndarray((1,), HEADER, buffer=memory.buf)
+        header[0] = (_MAGIC, capacity, 0, 0)
+        del header
+        return cls(memory, writer=True)
+
+    @classmethod
+    def attach(cls, name):
+        '''
+        Attaches to an existing table, a reader
+        '''
+        # the reader must not destroy the table when it exits (bpo-39959)
+        if sys.version_info >= (3, 13):
+            memory = shared_memory.SharedMemory(name, track=False)
+        else:
+            memory = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(memory._name, 'shared_memory')
+        return cls(memory)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @property
+    def count(self):
+        return int(self.header['count'][0])
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def rows(self):
+        '''
+        Zero-copy view of the used rows, may change under the reader,
+        check seq or use read() and snapshot() for consistent data
+        '''
+        return self._all[:self.count]
+
+    def index(self, url):
+        '''
+        Row number of a printer, None if it is not in the table
+        '''
+        row = self._index.get(url)
+        if row is None and not self.writer:
+            # a reader learns about the rows added since the last lookup
+            urls = self._all['url'][len(self._index):self.count]
+            for i, found in enumerate(urls, len(self._index)):
+                self._index[found.decode('utf-8')] = i
+            row = self._index.get(url)
+        return row
+
+    def _row(self, url):
+        row = self._index.get(url)
+        if row is None:
+            count = self.count
+            if count >= self.capacity:
+                raise RuntimeError('The state table is full')
+            encoded = url.encode('utf-8')
+            if len(encoded) > URL_SIZE:
+                raise ValueError('URL too long: {}'.format(url))
+            self._all[count] = (0, encoded, UNKNOWN) + (np.nan,) * 6
+            # the row is complete before readers can see it
+            self.header['count'] = count + 1
+            self._index[url] = row = count
+        return row
+
+    def update(self, url, *, state=None, progress=None, tool=None,
+               bed=None, timestamp=None):
+        '''
+        Writes the given values to the row of a printer, adding it
+        if needed, only the writer can do that
+
+        state is a state code, progress percent (use NaN for none),
+        tool and bed (actual, target) tuples
+        '''
+        if not self.writer:
+            raise RuntimeError('Only the table creator can write')
+        row = self._all[self._row(url)]
+        seq = row['seq']
+        row['seq'] = seq + 1  # odd, readers wait
+        if state is not None:
+            row['state'] = state
+        if progress is not None:
+            row['progress'] = progress
+        if tool is not None:
+            row['tool_actual'], row['tool_target'] = tool
+        if bed is not None:
+            row['bed_actual'], row['bed_target'] = bed
+        row['updated'] = time.time() if timestamp is None else timestamp
+        row['seq'] = seq + 2
+
+    @staticmethod
+    def _temperature(reading):
+        if not isinstance(reading, dict):
+            return None
+        return tuple(np.nan if reading.get(key) is None else reading[key]
+                     for key in ('actual', 'target'))
+
+    @staticmethod
+    def _progress(progress):
+        completion = (progress or {}).get('completion')
+        return np.nan if completion is None else completion
+
+    def update_current(self, url, current, timestamp=None):
+        '''
+        Updates a row from a current push message
+        '''
+        temps = current.get('temps') or [{}]
+        self.update(url, state=state_code(current.get('state')),
+                    progress=self._progress(current.get('progress')),
+                    tool=self._temperature(temps[-1].get('tool0')),
+                    bed=self._temperature(temps[-1].get('bed')),
+                    timestamp=timestamp)
+
+    def update_printer(self, url, printer, timestamp=None):
+        '''
+        Updates a row from the result of OctoClient.printer()
+        '''
+        temperature = printer.get('temperature') or {}
+        self.update(url, state=state_code(printer.get('state')),
+                    tool=self._temperature(temperature.get('tool0')),
+                    bed=self._temperature(temperature.get('bed')),
+                    timestamp=timestamp)
+
+    def update_job(self, url, job, timestamp=None):
+        '''
+        Updates a row from the result of OctoClient.job_info()
+        '''
+        self.update(url, progress=self._progress(job.get('progress')),
+                    timestamp=timestamp)
+
+    def on_message(self, url):
+        '''
+        Returns an on_message callback for a push event handler,
+        updating the row of given printer from the current messages
+        '''
+        def on_message(api, message):
+            if 'current' in message:
+                self.update_current(url, message['current'])
+        return on_message
+
+    def read(self, url, retries=1000):
+        '''
+        Returns a consistent copy of the row of a printer (a NumPy record),
+        None if the printer is not in the table
+
+        Raises RuntimeError if the row was being written in all the retries
+        '''
+        row = self.index(url)
+        if row is None:
+            return None
+        view = self._all[row:row + 1]
+        for _ in range(retries):
+            before = view['seq'][0]
+            if before % 2 == 0:
+                copy = view.copy()
+                if view['seq'][0] == before:
+                    return copy[0]
+            time.sleep(0)
+        raise RuntimeError('Row of {} is stuck being written'.format(url))
+
+    def snapshot(self, retries=1000):
+        '''
+        Returns a consistent copy of all the used rows
+
+        The rows are copied at once and only the torn ones are read again
+        '''
+        copy = self.rows.copy()
+        torn = np.flatnonzero((copy['seq'] % 2 == 1) |
+                              (copy['seq'] != self._all['seq'][:len(copy)]))
+        for row in torn:
+            copy[row] = self.read(copy['url'][row].decode('utf-8'), retries)
+        return copy
+
+    def close(self):
+        '''
+        Detaches from the table, the writer also destroys it
+        '''
+        self.header = self._all = None
+        self.memory.close()
+        if self.writer:
+            # a reader in a child process shares the resource tracker
+            # and its unregister() also dropped the writer's registration
+            resource_tracker.register(self.memory._name, 'shared_memory')
+            self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,310 @@
+'''
+Batched columnar telemetry sink for push messages
+
+Flattens the current push messages of many printers into rows of typed
+columns, buffers them in memory and has a background thread write them in
+batches, one file per batch:
+
+* npz - NumPy compressed archive, one array per column (requires NumPy)
+* csv - plain CSV with a header
+* parquet - requires pyarrow
+
+Use TelemetrySink.on_message(name) as the on_message callback of a push
+event handler (or call add() directly).
+'''
+import csv
+import glob
+import os
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+FORMATS = ('npz', 'csv', 'parquet')
+# parts of the current message that are not telemetry
+SKIPPED = ('logs', 'messages', 'busyFiles')
+
+
+def flatten(current, prefix=''):
+    '''
+    Flattens a current push message to a dict of dotted keys
+    and scalar values
+
+    Lists are skipped, except for temps, where only the latest
+    reading is kept (as temps.tool0.actual etc.)
+    '''
+    row = {}
+    for key, value in current.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            row.update(flatten(value, name + '.'))
+        elif key == 'temps' and not prefix:
+            if value:
+                row.update(flatten(value[-1], 'temps.'))
+        elif isinstance(value, (list, tuple)) or key in SKIPPED:
+            continue
+        else:
+            row[name] = value
+    return row
+
+
+def _kind(values, known=None):
+    '''
+    Type of a column given its values and the type it already had
+    (if any): bool, float or str
+
+    Columns only ever get wider (bool < float < str), a column without
+    any values keeps its type, or is float (NaN) when it has none yet
+    '''
+    kinds = {type(v) for v in values if v is not None}
+    if known is not None:
+        kinds.add(known)
+    if not kinds:
+        return float
+    if kinds == {bool}:
+        return bool
+    if kinds <= {bool, int, float}:
+        return float
+    return str
+
+
+def columns(rows, schema=None):
+    '''
+    Turns a list of row dicts to a dict of typed columns (lists),
+    missing numbers are NaN, missing flags False, missing strings empty
+
+    schema is an optional dict of column names to types, used and updated
+    to keep the columns typed the same across batches, its columns are
+    always included (as missing values when the rows have none of them)
+    '''
+    if schema is None:
+        schema = {}
+    names = sorted({name for row in rows for name in row} | set(schema))
+    result = {}
+    for name in names:
+        values = [row.get(name) for row in rows]
+        kind = _kind(values, schema.get(name))
+        if any(v is not None for v in values) or name in schema:
+            schema[name] = kind
+        if kind is bool:
+            result[name] = [bool(v) for v in values]
+        elif kind is float:
+            result[name] = [float('nan') if v is None else float(v)
+                            for v in values]
+        else:
+            result[name] = ['' if v is None else str(v) for v in values]
+    return result
+
+
+class TelemetrySink:
+    '''
+    Buffers flattened push messages and writes them in batches
+    from a background thread
+
+    directory - where to write the files, named prefix-NNNNNN.format
+    format - npz, csv or parquet
+    batch_size - rows per file, a batch is written once it is full ...
+    flush_interval - ... or once its oldest row waited this many seconds
+    max_pending - rows buffered at most, when the writer falls behind
+    on_full - 'block' to make add() wait for the writer (up to
+              block_timeout seconds, dropping the row then),
+              'drop' to drop new rows right away; dropped counts them
+    max_files - optional, only this many newest files are kept
+    '''
+
+    def __init__(self, directory, *, format='npz', prefix='telemetry',
+                 batch_size=10000, flush_interval=5.0, max_pending=100000,
+                 on_full='block', block_timeout=10.0, max_files=None):
+        if format not in FORMATS:
+            raise ValueError('Unknown format {!r}, use one of {}'.format(
+                format, ', '.join(FORMATS)))
+        if format == 'npz' and np is None:
+            raise RuntimeError('The npz format requires NumPy')
+        if format == 'parquet' and pyarrow is None:
+            raise RuntimeError('The parquet format requires pyarrow')
+        if on_full not in ('block', 'drop'):
+            raise ValueError("on_full must be 'block' or 'drop'")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.format = format
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.on_full = on_full
+        self.block_timeout = block_timeout
+        self.max_files = max_files
+
+        self.rows_written = 0
+        self.files_written = 0
+        self.dropped = 0
+        self.flush_latency = None  # seconds the oldest row of a batch waited
+        self.error = None  # the last exception of the writer
+
+        self._schema = {}  # column types, the same in every batch
+        self._pending = []
+        self._oldest = None
+        self._handled = 0  # rows taken by the writer
+        self._written = 0  # rows the writer is done with
+        self._flush_target = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._sequence = self._last_sequence()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _files(self):
+        pattern = os.path.join(self.directory, '{}-*.{}'.format(
+            glob.escape(self.prefix), self.format))
+        return sorted(glob.glob(pattern))
+
+    def _last_sequence(self):
+        files = self._files()
+        if not files:
+            return 0
+        name = os.path.basename(files[-1])
+        try:
+            return int(name[len(self.prefix) + 1:].split('.')[0])
+        except ValueError:
+            return 0
+
+    @property
+    def pending(self):
+        with self._condition:
+            return len(self._pending)
+
+    def add(self, printer, current, timestamp=None):
+        '''
+        Queues one current message of given printer (name or URL)
+
+        Returns False if the row was dropped
+        '''
+        row = flatten(current)
+        row['printer'] = printer
+        row['received'] = time.time() if timestamp is None else timestamp
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('The sink is closed')
+            if len(self._pending) >= self.max_pending:
+                if self.on_full == 'drop' or not self._condition.wait_for(
+                        lambda: len(self._pending) < self.max_pending,
+                        self.block_timeout):
+                    self.dropped += 1
+                    return False
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append(row)
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify_all()
+        return True
+
+    def on_message(self, printer):
+        '''
+        Returns an on_message callback for a push event handler,
+        adding the current messages of given printer
+        '''
+        def on_message(api, message):
+            if 'current' in message:
+                self.add(printer, message['current'])
+        return on_message
+
+    def _due(self):
+        if not self._pending:
+            return False
+        return (self._closed or len(self._pending) >= self.batch_size or
+                self._handled < self._flush_target or
+                time.monotonic() - self._oldest >= self.flush_interval)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._due():
+                    if self._closed:
+                        return
+                    timeout = self.flush_interval
+                    if self._pending:
+                        timeout -= time.monotonic() - self._oldest
+                    self._condition.wait(max(timeout, 0.001))
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+                self._handled += len(batch)
+                latency = time.monotonic() - self._oldest
+                self._oldest = time.monotonic() if self._pending else None
+                # make room for blocked add() calls
+                self._condition.notify_all()
+            try:
+                self._write(batch)
+            except Exception as e:
+                with self._condition:
+                    self.error = e
+                    self.dropped += len(batch)
+                    self._written += len(batch)
+                    self._condition.notify_all()
+                continue
+            with self._condition:
+                self.rows_written += len(batch)
+                self.files_written += 1
+                self._written += len(batch)
+                self.flush_latency = latency
+                self._condition.notify_all()
+
+    def _write(self, rows):
+        self._sequence += 1
+        path = os.path.join(self.directory, '{}-{:06d}.{}'.format(
+            self.prefix, self._sequence, self.format))
+        data = columns(rows, self._schema)
+        partial = path + '.part'
+        if self.format == 'npz':
+            with open(partial, 'wb') as f:
+                np.savez_compressed(f, **{name: np.array(values)
+                                          for name, values in data.items()})
+        elif self.format == 'parquet':
+            pyarrow.parquet.write_table(pyarrow.table(data), partial)
+        else:
+            with open(partial, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(data)
+                writer.writerows(zip(*data.values()))
+        # readers never see a half written file
+        os.replace(partial, path)
+        if self.max_files:
+            for old in self._files()[:-self.max_files]:
+                os.remove(old)
+
+    def flush(self, timeout=None):
+        '''
+        Writes everything queued so far, waits until it is written
+        '''
+        with self._condition:
+            target = self._handled + len(self._pending)
+            self._flush_target = target
+            self._condition.notify_all()
+            return self._condition.wait_for(
+                lambda: self._handled >= target and
+                self._written >= target, timeout)
+
+    def close(self):
+        '''
+        Writes the remaining rows and stops the writer
+        '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
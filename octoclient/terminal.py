@@ -0,0 +1,231 @@
+'''
+Bounded terminal log buffers
+
+The current push messages carry the serial terminal lines (logs) of
+a printer. TerminalBuffer keeps the recent ones in fixed memory: one
+bytearray arena used as a ring, with arrays of line offsets and lengths,
+and an inverted index of common tokens (Error:, T:, ok, G and M codes...)
+so searching for them does not scan all the lines.
+'''
+from array import array
+from collections import deque
+import re
+import threading
+
+
+_CODE = re.compile(r'[GMT]\d+$')
+_LINE_NUMBER = re.compile(r'N\d+$')
+_CHECKSUM = re.compile(r'\*\d+$')
+# the line lists of current messages
+KINDS = ('logs', 'messages')
+
+
+def tokens(line):
+    '''
+    Returns the set of index tokens of a line
+
+    Words with a colon are indexed up to the colon (T:210.0 as T:),
+    G, M and T codes as they are (M105) and alphabetic words
+    as they are (ok), other words (numbers, parameters) are not indexed.
+    Sent lines carry a line number and a checksum (N12 M105*38),
+    the line number is skipped and the checksum removed.
+    '''
+    result = set()
+    for word in line.split():
+        if _LINE_NUMBER.match(word):
+            continue
+        word = _CHECKSUM.sub('', word)
+        colon = word.find(':')
+        if colon > 0:
+            result.add(word[:colon + 1])
+        elif _CODE.match(word) or word.isalpha():
+            result.add(word)
+    return result
+
+
+class TerminalBuffer:
+    '''
+    Ring buffer of terminal lines of one printer
+
+    capacity is the size of the byte arena, max_lines the maximum number
+    of lines kept, the oldest lines are dropped when either runs out.
+    Lines get increasing sequence numbers, the oldest kept one is first.
+    '''
+
+    def __init__(self, capacity=1024 * 1024, max_lines=16384):
+        self.capacity = capacity
+        self.max_lines = max_lines
+        self.arena = bytearray(capacity)
+        self.starts = array('q', [0]) * max_lines
+        self.lengths = array('q', [0]) * max_lines
+        self.first = 0  # sequence number of the oldest line
+        self.next = 0  # sequence number of the next line
+        self.index = {}  # token -> deque of sequence numbers
+        self._position = 0  # where the next line goes in the arena
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.next - self.first
+
+    def _line(self, seq):
+        slot = seq % self.max_lines
+        start = self.starts[slot]
+        return self.arena[start:start + self.lengths[slot]].decode(
+            'utf-8', 'replace')
+
+    def _evict(self):
+        seq = self.first
+        for token in tokens(self._line(seq)):
+            postings = self.index[token]
+            postings.popleft()  # the oldest line is always first
+            if not postings:
+                del self.index[token]
+        self.first += 1
+
+    def _ahead(self, seq):
+        '''
+        Distance of the start of a line ahead of the write position
+        in the ring, the oldest lines are the nearest
+        '''
+        return (self.starts[seq % self.max_lines] - self._position) % \
+            self.capacity
+
+    def append(self, line):
+        '''
+        Adds a line (str), dropping the oldest ones if needed
+
+        Returns its sequence number
+        '''
+        data = line.encode('utf-8')[:self.capacity]
+        with self._lock:
+            if len(self) == self.max_lines:
+                self._evict()
+            start = self._position
+            if start + len(data) > self.capacity:
+                start = 0  # the rest of the arena stays unused this round
+            # bytes of the ring the line takes, from the write position on
+            span = (start - self._position) % self.capacity + len(data)
+            while len(self) and self._ahead(self.first) < span:
+                self._evict()
+            end = start + len(data)
+            self.arena[start:end] = data
+            seq = self.next
+            slot = seq % self.max_lines
+            self.starts[slot] = start
+            self.lengths[slot] = len(data)
+            self.next += 1
+            self._position = end % self.capacity
+            for token in tokens(self._line(seq)):
+                self.index.setdefault(token, deque()).append(seq)
+            return seq
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+    def lines(self, since=None):
+        '''
+        Returns a list of (sequence number, line) tuples, oldest first,
+        optionally only those with sequence numbers since given one
+        '''
+        with self._lock:
+            start = self.first if since is None else max(since, self.first)
+            return [(seq, self._line(seq)) for seq in range(start, self.next)]
+
+    def search(self, token, contains=None, limit=None):
+        '''
+        Returns (sequence number, line) tuples of the lines with given
+        token (as indexed, see tokens(), e.g. 'Error:' or 'M104'),
+        newest first, optionally only those containing given text
+
+        Raises ValueError for text that is not an index token,
+        use grep() for that
+        '''
+        indexed = tokens(token)
+        if indexed != {token}:
+            raise ValueError('{!r} is not an index token'.format(token))
+        result = []
+        with self._lock:
+            for seq in reversed(self.index.get(token, ())):
+                line = self._line(seq)
+                if contains is None or contains in line:
+                    result.append((seq, line))
+                    if limit is not None and len(result) >= limit:
+                        break
+        return result
+
+    def grep(self, text, limit=None):
+        '''
+        Returns (sequence number, line) tuples of the lines containing
+        text, newest first, scanning all of them
+        '''
+        result = []
+        with self._lock:
+            for seq in range(self.next - 1, self.first - 1, -1):
+                line = self._line(seq)
+                if text in line:
+                    result.append((seq, line))
+                    if limit is not None and len(result) >= limit:
+                        break
+        return result
+
+
+class TerminalLog:
+    '''
+    TerminalBuffers of every printer of a fleet
+
+    Use on_message(printer) as the on_message callback of a push
+    event handler, the lines of current messages are appended, every
+    kind to a buffer of its own: logs (the whole terminal, Send: and
+    Recv: lines) and messages (the lines received from the printer).
+    Pass kinds to keep only some of them.
+    '''
+
+    def __init__(self, capacity=1024 * 1024, max_lines=16384,
+                 kinds=KINDS):
+        unknown = set(kinds) - set(KINDS)
+        if unknown:
+            raise ValueError('Unknown kinds: {}'.format(
+                ', '.join(sorted(unknown))))
+        self.capacity = capacity
+        self.max_lines = max_lines
+        self.kinds = tuple(kinds)
+        self.buffers = {}  # (printer, kind) -> TerminalBuffer
+        self._lock = threading.Lock()
+
+    def buffer(self, printer, kind='logs'):
+        with self._lock:
+            buffer = self.buffers.get((printer, kind))
+            if buffer is None:
+                buffer = TerminalBuffer(self.capacity, self.max_lines)
+                self.buffers[(printer, kind)] = buffer
+            return buffer
+
+    def on_message(self, printer):
+        def on_message(api, message):
+            if 'current' in message:
+                current = message['current']
+                for kind in self.kinds:
+                    self.buffer(printer, kind).extend(current.get(kind) or ())
+        return on_message
+
+    def _buffers(self, kind):
+        with self._lock:
+            return {printer: buffer
+                    for (printer, k), buffer in self.buffers.items()
+                    if k == kind}
+
+    def search(self, token, contains=None, limit=None, kind='logs'):
+        '''
+        TerminalBuffer.search() of all the printers in buffers
+        of given kind, returns a dict mapping printers to the results
+        '''
+        return {printer: buffer.search(token, contains, limit)
+                for printer, buffer in self._buffers(kind).items()}
+
+    def grep(self, text, limit=None, kind='logs'):
+        '''
+        TerminalBuffer.grep() of all the printers
+        '''
+        return {printer: buffer.grep(text, limit)
+                for printer, buffer in self._buffers(kind).items()}
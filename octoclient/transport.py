@@ -0,0 +1,172 @@
+import time
+from threading import Event, Thread
+
+import requests
+import websocket
+
+from octoclient.sockjsclient import SockJSClient
+from octoclient.websocket import WebSocketEventHandler
+from octoclient.xhrstreaming import XHRStreamingEventHandler
+from octoclient.xhrstreaminggenerator import XHRStreamingGenerator
+
+
+WEBSOCKET = 'websocket'
+XHR_STREAMING = 'xhr_streaming'
+
+TRANSPORTS = {
+    WEBSOCKET: WebSocketEventHandler,
+    XHR_STREAMING: XHRStreamingEventHandler,
+}
+
+
+def probe(url, session=None, timeout=5):
+    """
+    Measures how the SockJS server at url can be reached
+
+    Returns a dict with the sockjs/info response (info), the time it took
+    in seconds (http_latency) and the time a WebSocket handshake took
+    (websocket_latency, None if it failed or the server has websockets
+    disabled, websocket_error is the exception then)
+    """
+    result = {'websocket_latency': None, 'websocket_error': None}
+    generator = XHRStreamingGenerator(url, session=session)
+    start = time.perf_counter()
+    result['info'] = generator.info()
+    result['http_latency'] = time.perf_counter() - start
+    if not result['info'].get('websocket', True):
+        return result
+
+    ws_url = WebSocketEventHandler(url).url
+    start = time.perf_counter()
+    try:
+        websocket.create_connection(ws_url, timeout=timeout).close()
+    except Exception as e:
+        result['websocket_error'] = e
+    else:
+        result['websocket_latency'] = time.perf_counter() - start
+    return result
+
+
+def choose_transport(probed, slow_factor=10):
+    """
+    Picks the transport name given the result of probe()
+
+    WebSocket carries the least overhead per message, so it is preferred
+    whenever it works, unless its handshake took more than slow_factor
+    times the HTTP round trip (usually a sign of a buffering proxy)
+    """
+    latency = probed['websocket_latency']
+    if latency is None:
+        return XHR_STREAMING
+    if latency > slow_factor * max(probed['http_latency'], 0.001):
+        return XHR_STREAMING
+    return WEBSOCKET
+
+
+class AutoEventHandler(SockJSClient):
+    """
+    SockJS event handler choosing the transport by itself
+
+    On run(), the server is probed (see probe()) and a WebSocketEventHandler
+    or an XHRStreamingEventHandler is started with the callbacks given here.
+    If the WebSocket connection ever fails to open (e.g. a proxy
+    refuses the upgrade), it falls back to XHR streaming, if it closes after
+    it worked, it is opened again. Connections that close within
+    MIN_UPTIME seconds of opening are reopened with an exponential backoff,
+    MAX_DROPS of them in a row make a WebSocket fall back to XHR streaming
+    too (e.g. a proxy accepting the upgrade and closing right away).
+
+    params are the same as for the other handlers, plus:
+    transport - optional name of the transport to start with
+                ('websocket' or 'xhr_streaming'), skips the probe
+    timeout - seconds to wait for the WebSocket handshake in the probe
+
+    The chosen transport is in the transport attribute, the probe result
+    in probed and the current handler in handler.
+    """
+    MIN_DELAY = 0.5  # seconds of the first backoff
+    MAX_DELAY = 30  # seconds between reconnection attempts at most
+    MIN_UPTIME = 10  # seconds a connection has to stay open to count as up
+    MAX_DROPS = 3  # quickly dropped WebSocket connections before fallback
+
+    def __init__(self, url, on_open=None, on_close=None, on_message=None,
+                 session=None, metrics=None, on_frame=None, transport=None,
+                 timeout=5):
+        super().__init__(url, on_open, on_close, on_message, metrics,
+                         on_frame)
+        self.base = url
+        self.session = session or requests.Session()
+        self.transport = transport
+        self.timeout = timeout
+        self.probed = None
+        self.handler = None
+        self.fallbacks = 0
+        self._stop = Event()
+
+    def _handler(self, transport):
+        opened = []
+
+        def on_open(api):
+            opened.append(time.monotonic())
+            self.on_open(api)
+
+        def on_close(api, *args):
+            # websocket-client also passes the close status and reason,
+            # a connection that never opened is not reported
+            if opened:
+                self.on_close(api)
+
+        kwargs = {'on_open': on_open, 'on_close': on_close,
+                  'on_message': self.on_message, 'metrics': self.metrics,
+                  'on_frame': self.on_frame}
+        if transport == XHR_STREAMING:
+            kwargs['session'] = self.session
+        return TRANSPORTS[transport](self.base, **kwargs), opened
+
+    def _run(self):
+        if self.transport is None:
+            self.probed = probe(self.base, self.session, self.timeout)
+            self.transport = choose_transport(self.probed)
+        delay = 0
+        drops = 0  # connections in a row closed soon after opening
+        while not self._stop.is_set():
+            self.handler, opened = self._handler(self.transport)
+            self.handler.run()
+            self.handler.wait()
+            if opened and time.monotonic() - opened[0] >= self.MIN_UPTIME:
+                delay = drops = 0
+            elif not opened and self.transport == WEBSOCKET:
+                self.transport = XHR_STREAMING
+                self.fallbacks += 1
+            else:
+                # not reachable, or dropping the connections, back off
+                drops += bool(opened)
+                if drops >= self.MAX_DROPS and self.transport == WEBSOCKET:
+                    self.transport = XHR_STREAMING
+                    self.fallbacks += 1
+                    drops = 0
+                delay = min(max(delay * 2, self.MIN_DELAY), self.MAX_DELAY)
+            self._stop.wait(delay)
+
+    def run(self):
+        """
+        Probes the server and runs the chosen handler in a thread
+        """
+        self.thread = Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        """
+        Stops reconnecting and closes the current WebSocket connection
+        (a running XHR streaming request ends only with the server)
+        """
+        self._stop.set()
+        if self.transport == WEBSOCKET and self.handler is not None:
+            self.handler.socket.close()
+
+    def send(self, data):
+        """
+        Sends data with the current handler
+        """
+        return self.handler.send(data)
@@ -0,0 +1,232 @@
+'''
+Webcam snapshots and MJPEG streams of OctoPrint instances
+
+Frames are read into preallocated buffers and handed out as memoryview
+slices of them, no copy is made per frame. A memoryview is only valid until
+the next frame is requested, copy it (bytes(frame)) to keep it longer.
+'''
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import threading
+import time
+from urllib import parse as urlparse
+
+import requests
+
+
+SOI = b'\xff\xd8'  # JPEG start of image
+EOI = b'\xff\xd9'  # JPEG end of image
+
+
+class MJPEGReader:
+    '''
+    Incremental parser of a multipart MJPEG stream
+
+    stream is a file-like object with readinto() (e.g. the raw attribute
+    of a streamed requests response). Iterating yields the JPEG frames as
+    memoryviews of one internal buffer, frames are found by the JPEG start
+    and end of image markers, so the multipart headers do not matter.
+    The buffer is grown if a frame does not fit in it.
+    '''
+
+    def __init__(self, stream, buffer_size=1024 * 1024):
+        self.stream = stream
+        self.buffer = bytearray(buffer_size)
+        self.start = 0  # first byte not consumed yet
+        self.end = 0  # end of data read so far
+        self.frames = 0
+
+    def _fill(self):
+        '''
+        Reads more data after the end of the buffered data,
+        compacting or growing the buffer if there is no room
+
+        Returns the number of bytes read, 0 at the end of the stream
+        '''
+        if self.end == len(self.buffer):
+            pending = self.end - self.start
+            if pending * 2 > len(self.buffer):
+                # a new buffer, the old one may still be exported
+                buffer = bytearray(len(self.buffer) * 2)
+                buffer[:pending] = self.buffer[self.start:self.end]
+                self.buffer = buffer
+            else:
+                self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, pending
+        with memoryview(self.buffer) as view, view[self.end:] as free:
+            read = self.stream.readinto(free) or 0
+        self.end += read
+        return read
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        buffer = self.buffer
+        soi = -1
+        scanned = self.start
+        while True:
+            if soi < 0:
+                soi = buffer.find(SOI, scanned, self.end)
+                if soi >= 0:
+                    self.start, scanned = soi, soi + 2
+                else:
+                    # drop the garbage, keep a possible half of the marker
+                    self.start = scanned = max(self.start, self.end - 1)
+            if soi >= 0:
+                eoi = buffer.find(EOI, scanned, self.end)
+                if eoi >= 0:
+                    self.start = eoi + 2
+                    self.frames += 1
+                    return memoryview(buffer)[soi:eoi + 2]
+                scanned = max(scanned, self.end - 1)
+            # _fill() may move the data to the beginning of the buffer
+            shift = self.start
+            if not self._fill():
+                raise StopIteration
+            shift -= self.start
+            buffer = self.buffer
+            scanned -= shift
+            if soi >= 0:
+                soi -= shift
+
+
+class Webcam:
+    '''
+    Webcam of one OctoPrint instance
+
+    The snapshot and stream URLs are discovered from the webcam settings
+    of the given OctoClient, unless given explicitly. Relative URLs
+    (the default /webcam/?action=... ones) are relative to the client URL.
+    '''
+
+    def __init__(self, client=None, *, snapshot_url=None, stream_url=None,
+                 session=None):
+        if client is not None and not (snapshot_url and stream_url):
+            settings = client.settings().get('webcam', {})
+            snapshot_url = snapshot_url or settings.get('snapshotUrl')
+            stream_url = stream_url or settings.get('streamUrl')
+        base = client.url if client is not None else ''
+        self.snapshot_url = (urlparse.urljoin(base, snapshot_url)
+                             if snapshot_url else None)
+        self.stream_url = (urlparse.urljoin(base, stream_url)
+                           if stream_url else None)
+        self.session = session or requests.Session()
+
+    def _get(self, url, what):
+        if not url:
+            raise RuntimeError('No webcam {} URL configured'.format(what))
+        response = self.session.get(url, stream=True)
+        if not (200 <= response.status_code < 210):
+            response.close()
+            msg = 'Reply for {} was not OK: {}'
+            raise RuntimeError(msg.format(url, response.status_code))
+        return response
+
+    def snapshot(self, buffer=None):
+        '''
+        Retrieves one snapshot
+
+        If buffer (a bytearray) is given, the image is read into it
+        (it is grown if needed) and a memoryview of it is returned,
+        otherwise returns bytes
+        '''
+        with self._get(self.snapshot_url, 'snapshot') as response:
+            if buffer is None:
+                return response.content
+            size = 0
+            while True:
+                if size == len(buffer):
+                    buffer.extend(bytes(max(len(buffer), 64 * 1024)))
+                with memoryview(buffer) as view, view[size:] as free:
+                    read = response.raw.readinto(free)
+                if not read:
+                    break
+                size += read
+            return memoryview(buffer)[:size]
+
+    def frames(self, buffer_size=1024 * 1024):
+        '''
+        Generator yielding frames of the MJPEG stream as memoryviews,
+        see MJPEGReader
+        '''
+        with self._get(self.stream_url, 'stream') as response:
+            for frame in MJPEGReader(response.raw, buffer_size):
+                yield frame
+
+
+class SnapshotPoller:
+    '''
+    Polls snapshots of many webcams with a pool of threads
+
+    webcams is a dict mapping names to Webcam instances. on_frame is called
+    with the name and a memoryview of the snapshot, the memoryview is valid
+    only during the call (every webcam has one reused buffer).
+    on_error is optionally called with the name and the exception.
+
+    No webcam is polled more often than fps times per second,
+    they are polled as often as the pool keeps up with otherwise.
+    '''
+
+    def __init__(self, webcams, on_frame, *, fps=1.0, workers=8,
+                 on_error=None):
+        self.webcams = dict(webcams)
+        self.on_frame = on_frame
+        self.on_error = on_error
+        self.interval = 1.0 / fps
+        self.workers = workers
+        self.buffers = {name: bytearray(256 * 1024) for name in self.webcams}
+        self._stop = threading.Event()
+        self._condition = threading.Condition()
+        self._due = []
+        self.thread = None
+
+    def _poll(self, name):
+        started = time.monotonic()
+        try:
+            with self.webcams[name].snapshot(self.buffers[name]) as frame:
+                self.on_frame(name, frame)
+        except Exception as e:
+            if self.on_error is not None:
+                self.on_error(name, e)
+        finally:
+            with self._condition:
+                heapq.heappush(self._due, (started + self.interval, name))
+                self._condition.notify()
+
+    def _run(self):
+        with self._condition:
+            now = time.monotonic()
+            self._due = [(now, name) for name in sorted(self.webcams)]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while not self._stop.is_set():
+                with self._condition:
+                    wait = 0.1
+                    if self._due:
+                        wait = self._due[0][0] - time.monotonic()
+                    if wait > 0:
+                        self._condition.wait(min(wait, 0.1))
+                        continue
+                    _, name = heapq.heappop(self._due)
+                # the webcam is pushed back to self._due when done,
+                # so it is never polled twice at once
+                executor.submit(self._poll, name)
+
+    def start(self):
+        '''
+        Starts polling in a background thread
+        '''
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stops polling and waits for the running snapshots
+        '''
+        self._stop.set()
+        with self._condition:
+            self._condition.notify()
+        if self.thread is not None:
+            self.thread.join()
@@ -20,9 +20,16 @@ class WebSocketEventHandler(SockJSClient):
                  and message in dict format
                - executes on received message, if array, then it executes
                  for every value of given array
+    metrics - optional octoclient.metrics.StreamMetrics instance
+            - collects frame and message counters of this connection
+    on_frame - optional callback function with 1 argument, raw frame (str)
+             - executes on every received frame before it is decoded
+               (e.g. octoclient.recording.Recorder)
     """
-    def __init__(self, url, on_open=None, on_close=None, on_message=None):
-        super().__init__(url, on_open, on_close, on_message)
+    def __init__(self, url, on_open=None, on_close=None, on_message=None,
+                 metrics=None, on_frame=None):
+        super().__init__(url, on_open, on_close, on_message, metrics,
+                         on_frame)
 
         self.url = self.url.format(protocol="wss" if self.secure else "ws",
                                    method="websocket")
@@ -33,11 +40,7 @@ class WebSocketEventHandler(SockJSClient):
         Executes given callbacks on events
         """
         def on_message(ws, data):
-            if data.startswith('m'):
-                self.on_message(ws, json.loads(data[1:]))
-            elif data.startswith('a'):
-                for msg in json.loads(data[1:]):
-                    self.on_message(ws, msg)
+            self._dispatch(ws, data)
 
         self.socket = websocket.WebSocketApp(self.url,
                                              on_open=self.on_open,
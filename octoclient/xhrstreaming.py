@@ -20,11 +20,17 @@ class XHRStreamingEventHandler(SockJSClient):
                  and message in dict format
                - executes on received message, if array, then it executes
                  for every value of given array
+    metrics - optional octoclient.metrics.StreamMetrics instance
+            - collects frame and message counters of this connection
+    on_frame - optional callback function with 1 argument, raw frame (str)
+             - executes on every received frame before it is decoded
+               (e.g. octoclient.recording.Recorder)
     """
-    def __init__(self, url,
-                 on_open=None, on_close=None, on_message=None, session=None):
+    def __init__(self, url, on_open=None, on_close=None, on_message=None,
+                 session=None, metrics=None, on_frame=None):
 
-        super().__init__(url, on_open, on_close, on_message)
+        super().__init__(url, on_open, on_close, on_message, metrics,
+                         on_frame)
 
         self.socket = session or requests.Session()
 
@@ -47,17 +53,12 @@ class XHRStreamingEventHandler(SockJSClient):
             try:
                 connection = self.socket.post(url, stream=True)
                 for line in connection.iter_lines():
-                    line = line.decode('utf-8')
-                    if line.startswith('o'):
+                    kind = self._dispatch(self, line.decode('utf-8'),
+                                          len(line))
+                    if kind == 'o':
                         self.on_open(self)
-                    elif line.startswith('c'):
+                    elif kind == 'c':
                         self.on_close(self)
-                    elif line.startswith('m'):
-                        data = json.loads(line[1:])
-                        self.on_message(self, data)
-                    elif line.startswith('a'):
-                        for msg in json.loads(line[1:]):
-                            self.on_message(self, msg)
             finally:
                 connection.close()
 
@@ -1,10 +1,13 @@
 import json
 import random
 import string
+import time
 from urllib import parse as urlparse
 
 import requests
 
+from octoclient.sockjsclient import decode_frame
+
 
 class XHRStreamingGenerator:
     """
@@ -16,12 +19,22 @@ class XHRStreamingGenerator:
         letters = string.ascii_lowercase + string.digits
         return ''.join(random.choice(letters) for c in range(length))
 
-    def __init__(self, url, session=None):
+    def __init__(self, url, session=None, metrics=None, on_frame=None):
         """
         Initialize the connection
         The url shall include the protocol and port (if necessary)
+
+        If metrics (octoclient.metrics.StreamMetrics) is given,
+        it collects frame and message counters of this connection,
+        the time the consumer spends between two messages is recorded
+        as the callback time
+
+        on_frame is an optional callable called with every raw frame (str)
+        before it is decoded (e.g. octoclient.recording.Recorder)
         """
         self.session = session or requests.Session()
+        self.metrics = metrics
+        self.on_frame = on_frame
         r1 = str(random.randint(0, 1000))
         conn_id = self.random_str(8)
         self.base_url = url
@@ -41,20 +54,20 @@ class XHRStreamingGenerator:
             try:
                 connection = self.session.post(url, stream=True)
                 for line in connection.iter_lines():
-                    line = line.decode('utf-8')
-                    if line.startswith('o'):
-                        continue  # open connection
-                    if line.startswith('c'):
-                        continue  # close connection
-                    if line.startswith('h'):
-                        continue  # heartbeat
-                    if line.startswith('m'):
-                        yield json.loads(line[1:])
-                        continue  # message
-                    if line.startswith('a'):
-                        for msg in json.loads(line[1:]):
+                    frame = line.decode('utf-8')
+                    if self.on_frame is not None:
+                        self.on_frame(frame)
+                    # open, close and heartbeat frames carry no messages
+                    _, messages = decode_frame(frame, self.metrics,
+                                               len(line))
+                    for msg in messages:
+                        if self.metrics is None:
                             yield msg
-                        continue  # array
+                            continue
+                        dispatched, start = time.time(), time.perf_counter()
+                        yield msg
+                        self.metrics.message(msg, dispatched,
+                                             time.perf_counter() - start)
             finally:
                 connection.close()
 
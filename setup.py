@@ -13,6 +13,15 @@ setup(
     url='https://github.com/hroncok/octoclient',
     packages=[p for p in find_packages() if p != 'tests'],
     install_requires=['requests', 'websocket-client'],
+    extras_require={
+        'analysis': ['numpy'],
+        'telemetry': ['numpy'],
+        'parquet': ['numpy', 'pyarrow'],
+        'statetable': ['numpy'],
+    },
+    entry_points={
+        'console_scripts': ['octoclient = octoclient.cli:main'],
+    },
     setup_requires=['pytest-runner'],
     tests_require=['pytest', 'betamax-serializers', 'betamax'],
     classifiers=[
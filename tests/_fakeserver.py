@@ -0,0 +1,158 @@
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from _common import APIKEY
+
+
+_MISSING = object()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.fake.lock:
+            self.server.fake.connections += 1
+
+    def _reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            return self.rfile.read(length)
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                chunk = self.rfile.read(size + 2)[:size]
+                if not size:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+        return b''
+
+    def _serve_bytes(self, content):
+        range_header = self.headers.get('Range', '')
+        match = re.match(r'bytes=(\d+)-(\d*)$', range_header)
+        if not match:
+            self._reply(200, content, {'Accept-Ranges': 'bytes'})
+            return
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(content) - 1
+        if start >= len(content):
+            self._reply(416, headers={
+                'Content-Range': 'bytes */{}'.format(len(content))})
+            return
+        end = min(end, len(content) - 1)
+        content_range = 'bytes {}-{}/{}'.format(start, end, len(content))
+        self._reply(206, content[start:end + 1],
+                    {'Content-Range': content_range})
+
+    def _handle(self, method):
+        server = self.server.fake
+        path = self.path.split('?')[0]
+        body = self._body() if method in ('POST', 'PUT') else b''
+        with server.lock:
+            server.requests.append((method, self.path, body,
+                                    dict(self.headers)))
+        if (not server.is_public(path) and
+                self.headers.get('X-Api-Key') != APIKEY):
+            self._reply(403, b'Invalid API key')
+            return
+        route = server.route(method, path)
+        if route is _MISSING:
+            self._reply(404, b'Not found')
+            return
+        if callable(route):
+            route = route(self, body)
+            if isinstance(route, tuple):
+                self._reply(*route)
+                return
+        if isinstance(route, bytes):
+            self._serve_bytes(route)
+        elif route is None:
+            self._reply(204)
+        else:
+            self._reply(200, json.dumps(route).encode('utf-8'),
+                        {'Content-Type': 'application/json'})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class FakeOctoPrint:
+    '''
+    Minimal local OctoPrint look-alike for tests that need a real HTTP server
+
+    Routes map (method, path) to a JSON-serializable payload, to bytes
+    (served with Range support), to None (204 No Content) or to a callable
+    taking the request handler and the request body.
+    A route path ending with / matches every path starting with it.
+
+    Paths in public are served without the API key,
+    again with / at the end meaning a prefix
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+        self.connections = 0  # TCP connections accepted
+        self.public = set()
+        self.routes = {
+            ('GET', '/api/version'): {'api': '0.1', 'server': '1.3.6'},
+        }
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.fake = self
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(0.05,))
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def is_public(self, path):
+        return any(path == p or (p.endswith('/') and path.startswith(p))
+                   for p in self.public)
+
+    def route(self, method, path):
+        route = self.routes.get((method, path), _MISSING)
+        if route is not _MISSING:
+            return route
+        prefixes = [p for m, p in self.routes
+                    if m == method and p.endswith('/') and path.startswith(p)]
+        if not prefixes:
+            return _MISSING
+        return self.routes[(method, max(prefixes, key=len))]
+
+    def paths(self, method='GET'):
+        with self.lock:
+            return [p for m, p, _, _ in self.requests if m == method]
@@ -0,0 +1,25 @@
+import pytest
+
+from octoclient import OctoClient
+
+from _common import APIKEY
+from _fakeserver import FakeOctoPrint
+
+
+# Test modules add their routes by overriding octoprint:
+#
+# @pytest.fixture
+# def octoprint(octoprint):
+#     octoprint.routes[('GET', '/api/job')] = JOB
+#     return octoprint
+
+
+@pytest.fixture
+def octoprint():
+    with FakeOctoPrint() as server:
+        yield server
+
+
+@pytest.fixture
+def client(octoprint):
+    return OctoClient(url=octoprint.url, apikey=APIKEY)
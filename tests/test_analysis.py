@@ -0,0 +1,178 @@
+import math
+import random
+import re
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from octoclient.analysis import analyze, parse_numbers  # noqa: E402
+
+
+def reference(path, filament_diameter=1.75):
+    '''
+    Straightforward line by line implementation to compare with
+    '''
+    pos = dict.fromkeys('XYZE', 0.0)
+    relative = relative_e = False
+    feedrate = None
+    tool = 0
+    time = 0.0
+    extruded = {}
+    printing, travel, layers = [], [], set()
+    with open(path) as f:
+        for line in f:
+            line = line.split(';')[0].strip()
+            if not line:
+                continue
+            command = re.match(r'[GMT]\d+', line).group()
+            params = {}
+            if command.startswith('G'):
+                for axis, value in re.findall(r'([XYZEFPS])([-+]?[\d.]+)',
+                                              line[len(command):]):
+                    params[axis] = float(value)
+            if command == 'G90':
+                relative = relative_e = False
+            elif command == 'G91':
+                relative = relative_e = True
+            elif command == 'M82':
+                relative_e = False
+            elif command == 'M83':
+                relative_e = True
+            elif command.startswith('T'):
+                tool = int(command[1:])
+            elif command == 'G92':
+                pos.update(params)
+            elif command == 'G28':
+                axes = [a for a in 'XYZ' if a in params] or 'XYZ'
+                for axis in axes:
+                    pos[axis] = 0.0
+            elif command == 'G4':
+                time += params.get('P', 0) / 1000 + params.get('S', 0)
+            elif command in ('G0', 'G1'):
+                if 'F' in params:
+                    feedrate = params['F']
+                new = dict(pos)
+                for axis in 'XYZE':
+                    if axis in params:
+                        rel = relative_e if axis == 'E' else relative
+                        new[axis] = (pos[axis] if rel else 0) + params[axis]
+                d = {a: new[a] - pos[a] for a in 'XYZE'}
+                dist = math.sqrt(d['X'] ** 2 + d['Y'] ** 2 + d['Z'] ** 2) \
+                    or abs(d['E'])
+                if feedrate:
+                    time += dist / feedrate * 60
+                total, maximum = extruded.get(tool, (0.0, 0.0))
+                total += d['E']
+                extruded[tool] = (total, max(maximum, total))
+                if dist > 0:
+                    travel += [pos, new]
+                if (d['X'] or d['Y']) and d['E'] > 0:
+                    printing += [pos, new]
+                    layers.add(round(new['Z'], 4))
+                pos = new
+    area = math.pi * (filament_diameter / 2) ** 2
+    return {
+        'estimatedPrintTime': time,
+        'filament': {'tool{}'.format(t): {'length': m,
+                                          'volume': m * area / 1000}
+                     for t, (_, m) in extruded.items() if m > 0},
+        'printingArea': {'minX': min(p['X'] for p in printing),
+                         'maxX': max(p['X'] for p in printing),
+                         'minY': min(p['Y'] for p in printing),
+                         'maxY': max(p['Y'] for p in printing),
+                         'minZ': min(p['Z'] for p in printing),
+                         'maxZ': max(p['Z'] for p in printing)},
+        'layers': len(layers),
+    }
+
+
+def generate(path, layers=30, seed=42):
+    rnd = random.Random(seed)
+    lines = ['; generated by test', 'G21', 'G90', 'M82', 'M104 S200 T0',
+             'G28', 'G92 E0', 'M117 Hello X Y Z', 'G1 Z0.3 F3000']
+    e = 0.0
+    for layer in range(layers):
+        z = 0.3 + layer * 0.2
+        lines.append(';LAYER:{}'.format(layer))
+        lines.append('G0 F9000 X{:.3f} Y{:.3f} Z{:.3f}'.format(
+            rnd.uniform(10, 200), rnd.uniform(10, 200), z))
+        if layer % 7 == 3:
+            lines.append('T1' if layer % 2 else 'T0')
+        for _ in range(50):
+            e += rnd.uniform(0.01, 0.5)
+            lines.append('G1 X{:.3f} Y{:.3f} E{:.5f} F{}'.format(
+                rnd.uniform(10, 200), rnd.uniform(10, 200), e,
+                rnd.choice((1200, 1800, 2400))))
+        lines.append('G1 E{:.5f} F2400 ; retract'.format(e - 1))
+        lines.append('G1 E{:.5f}'.format(e))
+        if layer % 5 == 4:
+            lines.append('G92 E0')
+            e = 0.0
+        if layer % 9 == 8:
+            lines.append('M83')
+            lines.append('G1X20Y20E1.5')
+            lines.append('G1 X{:.1f} E-.5'.format(rnd.uniform(10, 200)))
+            lines.append('M82')
+            lines.append('G92 E0')
+            e = 0.0
+        if layer % 11 == 10:
+            lines += ['G91', 'G1 Z1 F600', 'G1 Z-1', 'G90', 'G4 P500']
+    lines.append('G28 X')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+@pytest.fixture
+def gcode(tmp_path):
+    path = str(tmp_path / 'test.gcode')
+    generate(path)
+    return path
+
+
+class TestAnalysis:
+    def test_parse_numbers(self):
+        buf = np.frombuffer(b'X10 Y-2.5 E.75 F1800 Z0.2 X12345.67891 X '
+                            b'E+3. X1.2.3\n', dtype=np.uint8)
+        positions = np.flatnonzero(np.isin(buf, list(b'XYZEF')))
+        values = parse_numbers(buf, positions)
+        assert np.isnan(values[6])
+        values = np.delete(values, 6)
+        assert values.tolist() == [10, -2.5, 0.75, 1800, 0.2, 12345.67891,
+                                   3, 1.2]
+
+    @pytest.mark.parametrize('chunk_size', (64, 1000, 4 * 1024 * 1024))
+    def test_matches_reference(self, gcode, chunk_size):
+        result = analyze(gcode, chunk_size=chunk_size)
+        expected = reference(gcode)
+        assert result['estimatedPrintTime'] == pytest.approx(
+            expected['estimatedPrintTime'])
+        assert set(result['filament']) == {'tool0', 'tool1'}
+        for tool, values in expected['filament'].items():
+            assert result['filament'][tool]['length'] == pytest.approx(
+                values['length'])
+            assert result['filament'][tool]['volume'] == pytest.approx(
+                values['volume'])
+        for key, value in expected['printingArea'].items():
+            assert result['printingArea'][key] == pytest.approx(value)
+        assert result['layers'] == expected['layers'] == 30
+        width = result['dimensions']['width']
+        assert width == pytest.approx(result['printingArea']['maxX'] -
+                                      result['printingArea']['minX'])
+
+    def test_shape(self, gcode):
+        result = analyze(gcode)
+        assert set(result) == {'estimatedPrintTime', 'filament',
+                               'printingArea', 'dimensions', 'travelArea',
+                               'travelDimensions', 'layers'}
+        assert set(result['travelArea']) == {'minX', 'maxX', 'minY', 'maxY',
+                                             'minZ', 'maxZ'}
+        assert result['travelArea']['maxZ'] >= result['printingArea']['maxZ']
+
+    def test_empty_file(self, tmp_path):
+        path = tmp_path / 'empty.gcode'
+        path.write_bytes(b'')
+        result = analyze(str(path))
+        assert result['estimatedPrintTime'] == 0
+        assert result['filament'] == {}
+        assert result['layers'] == 0
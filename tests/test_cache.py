@@ -0,0 +1,163 @@
+import json
+import threading
+
+import pytest
+
+from octoclient import OctoClient
+from octoclient.cache import MetadataCache
+
+from _common import APIKEY
+
+
+FILES = {'files': [{'name': 'a.gcode', 'origin': 'local',
+                    'gcodeAnalysis': {'estimatedPrintTime': 1234}}],
+         'free': 1000}
+
+
+def etag_route(server, payload, etag='"v1"'):
+    '''
+    Route serving payload with an ETag, honoring If-None-Match
+    '''
+    server.etag = etag
+
+    def route(handler, body):
+        if handler.headers.get('If-None-Match') == server.etag:
+            return 304, b'', {'ETag': server.etag}
+        return (200, json.dumps(payload).encode('utf-8'),
+                {'ETag': server.etag, 'Content-Type': 'application/json'})
+    return route
+
+
+@pytest.fixture
+def octoprint(octoprint):
+    octoprint.routes[('GET', '/api/files')] = etag_route(octoprint, FILES)
+    octoprint.routes[('GET', '/api/settings')] = {'webcam': {}}
+    octoprint.routes[('DELETE', '/api/files/local/a.gcode')] = None
+    return octoprint
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = MetadataCache(str(tmp_path / 'cache.sqlite'))
+    yield cache
+    cache.close()
+
+
+def requests_for(server, path):
+    return [r for r in server.requests if r[1] == path]
+
+
+class TestMetadataCache:
+    def test_wal(self, cache):
+        mode = cache.connection.execute('PRAGMA journal_mode').fetchone()
+        assert mode == ('wal',)
+
+    def test_put_get(self, cache):
+        assert cache.get('http://p', '/api/files') is None
+        cache.put('http://p', '/api/files', b'{}', '"x"')
+        entry = cache.get('http://p', '/api/files')
+        assert (entry.body, entry.etag) == (b'{}', '"x"')
+        assert entry.age() < 5
+        assert cache.get('http://q', '/api/files') is None
+
+    def test_eviction(self, cache):
+        cache.max_size = 250
+        for n in range(5):
+            cache.put('http://p', '/r{}'.format(n), bytes(100))
+        assert len(cache) == 2
+        assert cache.size() == 200
+        assert cache.get('http://p', '/r4') is not None
+        assert cache.get('http://p', '/r0') is None
+
+    def test_eviction_keeps_recently_used(self, cache):
+        cache.max_size = 250
+        cache.put('http://p', '/old', bytes(100))
+        cache.put('http://p', '/new', bytes(100))
+        cache.get('http://p', '/old')
+        cache.put('http://p', '/newest', bytes(100))
+        assert cache.get('http://p', '/old') is not None
+        assert cache.get('http://p', '/new') is None
+
+    def test_clear_prefix(self, cache):
+        cache.put('http://p', '/api/files', b'1')
+        cache.put('http://p', '/api/files/local', b'2')
+        cache.put('http://p', '/api/settings', b'3')
+        cache.put('http://q', '/api/files', b'4')
+        cache.clear('http://p', '/api/files')
+        assert len(cache) == 2
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_threads(self, cache):
+        errors = []
+
+        def work(n):
+            try:
+                for i in range(20):
+                    cache.put('http://p{}'.format(n), '/r', bytes([i]))
+                    assert cache.get('http://p{}'.format(n), '/r').body
+            except Exception as e:
+                errors.append(e)
+            finally:
+                cache.close()
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors
+        assert len(cache) == 8
+
+
+class TestClientCache:
+    def test_revalidates_with_etag(self, octoprint, cache):
+        client = OctoClient(url=octoprint.url, apikey=APIKEY, cache=cache)
+        assert client.files() == FILES
+        assert client.files() == FILES
+        first, second = requests_for(octoprint, '/api/files')
+        assert 'If-None-Match' not in first[3]
+        assert second[3]['If-None-Match'] == '"v1"'
+
+    def test_warm_start(self, octoprint, cache):
+        OctoClient(url=octoprint.url, apikey=APIKEY, cache=cache).files()
+        cache.max_age = 60
+        client = OctoClient(url=octoprint.url, apikey=APIKEY, cache=cache)
+        assert client.files(model=True)[0].analysis == {
+            'estimatedPrintTime': 1234}
+        assert client.settings() == {'webcam': {}}
+        assert client.settings() == {'webcam': {}}
+        assert len(requests_for(octoprint, '/api/files')) == 1
+        assert len(requests_for(octoprint, '/api/version')) == 1
+        assert len(requests_for(octoprint, '/api/settings')) == 1
+
+    def test_changed_resource(self, octoprint, cache):
+        client = OctoClient(url=octoprint.url, apikey=APIKEY, cache=cache)
+        client.files()
+        FILES_V2 = dict(FILES, free=10)
+        octoprint.routes[('GET', '/api/files')] = etag_route(
+            octoprint, FILES_V2, '"v2"')
+        assert client.files() == FILES_V2
+        assert cache.get(octoprint.url, '/api/files').etag == '"v2"'
+
+    def test_delete_invalidates(self, octoprint, cache):
+        cache.max_age = 60
+        client = OctoClient(url=octoprint.url, apikey=APIKEY, cache=cache)
+        client.files()
+        client.delete('a.gcode')
+        client.files()
+        assert len(requests_for(octoprint, '/api/files')) == 2
+
+    def test_params_are_part_of_the_key(self, octoprint, cache):
+        octoprint.routes[('GET', '/api/files')] = FILES
+        client = OctoClient(url=octoprint.url, apikey=APIKEY, cache=cache)
+        client._get('/api/files', params={'recursive': 'true'})
+        client._get('/api/files')
+        assert len(cache) == 3  # version too
+
+    def test_no_cache(self, octoprint):
+        client = OctoClient(url=octoprint.url, apikey=APIKEY)
+        client.files()
+        client.files()
+        assert all('If-None-Match' not in r[3]
+                   for r in requests_for(octoprint, '/api/files'))
@@ -0,0 +1,220 @@
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from octoclient import cli, websocket
+from octoclient.daemon import Daemon
+
+from _common import APIKEY
+
+
+JOB = {'job': {'file': {'name': 'homex.gcode'}},
+       'progress': {'completion': 42.0},
+       'state': 'Printing'}
+PRINTER = {'state': {'text': 'Printing'},
+           'temperature': {'tool0': {'actual': 200.0, 'target': 210.0},
+                           'bed': {'actual': 60.0, 'target': 60.0}}}
+
+
+@pytest.fixture
+def octoprint(octoprint):
+    octoprint.routes[('GET', '/api/job')] = JOB
+    octoprint.routes[('GET', '/api/printer')] = PRINTER
+    return octoprint
+
+
+@pytest.fixture
+def config(octoprint, tmp_path):
+    path = tmp_path / 'printers.ini'
+    text = '[prusa]\nurl = {}\napikey = {}\n'.format(octoprint.url, APIKEY)
+    path.write_text(text)
+    return str(path)
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / 'octoclient.sock')
+
+
+def start(daemon):
+    errors = []
+
+    def serve():
+        try:
+            daemon.serve_forever()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=serve)
+    thread.errors = errors
+    thread.start()
+    for _ in range(100):
+        if daemon.server is not None:
+            break
+        time.sleep(0.01)
+    return thread
+
+
+@pytest.fixture
+def daemon(config, socket_path):
+    daemon = Daemon(cli.load_printers(config), socket_path, push=False)
+    thread = start(daemon)
+    yield daemon
+    daemon.shutdown()
+    thread.join()
+
+
+def run(capsys, *argv):
+    code = cli.main(list(argv))
+    captured = capsys.readouterr()
+    run.err = captured.err
+    return code, captured.out
+
+
+class TestCLI:
+    def test_status_without_daemon(self, capsys, config, socket_path):
+        code, out = run(capsys, '--config', config, '--socket', socket_path,
+                        'status', '--all')
+        assert code == 0
+        assert out == ('prusa\tPrinting\t42.0%\thomex.gcode\t'
+                       'bed:60.0/60.0 tool0:200.0/210.0\n')
+
+    def test_status_reuses_daemon_clients(self, capsys, daemon, octoprint,
+                                          socket_path):
+        for _ in range(3):
+            code, out = run(capsys, '--config', 'nonexistent', '--socket',
+                            socket_path, 'status', 'prusa')
+            assert code == 0
+            assert out.startswith('prusa\tPrinting\t42.0%')
+        # the version() handshake happened only once
+        assert octoprint.paths().count('/api/version') == 1
+
+    def test_status_reuses_connections(self, daemon, octoprint):
+        for _ in range(20):
+            assert daemon.status(['prusa'])['prusa']['state'] == 'Printing'
+        # at most one per part requested at the same time
+        assert octoprint.connections <= 3
+
+    def test_status_uses_push_state(self, daemon):
+        daemon.current['prusa'] = ({'state': {'text': 'Paused'},
+                                    'progress': {'completion': 50.0},
+                                    'job': {'file': {'name': 'a.gcode'}},
+                                    'temps': [{'time': 1,
+                                               'tool0': {'actual': 1,
+                                                         'target': 2}}]},
+                                   time.time())
+        row = cli.request(daemon.socket_path, {'command': 'status'})['prusa']
+        assert row['source'] == 'push'
+        assert row['state'] == 'Paused'
+        assert row['temperature'] == {'tool0': {'actual': 1, 'target': 2}}
+
+    def test_job_json(self, capsys, daemon, socket_path):
+        code, out = run(capsys, '--socket', socket_path, 'job')
+        assert code == 0
+        assert '"completion": 42.0' in out
+
+    def test_unknown_printer(self, capsys, daemon, socket_path):
+        code, out = run(capsys, '--socket', socket_path, 'status', 'nope')
+        assert code == 1
+        assert run.err == 'Unknown printers: nope\n'
+
+    def test_stop(self, capsys, daemon, socket_path):
+        code, out = run(capsys, '--socket', socket_path, 'stop')
+        assert code == 0
+        assert out == 'stopping\n'
+
+    def test_stop_without_daemon(self, capsys, socket_path):
+        code, out = run(capsys, '--socket', socket_path, 'stop')
+        assert code == 1
+        assert run.err == 'No daemon running\n'
+
+    def test_status_with_stale_socket(self, capsys, config, socket_path,
+                                      octoprint):
+        with socket.socket(socket.AF_UNIX) as stale:
+            stale.bind(socket_path)  # not listening, as if the daemon died
+            code, out = run(capsys, '--config', config, '--socket',
+                            socket_path, 'status')
+        assert code == 0
+        assert out.startswith('prusa\tPrinting')
+
+    def test_status_daemon_timeout(self, capsys, monkeypatch, config,
+                                   socket_path, octoprint):
+        def request(socket_path, message, timeout=30):
+            raise socket.timeout('timed out')
+
+        monkeypatch.setattr(cli, 'request', request)
+        code, out = run(capsys, '--config', config, '--socket', socket_path,
+                        'status')
+        assert code == 1
+        assert run.err == 'The daemon did not answer in time\n'
+        # no fallback to asking the printers directly
+        assert octoprint.paths() == []
+
+
+class TestDaemon:
+    def test_refuses_to_replace_running_daemon(self, daemon, config,
+                                               socket_path):
+        second = Daemon(cli.load_printers(config), socket_path, push=False)
+        with pytest.raises(RuntimeError, match='already running'):
+            second.serve_forever()
+        assert cli.request(socket_path, {'command': 'printers'})
+
+    def test_daemon_command_already_running(self, capsys, daemon, config,
+                                            socket_path):
+        code, out = run(capsys, '--config', config, '--socket', socket_path,
+                        'daemon', '--no-push')
+        assert code == 1
+        assert run.err.startswith('A daemon is already running')
+
+    def test_replaces_stale_socket(self, config, socket_path):
+        with socket.socket(socket.AF_UNIX) as stale:
+            stale.bind(socket_path)  # not listening, as if the daemon died
+        daemon = Daemon(cli.load_printers(config), socket_path, push=False)
+        thread = start(daemon)
+        assert cli.request(socket_path, {'command': 'printers'})
+        daemon.shutdown()
+        thread.join()
+        assert thread.errors == []
+        assert not os.path.exists(socket_path)
+
+    def test_keeps_socket_it_did_not_bind(self, config, socket_path):
+        daemon = Daemon(cli.load_printers(config), socket_path, push=False)
+        thread = start(daemon)
+        os.unlink(socket_path)
+        with socket.socket(socket.AF_UNIX) as other:
+            other.bind(socket_path)  # e.g. another daemon started meanwhile
+            daemon.shutdown()
+            thread.join()
+            assert os.path.exists(socket_path)
+
+    def test_closes_push_handlers(self, monkeypatch, socket_path):
+        class Handler:
+            def __init__(self, url, on_message):
+                self.closed = False
+
+            def run(self):
+                pass
+
+        class ClosableHandler(Handler):
+            def close(self):
+                self.closed = True
+
+        def factory(url, on_message):
+            if 'prusa' in url:
+                return ClosableHandler(url, on_message)
+            return Handler(url, on_message)
+
+        monkeypatch.setattr(websocket, 'WebSocketEventHandler', factory)
+        daemon = Daemon({'prusa': ('http://prusa.local', APIKEY),
+                         'ender': ('http://ender.local', APIKEY)},
+                        socket_path)
+        thread = start(daemon)
+        daemon.shutdown()
+        thread.join()
+        assert thread.errors == []
+        assert daemon.handlers['prusa'].closed
+        assert not daemon.handlers['ender'].closed
+        assert not os.path.exists(socket_path)
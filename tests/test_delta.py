@@ -0,0 +1,137 @@
+import copy
+import time
+
+from octoclient.delta import DeltaTracker, diff
+
+
+CURRENT = {
+    'state': {'text': 'Operational',
+              'flags': {'operational': True, 'printing': False}},
+    'job': {'file': {'name': None}},
+    'progress': {'completion': None},
+    'temps': [],
+    'logs': [],
+    'serverTime': 1000.0,
+}
+
+
+def tick(**changes):
+    current = copy.deepcopy(CURRENT)
+    for path, value in changes.items():
+        *parents, leaf = path.split('__')
+        node = current
+        for parent in parents:
+            node = node[parent]
+        node[leaf] = value
+    return current
+
+
+class TestDiff:
+    def test_equal(self):
+        assert diff(CURRENT, copy.deepcopy(CURRENT)) == {}
+
+    def test_nested_change(self):
+        new = tick(state__text='Printing', state__flags__printing=True)
+        assert diff(CURRENT, new) == {'state.text': 'Printing',
+                                      'state.flags.printing': True}
+
+    def test_first_document(self):
+        changes = diff({}, CURRENT)
+        assert changes['state.flags.operational'] is True
+        assert changes['job.file.name'] is None
+        assert changes['temps'] == []
+
+    def test_added_and_removed(self):
+        new = tick(job__file={'name': 'cube.gcode', 'size': 10})
+        del new['logs']
+        assert diff(CURRENT, new) == {'job.file.name': 'cube.gcode',
+                                      'job.file.size': 10, 'logs': None}
+
+    def test_removed_sentinel(self):
+        removed = object()
+        new = tick(job=None)
+        del new['logs']
+        assert diff(CURRENT, new, removed=removed) == {
+            'job.file.name': removed, 'job': None, 'logs': removed}
+
+    def test_dict_replaced_by_scalar(self):
+        new = tick(job=None)
+        assert diff(CURRENT, new) == {'job.file.name': None, 'job': None}
+
+    def test_lists_as_a_whole(self):
+        new = tick(logs=['Recv: ok'])
+        assert diff(CURRENT, new) == {'logs': ['Recv: ok']}
+
+
+class TestDeltaTracker:
+    def test_update(self):
+        tracker = DeltaTracker()
+        assert 'state.text' in tracker.update('a', tick())
+        assert tracker.update('a', tick(serverTime=1001.0)) == {}
+        assert tracker.update('a', tick(state__text='Printing')) == {
+            'state.text': 'Printing'}
+        # printers are tracked separately
+        assert tracker.update('b', tick(state__text='Printing'))
+
+    def test_ignore(self):
+        tracker = DeltaTracker(ignore=('serverTime', 'state.flags'))
+        tracker.update('a', tick())
+        assert tracker.update('a', tick(serverTime=1.0,
+                                        state__flags__printing=True)) == {}
+        tracker = DeltaTracker(ignore=())
+        tracker.update('a', tick())
+        assert tracker.update('a', tick(serverTime=1.0)) == {
+            'serverTime': 1.0}
+
+    def test_subscribe(self):
+        tracker = DeltaTracker()
+        everything, state, flags = [], [], []
+        tracker.subscribe(lambda p, c: everything.append((p, c)))
+        tracker.subscribe(lambda p, c: state.append((p, c)),
+                          ['state.text', 'progress'])
+        tracker.subscribe(lambda p, c: flags.append((p, c)), ['state.flags'])
+        tracker.update('a', tick())
+        everything.clear(), state.clear(), flags.clear()
+
+        tracker.update('a', tick(progress__completion=1.5))
+        assert state == [('a', {'progress.completion': 1.5})]
+        assert flags == []
+        assert everything == [('a', {'progress.completion': 1.5})]
+
+        tracker.update('a', tick(progress__completion=1.5,
+                                 state__flags__printing=True))
+        assert flags == [('a', {'state.flags.printing': True})]
+        assert len(state) == 1
+
+    def test_unsubscribe(self):
+        tracker = DeltaTracker()
+        calls = []
+        callback = tracker.subscribe(lambda p, c: calls.append(c), ['state'])
+        tracker.update('a', tick())
+        tracker.unsubscribe(callback)
+        tracker.update('a', tick(state__text='Printing'))
+        assert len(calls) == 1
+
+    def test_on_message_and_forget(self):
+        tracker = DeltaTracker()
+        changes = []
+        tracker.subscribe(lambda p, c: changes.append(c))
+        on_message = tracker.on_message('a')
+        on_message(None, {'current': tick()})
+        on_message(None, {'event': {'type': 'Connected'}})
+        on_message(None, {'current': tick()})
+        assert len(changes) == 1
+        tracker.forget('a')
+        on_message(None, {'current': tick()})
+        assert len(changes) == 2
+
+    def test_cheap_enough(self):
+        tracker = DeltaTracker()
+        documents = [tick(serverTime=float(n), temps=[{'time': n}],
+                          progress__completion=n // 50)
+                     for n in range(200)]
+        start = time.perf_counter()
+        for n in range(5000):
+            tracker.update(n % 300, documents[n % 200])
+        # hundreds of printers at several messages per second each
+        assert (time.perf_counter() - start) / 5000 < 0.001
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import time
+
+import pytest
+
+from octoclient import Fleet, OctoClient
+
+from _common import APIKEY
+from _fakeserver import FakeOctoPrint
+
+
+CONTENT = bytes(range(256)) * 4096  # 1 MiB
+PATH = '/downloads/files/local/big.gcode'
+
+
+def entry(url, content=CONTENT):
+    return {'name': 'big.gcode', 'origin': 'local', 'size': len(content),
+            'hash': hashlib.sha1(content).hexdigest(),
+            'refs': {'download': url + PATH}}
+
+
+@pytest.fixture
+def octoprint(octoprint):
+    octoprint.routes[('GET', '/api/files/local/big.gcode')] = entry(
+        octoprint.url)
+    octoprint.routes[('GET', PATH)] = CONTENT
+    return octoprint
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class TestDownload:
+    def test_download_to_directory(self, client, tmp_path):
+        path = client.download('big.gcode', str(tmp_path))
+        assert path == str(tmp_path / 'big.gcode')
+        assert read(path) == CONTENT
+        assert not os.path.exists(path + '.part')
+
+    def test_resume_with_range(self, client, octoprint, tmp_path):
+        dest = str(tmp_path / 'out.gcode')
+        with open(dest + '.part', 'wb') as f:
+            f.write(CONTENT[:1000])
+        client.download('big.gcode', dest)
+        assert read(dest) == CONTENT
+        _, path, _, headers = octoprint.requests[-1]
+        assert path == PATH
+        assert headers['Range'] == 'bytes=1000-'
+
+    def test_complete_part_is_not_downloaded_again(self, client, octoprint,
+                                                   tmp_path):
+        dest = str(tmp_path / 'out.gcode')
+        with open(dest + '.part', 'wb') as f:
+            f.write(CONTENT)
+        client.download('big.gcode', dest)
+        assert read(dest) == CONTENT
+        assert PATH not in octoprint.paths()
+
+    def test_hash_mismatch_raises(self, client, octoprint, tmp_path):
+        octoprint.routes[('GET', PATH)] = CONTENT[::-1]
+        dest = str(tmp_path / 'out.gcode')
+        with pytest.raises(RuntimeError):
+            client.download('big.gcode', dest)
+        assert not os.path.exists(dest)
+        assert not os.path.exists(dest + '.part')
+
+    def test_size_mismatch_raises(self, client, octoprint, tmp_path):
+        octoprint.routes[('GET', PATH)] = CONTENT[:-1]
+        with pytest.raises(RuntimeError):
+            client.download('big.gcode', str(tmp_path / 'out.gcode'))
+
+    def test_direct_path(self, client, tmp_path):
+        dest = str(tmp_path / 'out.gcode')
+        client.download(PATH, dest)
+        assert read(dest) == CONTENT
+
+    def test_direct_path_resume(self, client, octoprint, tmp_path):
+        dest = str(tmp_path / 'out.gcode')
+        with open(dest + '.part', 'wb') as f:
+            f.write(CONTENT[:1000])
+        client.download(PATH, dest)
+        assert read(dest) == CONTENT
+        _, path, _, headers = octoprint.requests[-1]
+        assert headers['Range'] == 'bytes=1000-'
+
+    def test_direct_path_complete_part(self, client, octoprint, tmp_path):
+        dest = str(tmp_path / 'out.gcode')
+        with open(dest + '.part', 'wb') as f:
+            f.write(CONTENT)
+        client.download(PATH, dest)
+        assert read(dest) == CONTENT
+        assert octoprint.paths().count(PATH) == 1  # answered by 416
+
+    def test_direct_path_longer_part(self, client, octoprint, tmp_path):
+        dest = str(tmp_path / 'out.gcode')
+        with open(dest + '.part', 'wb') as f:
+            f.write(CONTENT + b'garbage')
+        client.download(PATH, dest)
+        assert read(dest) == CONTENT
+        assert 'Range' not in octoprint.requests[-1][3]
+
+    def test_direct_path_server_ignoring_range(self, client, octoprint,
+                                               tmp_path):
+        octoprint.routes[('GET', PATH)] = lambda h, b: (200, CONTENT)
+        dest = str(tmp_path / 'out.gcode')
+        with open(dest + '.part', 'wb') as f:
+            f.write(b'x' * 1000)
+        client.download(PATH, dest)
+        assert read(dest) == CONTENT
+
+    def test_sdcard_file_raises(self, client, octoprint, tmp_path):
+        octoprint.routes[('GET', '/api/files/sdcard/a.gco')] = {
+            'name': 'a.gco', 'origin': 'sdcard', 'refs': {}}
+        with pytest.raises(RuntimeError):
+            client.download('sdcard/a.gco', str(tmp_path))
+
+    def test_rate_cap(self, client, tmp_path):
+        start = time.perf_counter()
+        client.download('big.gcode', str(tmp_path), rate=4 * len(CONTENT))
+        assert time.perf_counter() - start >= 0.2
+
+    def test_fleet(self, octoprint, tmp_path):
+        with FakeOctoPrint() as other:
+            other.routes[('GET', '/api/files/local/big.gcode')] = entry(
+                other.url)
+            other.routes[('GET', PATH)] = CONTENT
+            clients = [OctoClient(url=s.url, apikey=APIKEY)
+                       for s in (octoprint, other)]
+            results = Fleet(clients).download('big.gcode', str(tmp_path))
+        assert len(results) == 2
+        for path in results.values():
+            assert read(path) == CONTENT
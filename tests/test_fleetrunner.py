@@ -0,0 +1,165 @@
+import os
+import pickle
+import threading
+import time
+
+from octoclient.fleetrunner import (CHANGES, EVENT, OPEN, REMOVED,
+                                    FleetRunner, _Shard)
+
+
+class FakeHandler:
+    '''
+    Push event handler sending a few messages, no network involved
+    '''
+
+    def __init__(self, url, on_open, on_close, on_message):
+        self.url = url
+        self.on_open = on_open
+        self.on_close = on_close
+        self.on_message = on_message
+        self.stop = threading.Event()
+
+    def _run(self):
+        self.on_open(self)
+        for completion in (0.0, 50.0, 100.0):
+            self.on_message(self, {'current': {
+                'state': {'text': 'Printing'},
+                'progress': {'completion': completion},
+                'pid': os.getpid()}})
+        self.on_message(self, {'event': {'type': 'PrintDone',
+                                         'payload': {}}})
+        self.stop.wait()
+
+    def run(self):
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.stop.set()
+
+
+def fake_handler(url, on_open, on_close, on_message):
+    return FakeHandler(url, on_open, on_close, on_message)
+
+
+URLS = ['http://printer{}.local'.format(i) for i in range(6)]
+
+
+def wait_for(condition, timeout=20):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+class TestSharding:
+    def test_add_balanced(self):
+        runner = FleetRunner(URLS[:5], processes=2)
+        assert sorted(len(s) for s in runner.shards) == [2, 3]
+        assert set(runner.assignment) == set(URLS[:5])
+
+    def test_remove_rebalances(self):
+        runner = FleetRunner(URLS, processes=3)
+        for url in runner.shards[0].copy():
+            runner.remove(url)
+        assert sorted(len(s) for s in runner.shards) == [1, 1, 2]
+        for index, shard in enumerate(runner.shards):
+            for url in shard:
+                assert runner.assignment[url] == index
+
+    def test_add_twice(self):
+        runner = FleetRunner(processes=2)
+        runner.add(URLS[0])
+        runner.add(URLS[0])
+        assert sum(len(s) for s in runner.shards) == 1
+
+
+class TestShard:
+    def test_removed_paths(self):
+        handlers = []
+
+        def factory(url, on_open, on_close, on_message):
+            handler = FakeHandler(url, on_open, on_close, on_message)
+            handlers.append(handler)
+            return handler
+
+        shard = _Shard(factory)
+        shard.add(URLS[0])
+        on_message = handlers[0].on_message
+        on_message(None, {'current': {'job': {'user': 'me'}, 'logs': []}})
+        shard.take()
+        on_message(None, {'current': {'job': {'user': None}}})
+        (url, kind, changes), = pickle.loads(pickle.dumps(shard.take()))
+        assert changes == {'job.user': None, 'logs': REMOVED}
+        assert changes['logs'] is REMOVED
+        shard.close()
+
+    def test_handler_without_close(self):
+        class Handler:
+            def __init__(self, *args):
+                pass
+
+            def run(self):
+                pass
+
+        shard = _Shard(Handler)
+        shard.add(URLS[0])
+        shard.remove(URLS[0])
+        assert shard.handlers == {}
+
+
+class TestFleetRunner:
+    def test_none_values_are_kept(self):
+        runner = FleetRunner(URLS[:1], processes=1)
+        runner._queue.put = lambda update: None
+        runner._deliver(URLS[0], CHANGES, {'a': 1, 'b': None, 'c': 3})
+        runner._deliver(URLS[0], CHANGES, {'a': REMOVED})
+        assert runner.current[URLS[0]] == {'b': None, 'c': 3}
+
+    def test_callback(self):
+        updates = []
+        runner = FleetRunner(URLS[:4], processes=2, callback=lambda *u:
+                             updates.append(u), handler_factory=fake_handler)
+        with runner:
+            wait_for(lambda: len([u for u in updates if u[1] == EVENT]) == 4)
+            assert set(runner.current) == set(URLS[:4])
+            for url in URLS[:4]:
+                current = runner.current[url]
+                assert current['state.text'] == 'Printing'
+                assert current['progress.completion'] == 100.0
+            # two shards, two processes
+            pids = {c['pid'] for c in runner.current.values()}
+            assert len(pids) == 2
+            assert os.getpid() not in pids
+
+            kinds = [(u[0], u[1]) for u in updates]
+            for url in URLS[:4]:
+                assert kinds.index((url, OPEN)) < \
+                    kinds.index((url, CHANGES)) < kinds.index((url, EVENT))
+
+    def test_add_remove_running(self):
+        updates = []
+        runner = FleetRunner(URLS[:2], processes=2, callback=lambda *u:
+                             updates.append(u), handler_factory=fake_handler)
+        with runner:
+            wait_for(lambda: len(runner.current) == 2)
+            runner.add(URLS[2])
+            wait_for(lambda: URLS[2] in runner.current)
+            runner.remove(URLS[0])
+            assert URLS[0] not in runner.current
+            assert sorted(len(s) for s in runner.shards) == [1, 1]
+
+    def test_updates(self):
+        runner = FleetRunner(URLS[:2], processes=1,
+                             handler_factory=fake_handler).start()
+        events = []
+        for url, kind, payload in runner.updates(timeout=20):
+            if kind == EVENT:
+                events.append((url, payload['type']))
+                if len(events) == 2:
+                    break
+        runner.stop()
+        assert sorted(events) == [(URLS[0], 'PrintDone'),
+                                  (URLS[1], 'PrintDone')]
+        assert list(runner.updates(timeout=1)) == []
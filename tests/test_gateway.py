@@ -0,0 +1,195 @@
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+from octoclient.gateway import Gateway, GatewayEventHandler
+
+
+PRINTERS = {'prusa': 'http://prusa.local', 'ender': 'http://ender.local'}
+
+
+class FakeUpstream:
+    def __init__(self, url, on_open, on_close, on_message):
+        self.url = url
+        self.on_message = on_message
+        self.running = False
+        self.closed = False
+
+    def run(self):
+        self.running = True
+
+    def close(self):
+        self.closed = True
+
+
+def current(text):
+    return {'current': {'state': {'text': text}}}
+
+
+EVENT = {'event': {'type': 'PrintStarted', 'payload': {}}}
+
+
+class Consumer:
+    def __init__(self, socket_path, printer, types=None):
+        self.messages = []
+        self.closed = threading.Event()
+        self.condition = threading.Condition()
+        self.handler = GatewayEventHandler(
+            socket_path, printer, on_message=self.on_message,
+            on_close=lambda api: self.closed.set(), types=types)
+        self.handler.run()
+
+    def on_message(self, api, message):
+        with self.condition:
+            self.messages.append(message)
+            self.condition.notify_all()
+
+    def wait(self, count):
+        with self.condition:
+            assert self.condition.wait_for(
+                lambda: len(self.messages) >= count, 5)
+        return self.messages
+
+
+@pytest.fixture
+def gateway(tmp_path):
+    upstreams = {}
+
+    def factory(url, on_open, on_close, on_message):
+        upstream = FakeUpstream(url, on_open, on_close, on_message)
+        upstreams[url] = upstream
+        return upstream
+
+    gateway = Gateway(PRINTERS, str(tmp_path / 'gateway.sock'),
+                      handler_factory=factory)
+    gateway.upstreams = upstreams
+    thread = threading.Thread(target=gateway.serve_forever)
+    thread.start()
+    for _ in range(100):
+        if gateway.server is not None and len(upstreams) == 2:
+            break
+        time.sleep(0.01)
+    yield gateway
+    gateway.shutdown()
+    thread.join()
+
+
+def send(gateway, name, message):
+    gateway.upstreams[PRINTERS[name]].on_message(None, message)
+
+
+def wait_subscribed(gateway, count):
+    for _ in range(100):
+        if len(gateway.consumers) >= count:
+            return
+        time.sleep(0.01)
+    raise AssertionError('consumers did not subscribe')
+
+
+class TestGateway:
+    def test_one_upstream_per_printer(self, gateway):
+        consumers = [Consumer(gateway.socket_path, 'prusa')
+                     for _ in range(3)]
+        wait_subscribed(gateway, 3)
+        assert sorted(gateway.upstreams) == sorted(PRINTERS.values())
+        assert all(u.running for u in gateway.upstreams.values())
+        send(gateway, 'prusa', current('Printing'))
+        send(gateway, 'ender', current('Operational'))
+        for consumer in consumers:
+            assert consumer.wait(1) == [current('Printing')]
+        assert gateway.published == 2
+
+    def test_types(self, gateway):
+        everything = Consumer(gateway.socket_path, 'prusa')
+        events = Consumer(gateway.socket_path, 'prusa', types=['event'])
+        wait_subscribed(gateway, 2)
+        send(gateway, 'prusa', current('Printing'))
+        send(gateway, 'prusa', EVENT)
+        assert everything.wait(2) == [current('Printing'), EVENT]
+        assert events.wait(1) == [EVENT]
+
+    def test_late_joiner(self, gateway):
+        send(gateway, 'prusa', current('Operational'))
+        send(gateway, 'prusa', current('Printing'))
+        send(gateway, 'prusa', EVENT)
+        consumer = Consumer(gateway.socket_path, 'prusa')
+        assert consumer.wait(1) == [current('Printing')]
+        send(gateway, 'prusa', current('Paused'))
+        assert consumer.wait(2) == [current('Printing'), current('Paused')]
+
+    def test_late_joiner_filtered(self, gateway):
+        send(gateway, 'prusa', current('Printing'))
+        events = Consumer(gateway.socket_path, 'prusa', types=['event'])
+        wait_subscribed(gateway, 1)
+        send(gateway, 'prusa', EVENT)
+        assert events.wait(1) == [EVENT]
+
+    def test_unknown_printer(self, gateway):
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.connect(gateway.socket_path)
+            sock.sendall(b'{"printers": ["nope"]}\n')
+            reply = json.loads(sock.makefile('rb').readline())
+        assert reply == {'error': 'Unknown printers: nope'}
+
+    def test_slow_consumer_dropped(self, gateway):
+        gateway.max_queue = 2
+        consumer = gateway.subscribe(['prusa'])
+        for i in range(5):
+            send(gateway, 'prusa', current(str(i)))
+        assert consumer.dropped
+        assert consumer.queue.get_nowait() is None
+
+    def test_consumer_leaves(self, gateway):
+        consumer = Consumer(gateway.socket_path, 'prusa')
+        wait_subscribed(gateway, 1)
+        consumer.handler.close()
+        assert consumer.closed.wait(5)
+        # the gateway notices once it writes to the closed socket
+        for _ in range(100):
+            send(gateway, 'prusa', current('Printing'))
+            if not gateway.consumers:
+                break
+            time.sleep(0.01)
+        assert not gateway.consumers
+
+    def test_shutdown_closes_consumers(self, gateway):
+        consumer = Consumer(gateway.socket_path, 'prusa')
+        wait_subscribed(gateway, 1)
+        gateway.shutdown()
+        assert consumer.closed.wait(5)
+        assert all(u.closed for u in gateway.upstreams.values())
+
+    def test_shutdown_with_handlers_without_close(self, tmp_path):
+        class Upstream:
+            def __init__(self, url, on_open, on_close, on_message):
+                pass
+
+            def run(self):
+                pass
+
+        gateway = Gateway(PRINTERS, str(tmp_path / 'gateway.sock'),
+                          handler_factory=Upstream)
+        errors = []
+
+        def serve():
+            try:
+                gateway.serve_forever()
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        for _ in range(100):
+            if len(gateway.handlers) == 2:
+                break
+            time.sleep(0.01)
+        consumer = Consumer(gateway.socket_path, 'prusa')
+        wait_subscribed(gateway, 1)
+        gateway.shutdown()
+        thread.join(5)
+        assert errors == []
+        assert consumer.closed.wait(5)
+        assert not (tmp_path / 'gateway.sock').exists()
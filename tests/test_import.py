@@ -0,0 +1,54 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+
+# Cold `import octoclient` must stay under this many seconds
+IMPORT_BUDGET = 0.05
+
+HEAVY = ('requests', 'urllib3', 'websocket', 'octoclient.client')
+
+BENCHMARK = '''
+import json, sys, time
+start = time.perf_counter()
+import octoclient
+package = time.perf_counter() - start
+loaded = [m for m in {heavy!r} if m in sys.modules]
+start = time.perf_counter()
+from octoclient import {name}
+name = time.perf_counter() - start
+print(json.dumps({{'package': package, 'name': name, 'loaded': loaded}}))
+'''
+
+
+def benchmark(name='OctoClient'):
+    code = BENCHMARK.format(heavy=HEAVY, name=name)
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return json.loads(output.decode('utf-8'))
+
+
+class TestImport:
+    def test_package_import_is_lazy(self):
+        result = benchmark()
+        assert result['loaded'] == []
+
+    def test_package_import_budget(self):
+        best = min(benchmark()['package'] for _ in range(3))
+        assert best < IMPORT_BUDGET
+
+    @pytest.mark.parametrize('name', ('OctoClient', 'Fleet',
+                                      'XHRStreamingGenerator',
+                                      'XHRStreamingEventHandler',
+                                      'WebSocketEventHandler',
+                                      'AutoEventHandler'))
+    def test_names_resolve(self, name):
+        import octoclient
+        assert getattr(octoclient, name).__name__ == name
+        assert name in dir(octoclient)
+
+    def test_unknown_name_raises(self):
+        import octoclient
+        with pytest.raises(AttributeError):
+            octoclient.NoSuchThing
@@ -0,0 +1,74 @@
+import itertools
+
+import pytest
+
+
+PATH = '/downloads/logs/serial.log'
+
+
+class Log:
+    def __init__(self, server, content):
+        self.server = server
+        self.content = content
+        server.routes[('GET', '/api/logs')] = self.listing
+        server.routes[('GET', PATH)] = lambda handler, body: self.content
+
+    def listing(self, handler, body):
+        return {'files': [{'name': 'serial.log', 'size': len(self.content)}],
+                'free': 1000}
+
+    def ranges(self):
+        return [h.get('Range') for m, p, b, h in self.server.requests
+                if p == PATH]
+
+
+@pytest.fixture
+def log(octoprint):
+    return Log(octoprint, b'Send: M105\nRecv: ok T:20.0\nRecv: ok')
+
+
+class TestTailLog:
+    def test_read_without_follow(self, client, log):
+        lines = list(client.tail_log('serial.log', follow=False))
+        # the last line is not complete yet
+        assert lines == ['Send: M105', 'Recv: ok T:20.0']
+        assert log.ranges() == [None]
+
+    def test_only_new_bytes_are_requested(self, client, log):
+        tail = client.tail_log('serial.log', interval=0)
+        assert list(itertools.islice(tail, 2)) == ['Send: M105',
+                                                   'Recv: ok T:20.0']
+        log.content += b' T:21.0\nSend: M114\n'
+        assert list(itertools.islice(tail, 2)) == ['Recv: ok T:21.0',
+                                                   'Send: M114']
+        assert log.ranges() == [None, 'bytes=35-']
+
+    def test_offset_is_remembered(self, client, log):
+        list(client.tail_log('serial.log', follow=False))
+        log.content += b'\nSend: M114\n'
+        assert list(client.tail_log('serial.log', follow=False)) == [
+            'Recv: ok', 'Send: M114']
+        assert log.ranges()[-1] == 'bytes=27-'
+        assert list(client.tail_log('serial.log', follow=False)) == []
+
+    def test_rotation(self, client, log):
+        tail = client.tail_log('serial.log', interval=0)
+        assert next(tail) == 'Send: M105'
+        next(tail)
+        log.content = b'Fresh\n'
+        assert next(tail) == 'Fresh'
+
+    def test_long_lines_are_split(self, client, log):
+        log.content = b'x' * 100 + b'\nshort\n'
+        lines = list(client.tail_log('serial.log', follow=False,
+                                     chunk_size=16, max_line=32))
+        assert ''.join(lines[:-1]) == 'x' * 100
+        assert all(len(line) <= 48 for line in lines)
+        assert lines[-1] == 'short'
+
+    def test_server_ignoring_range(self, client, log, octoprint):
+        list(client.tail_log('serial.log', follow=False))
+        log.content += b'\nnew\n'
+        octoprint.routes[('GET', PATH)] = lambda h, b: (200, log.content)
+        assert list(client.tail_log('serial.log', follow=False)) == [
+            'Recv: ok', 'new']
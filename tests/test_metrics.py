@@ -0,0 +1,160 @@
+import json
+import time
+
+import pytest
+
+from octoclient import (OctoClient, WebSocketEventHandler,
+                        XHRStreamingGenerator)
+from octoclient.metrics import (RESTMetrics, StreamMetrics, endpoint,
+                                message_type, span_hook)
+
+from _common import APIKEY, URL
+
+
+@pytest.fixture
+def octoprint(octoprint):
+    octoprint.routes[('GET', '/api/job')] = {'state': 'Operational'}
+    octoprint.routes[('POST', '/api/job')] = None
+    octoprint.routes[('DELETE', '/api/files/local/a.gcode')] = None
+    return octoprint
+
+
+class TestMetrics:
+    @pytest.mark.parametrize(('path', 'expected'), (
+        ('/api/job', '/api/job'),
+        ('/api/printer?exclude=sd', '/api/printer'),
+        ('/api/files/local', '/api/files/local'),
+        ('/api/files/local/folder/a.gcode', '/api/files/local/{path}'),
+        ('/api/logs/serial.log', '/api/logs/{name}'),
+    ))
+    def test_endpoint(self, path, expected):
+        assert endpoint(path) == expected
+
+    def test_histograms_and_counters(self, octoprint):
+        metrics = RESTMetrics()
+        client = OctoClient(url=octoprint.url, apikey=APIKEY,
+                            hooks=[metrics])
+        client.job_info()
+        client.cancel()
+        client.delete('a.gcode')
+        with pytest.raises(RuntimeError):
+            client.logs()
+
+        key = (octoprint.url, 'GET', '/api/job')
+        assert metrics.histograms[key][-2] == 1
+        assert metrics.response_bytes[key] == len(b'{"state": "Operational"}')
+        post = (octoprint.url, 'POST', '/api/job')
+        assert metrics.request_bytes[post] == len(b'{"command": "cancel"}')
+        assert metrics.statuses[post + (204,)] == 1
+        delete = (octoprint.url, 'DELETE', '/api/files/local/{path}')
+        assert metrics.statuses[delete + (204,)] == 1
+        logs = (octoprint.url, 'GET', '/api/logs')
+        assert metrics.statuses[logs + (404,)] == 1
+        assert metrics.exceptions[logs + ('RuntimeError',)] == 1
+
+    def test_prometheus(self, octoprint):
+        metrics = RESTMetrics(buckets=[0.1, 100])
+        client = OctoClient(url=octoprint.url, apikey=APIKEY,
+                            hooks=[metrics])
+        client.job_info()
+        text = metrics.prometheus()
+        labels = 'url="{}",method="GET",endpoint="/api/job"'.format(
+            octoprint.url)
+        assert ('octoclient_request_duration_seconds_bucket{'
+                + labels + ',le="100.0"} 1') in text
+        assert ('octoclient_request_duration_seconds_count{'
+                + labels + '} 1') in text
+        assert ('octoclient_responses_total{'
+                + labels + ',status="200"} 1') in text
+        assert '# TYPE octoclient_request_duration_seconds histogram' in text
+
+    def test_connection_errors_are_recorded(self, octoprint):
+        metrics = RESTMetrics()
+        client = OctoClient(url=octoprint.url, apikey=APIKEY,
+                            hooks=[metrics])
+        client.url = 'http://127.0.0.1:1'
+        with pytest.raises(Exception):
+            client.job_info()
+        (key, count), = metrics.exceptions.items()
+        assert key[3] == 'ConnectionError'
+        assert key[:3] == (client.url, 'GET', '/api/job')
+        assert not [k for k in metrics.statuses if k[2] == '/api/job']
+
+    def test_span_hook(self, octoprint):
+        spans = []
+        client = OctoClient(url=octoprint.url, apikey=APIKEY,
+                            hooks=[span_hook(spans.append)])
+        client.job_info()
+        span = spans[-1]
+        assert span['name'] == 'GET /api/job'
+        assert span['status'] == 'OK'
+        assert span['attributes']['http.status_code'] == 200
+        assert span['end_time'] >= span['start_time']
+
+
+class FakeStreamingSession:
+    def __init__(self, lines):
+        self.lines = lines
+
+    def post(self, url, stream=False):
+        return self
+
+    def iter_lines(self):
+        return iter(self.lines)
+
+    def close(self):
+        pass
+
+
+def frames(server_time):
+    current = {'current': {'serverTime': server_time,
+                           'state': {'text': 'Printing'}}}
+    return ['o', 'h',
+            'a' + json.dumps([current, {'event': {'type': 'Connected'}}]),
+            'm' + json.dumps(current)]
+
+
+class TestStreamMetrics:
+    def test_message_type(self):
+        assert message_type({'event': {'type': 'Connected'}}) == 'event'
+        assert message_type({}) == 'dict'
+
+    def test_dispatch_counts_frames_and_messages(self):
+        received = []
+        metrics = StreamMetrics()
+        handler = WebSocketEventHandler(
+            URL, metrics=metrics,
+            on_message=lambda api, msg: received.append(msg))
+        sent = frames(time.time() - 2)
+        for frame in sent:
+            handler._dispatch(None, frame)
+
+        assert len(received) == 3
+        stats = metrics.stats()
+        assert stats['frames'] == {'o': 1, 'h': 1, 'a': 1, 'm': 1}
+        assert stats['messages'] == {'current': 2, 'event': 1}
+        assert stats['bytes'] == sum(len(f) for f in sent)
+        assert set(stats['callback_time']) == {'current', 'event'}
+        assert stats['lag']['count'] == 2
+        assert 2 <= stats['lag']['mean'] < 10
+
+    def test_dispatch_without_metrics(self):
+        received = []
+        handler = WebSocketEventHandler(
+            URL, on_message=lambda api, msg: received.append(msg))
+        kinds = [handler._dispatch(None, f) for f in frames(0.0)]
+        assert kinds == ['o', 'h', 'a', 'm']
+        assert len(received) == 3
+
+    def test_generator(self):
+        metrics = StreamMetrics()
+        lines = [f.encode('utf-8') for f in frames(time.time())]
+        generator = XHRStreamingGenerator(
+            URL, session=FakeStreamingSession(lines), metrics=metrics)
+        loop = generator.read_loop()
+        messages = [next(loop) for _ in range(3)]
+        assert [list(m) for m in messages] == [['current'], ['event'],
+                                               ['current']]
+        assert metrics.frames == {'o': 1, 'h': 1, 'a': 1, 'm': 1}
+        # the last message is still being consumed
+        assert metrics.messages == {'current': 1, 'event': 1}
@@ -0,0 +1,127 @@
+import email.parser
+import io
+
+import pytest
+
+from octoclient.minify import Minifier
+
+
+GCODE = b'''; generated by a slicer
+;FLAVOR:Marlin
+;LAYER:0
+G90
+M82 ; absolute extrusion
+G92 E0.00000
+  G1   F1800.000 X10.500 Y-0.000 E+1.25000 ; perimeter\r
+G1 F1800
+G1 F2400.0
+G1
+
+M117 Printing   layer 0 ; message
+G1 X20.000 Y20.000 E2.50000
+;LAYER:1
+T1
+G4 P500
+'''
+
+MINIFIED = b''';LAYER:0
+G90
+M82
+G92 E0
+G1 F1800 X10.5 Y0 E1.25
+G1 F2400
+M117 Printing   layer 0
+G1 X20 Y20 E2.5
+;LAYER:1
+T1
+G4 P500
+'''
+
+
+def parse_upload(request):
+    _, _, body, headers = request
+    message = email.parser.BytesParser().parsebytes(
+        'Content-Type: {}\r\n\r\n'.format(headers['Content-Type'])
+        .encode('utf-8') + body)
+    return {part.get_param('name', header='content-disposition'):
+            (part.get_filename(), part.get_payload(decode=True))
+            for part in message.get_payload()}
+
+
+@pytest.fixture
+def octoprint(octoprint):
+    octoprint.routes[('POST', '/api/files/local')] = {
+        'done': True, 'files': {'local': {'name': 'test.gcode'}}}
+    return octoprint
+
+
+class TestMinifier:
+    def test_minify(self):
+        minifier = Minifier()
+        assert b''.join(minifier.lines([GCODE])) == MINIFIED
+        assert minifier.bytes_in == len(GCODE)
+        assert minifier.bytes_out == len(MINIFIED)
+        assert minifier.saved == len(GCODE) - len(MINIFIED)
+        assert minifier.lines_dropped == 5
+
+    @pytest.mark.parametrize('chunk_size', (1, 7, 64, 10000))
+    def test_chunk_boundaries(self, chunk_size):
+        minifier = Minifier()
+        chunks = list(minifier.stream(io.BytesIO(GCODE), chunk_size))
+        assert b''.join(chunks) == MINIFIED
+        assert minifier.saved == len(GCODE) - len(MINIFIED)
+
+    def test_reused_for_another_stream(self):
+        minifier = Minifier()
+        assert b''.join(minifier.lines([b'G1 F1800\n'])) == b'G1 F1800\n'
+        assert b''.join(minifier.stream(io.BytesIO(b'G1 F1800\n'))) == \
+            b'G1 F1800\n'
+        assert b''.join(minifier.lines([GCODE])) == MINIFIED
+        assert minifier.lines_dropped == 5
+
+    def test_text_file(self):
+        stream = Minifier().stream(io.StringIO(GCODE.decode('utf-8')))
+        assert b''.join(stream) == MINIFIED
+
+    def test_keep(self):
+        minifier = Minifier(keep=(';LAYER:', ';FLAVOR:'))
+        assert minifier.line(b' ;FLAVOR:Marlin') == b';FLAVOR:Marlin'
+        assert Minifier(keep=()).line(b';LAYER:0') is None
+
+    @pytest.mark.parametrize(('line', 'minified'), (
+        (b'G1 X0.0', b'G1 X0'),
+        (b'G1 X-0.50', b'G1 X-0.5'),
+        (b'G1 X100 Y.50', b'G1 X100 Y.5'),
+        (b'G28 X0 Y0', b'G28 X0 Y0'),
+        (b'G10', b'G10'),
+        (b'M104 S200.0', b'M104 S200.0'),
+        (b'G1X1.0Y2.0', b'G1X1Y2'),
+    ))
+    def test_numbers(self, line, minified):
+        assert Minifier().line(line) == minified
+
+
+class TestUpload:
+    def test_upload_minified(self, client, octoprint, tmp_path):
+        path = tmp_path / 'test.gcode'
+        path.write_bytes(GCODE)
+        minifier = Minifier()
+        response = client.upload(str(path), select=True, minify=minifier)
+        assert response['done']
+        request = [r for r in octoprint.requests if r[0] == 'POST'][-1]
+        assert request[3].get('Transfer-Encoding') == 'chunked'
+        parts = parse_upload(request)
+        assert parts['file'] == ('test.gcode', MINIFIED)
+        assert parts['select'] == (None, b'true')
+        assert parts['print'] == (None, b'false')
+        assert minifier.saved == len(GCODE) - len(MINIFIED)
+
+    def test_upload_file_object(self, client, octoprint):
+        client.upload(('other.gcode', io.BytesIO(GCODE)), minify=True)
+        request = [r for r in octoprint.requests if r[0] == 'POST'][-1]
+        assert parse_upload(request)['file'] == ('other.gcode', MINIFIED)
+
+    def test_upload_not_minified(self, client, octoprint):
+        client.upload(('other.gcode', io.BytesIO(GCODE)))
+        request = [r for r in octoprint.requests if r[0] == 'POST'][-1]
+        assert parse_upload(request)['file'] == ('other.gcode', GCODE)
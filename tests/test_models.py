@@ -0,0 +1,179 @@
+import json
+import tracemalloc
+
+import pytest
+
+from octoclient.models import (ConnectionInfo, FileEntry, JobInfo,
+                               PrinterState, TemperatureReading, _compact)
+
+
+JOB = {'job': {'file': {'name': 'homex.gcode', 'origin': 'local'},
+               'estimatedPrintTime': 120.5},
+       'progress': {'completion': 42.0, 'filepos': 1234,
+                    'printTime': 50, 'printTimeLeft': 70},
+       'state': 'Printing'}
+PRINTER = {'sd': {'ready': True},
+           'state': {'text': 'Printing',
+                     'flags': {'operational': True, 'printing': True,
+                               'paused': False, 'error': False}},
+           'temperature': {'tool0': {'actual': 200.0, 'target': 210.0,
+                                     'offset': 0},
+                           'bed': {'actual': 60.0, 'target': 60.0,
+                                   'offset': 0}}}
+ENTRY = {'name': 'homex.gcode', 'path': 'homex.gcode', 'type': 'machinecode',
+         'origin': 'local', 'size': 1337, 'date': 1500000000,
+         'hash': 'abc', 'refs': {'download': 'http://x/downloads/files/'
+                                             'local/homex.gcode'},
+         'gcodeAnalysis': {'estimatedPrintTime': 120.5}}
+FOLDER = {'name': 'parts', 'path': 'parts', 'type': 'folder',
+          'origin': 'local', 'children': [ENTRY]}
+FILES = {'files': [ENTRY, FOLDER], 'free': 1000}
+CONNECTION = {'current': {'state': 'Operational', 'port': '/dev/ttyACM0',
+                          'baudrate': 115200, 'printerProfile': '_default'}}
+
+
+@pytest.fixture
+def octoprint(octoprint):
+    octoprint.routes[('GET', '/api/job')] = JOB
+    octoprint.routes[('GET', '/api/printer')] = PRINTER
+    octoprint.routes[('GET', '/api/files')] = FILES
+    octoprint.routes[('GET', '/api/files/local/homex.gcode')] = ENTRY
+    octoprint.routes[('GET', '/api/connection')] = CONNECTION
+    return octoprint
+
+
+class TestModels:
+    def test_job_info(self, client):
+        job = client.job_info(model=True)
+        assert isinstance(job, JobInfo)
+        assert job.state == 'Printing'
+        assert job.completion == 42.0
+        assert job.file['name'] == 'homex.gcode'
+        assert job.estimated_print_time == 120.5
+        assert job.print_time_left == 70
+        assert job.to_dict() == JOB
+
+    def test_fields_are_parsed_lazily(self):
+        job = JobInfo(json.dumps(JOB))
+        with pytest.raises(AttributeError):
+            job._state
+        assert job.state == 'Printing'
+        # one parse fills all the fields
+        assert job._state == 'Printing'
+        assert job._completion == 42.0
+
+    def test_parsed_once(self, monkeypatch):
+        parses = []
+        loads = json.loads
+        monkeypatch.setattr(json, 'loads',
+                            lambda *a, **k: parses.append(1) or loads(*a, **k))
+        job = JobInfo(json.dumps(JOB))
+        assert (job.state, job.file['name'], job.completion, job.print_time,
+                job.filepos) == ('Printing', 'homex.gcode', 42.0, 50, 1234)
+        assert len(parses) == 1
+
+    def test_printer(self, client):
+        printer = client.printer(model=True)
+        assert printer.text == 'Printing'
+        assert printer.printing and printer.operational
+        assert not printer.paused and not printer.error
+        assert printer.sd_ready is True
+        assert printer.temperature['tool0'] == TemperatureReading(
+            'tool0', 200.0, 210.0, 0)
+        assert printer.temperature['bed'].target == 60.0
+
+    def test_missing_sections_are_none(self):
+        printer = PrinterState(b'{"state": {"text": "Operational"}}')
+        assert printer.temperature is None
+        assert printer.sd_ready is None
+        assert not printer.printing
+
+    def test_files_listing(self, client):
+        entries = client.files(model=True)
+        assert [e.name for e in entries] == ['homex.gcode', 'parts']
+        assert entries[0].size == 1337
+        assert entries[0].download.endswith('/local/homex.gcode')
+        assert entries[1].children == [FileEntry(ENTRY)]
+
+    def test_files_parsed_once(self, client, monkeypatch):
+        parses = []
+        loads = json.loads
+        monkeypatch.setattr(json, 'loads',
+                            lambda *a, **k: parses.append(1) or loads(*a, **k))
+        entries = client.files(model=True)
+        assert len(parses) == 1
+        assert client.files('homex.gcode', model=True).size == 1337
+        assert len(parses) == 2
+        assert len(entries) == 2
+
+    def test_files_single_entry(self, client):
+        entry = client.files('homex.gcode', model=True)
+        assert entry.hash == 'abc'
+        assert entry.analysis == {'estimatedPrintTime': 120.5}
+
+    def test_state_still_works(self, client):
+        assert client.state() == 'Operational'
+
+    def test_no_dict_attribute(self):
+        with pytest.raises(AttributeError):
+            JobInfo(b'{}').whatever = 1
+
+    def test_models_are_smaller_than_dicts(self):
+        raw = json.dumps(FILES).encode('utf-8')
+
+        def allocated(make):
+            tracemalloc.start()
+            kept = [make() for _ in range(200)]
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            assert kept
+            return size
+
+        dicts = allocated(lambda: json.loads(raw.decode('utf-8')))
+        models = allocated(lambda: FileEntry.listing(raw))
+        assert models < dicts / 2
+
+    def test_reading_a_field_keeps_models_small(self):
+        analysis = {'estimatedPrintTime': 120.5,
+                    'filament': {'tool{}'.format(i): {'length': i * 100.5,
+                                                      'volume': i * 1.5}
+                                 for i in range(8)},
+                    'printingArea': {k: 10.0 for k in (
+                        'minX', 'maxX', 'minY', 'maxY', 'minZ', 'maxZ')}}
+        entry = dict(ENTRY, gcodeAnalysis=analysis)
+        folder = dict(FOLDER, children=[entry] * 10)
+        raw = json.dumps({'files': [entry, folder] * 50}).encode('utf-8')
+
+        def allocated(make):
+            tracemalloc.start()
+            kept = make()
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            assert kept
+            return size
+
+        def read_names():
+            entries = FileEntry.listing(raw)
+            assert {e.name for e in entries} == {'homex.gcode', 'parts'}
+            return entries
+
+        dicts = allocated(lambda: json.loads(raw.decode('utf-8')))
+        models = allocated(read_names)
+        assert models < dicts / 2
+        # the slices are decoded on access
+        entry = FileEntry(_compact(folder))
+        assert entry.name == 'parts'
+        assert entry.children[0].analysis == analysis
+
+    def test_member(self):
+        info = ConnectionInfo(json.dumps(
+            {'current': CONNECTION['current'], 'options': []}))
+        assert info.member('current') == CONNECTION['current']
+        assert info.member('options') == []
+        assert info.member('missing') is None
+        assert ConnectionInfo(b' [1]').member('current') is None
+
+    def test_member_parses_only_up_to_it(self):
+        info = ConnectionInfo(b'{"current": {"state": "Operational"}, '
+                              b'"options": {"ports": [')  # not valid JSON
+        assert info.member('current') == {'state': 'Operational'}
@@ -0,0 +1,188 @@
+import time
+
+import pytest
+
+from octoclient import OctoClient
+from octoclient.ratelimit import COMMAND, READ, AdaptiveBucket, RateLimiter
+
+from _common import APIKEY
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def bucket(clock, rate=4, **kwargs):
+    return AdaptiveBucket(rate, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+class TestAdaptiveBucket:
+    def test_burst_then_wait(self, clock):
+        b = bucket(clock)
+        for _ in range(4):
+            assert b.acquire()
+        assert clock.slept == []
+        assert b.acquire()
+        assert clock.slept == [pytest.approx(0.25)]
+        assert b.waited == pytest.approx(0.25)
+
+    def test_refill(self, clock):
+        b = bucket(clock, burst=2)
+        assert b.acquire() and b.acquire()
+        clock.now += 10
+        assert b.acquire() and b.acquire()
+        assert clock.slept == []
+
+    def test_timeout(self, clock):
+        b = bucket(clock, rate=1)
+        assert b.acquire(timeout=0)
+        assert not b.acquire(timeout=0)
+        assert not b.acquire(timeout=0.5)
+        assert clock.now == pytest.approx(0.5)
+
+    @pytest.mark.parametrize(('elapsed', 'status'), (
+        (0.1, 500), (0.1, 503), (0.1, None), (2.0, 200)))
+    def test_decrease(self, clock, elapsed, status):
+        b = bucket(clock, rate=8)
+        b.record(elapsed, status)
+        assert b.rate == 4
+        assert b.decreases == 1
+
+    def test_unknown_latency(self, clock):
+        b = bucket(clock, rate=8)
+        b.record(None, 200)
+        assert b.decreases == 0
+        b.record(None, 503)
+        assert b.decreases == 1
+
+    def test_cooldown(self, clock):
+        b = bucket(clock, rate=8, cooldown=1.0)
+        b.record(0.1, 500)
+        b.record(0.1, 500)
+        assert b.rate == 4
+        clock.now += 1
+        b.record(0.1, 500)
+        assert b.rate == 2
+
+    def test_min_rate(self, clock):
+        b = bucket(clock, rate=8, min_rate=3, cooldown=0)
+        for _ in range(5):
+            b.record(0.1, 500)
+        assert b.rate == 3
+
+    def test_increase(self, clock):
+        b = bucket(clock, rate=8, cooldown=0)
+        b.record(0.1, 500)
+        b.record(0.1, 200)
+        assert b.rate == pytest.approx(4.25)
+        for _ in range(1000):
+            b.record(0.1, 200)
+        assert b.rate == 8
+        b.record(0.1, 404)
+        assert b.rate == 8
+
+
+class TestRateLimiter:
+    def test_kind(self):
+        assert RateLimiter.kind('GET') == READ
+        assert RateLimiter.kind('POST') == COMMAND
+        assert RateLimiter.kind('DELETE') == COMMAND
+
+    def test_buckets(self):
+        limiter = RateLimiter(read_rate=5, command_rate=1)
+        limiter.acquire('http://a', READ)
+        limiter.acquire('http://a', COMMAND)
+        limiter.acquire('http://b', READ)
+        assert limiter.bucket('http://a', READ) is not \
+            limiter.bucket('http://b', READ)
+        assert limiter.stats() == {'http://a': {READ: 5, COMMAND: 1},
+                                   'http://b': {READ: 5}}
+
+    def test_timeout(self):
+        limiter = RateLimiter(command_rate=0.01, min_rate=0.01, timeout=0)
+        limiter.acquire('http://a', COMMAND)
+        with pytest.raises(RuntimeError):
+            limiter.acquire('http://a', COMMAND)
+
+
+@pytest.fixture
+def octoprint(octoprint):
+    octoprint.routes[('GET', '/api/job')] = {'state': 'Printing'}
+    octoprint.routes[('POST', '/api/job')] = None
+    octoprint.routes[('GET', '/api/printer')] = \
+        lambda handler, body: (503, b'busy')
+    return octoprint
+
+
+class TestOctoClient:
+    def test_limited(self, octoprint):
+        limiter = RateLimiter(read_rate=100, command_rate=0.01,
+                              min_rate=0.01, timeout=0)
+        client = OctoClient(url=octoprint.url, apikey=APIKEY,
+                            limiter=limiter)
+        client.job_info()
+        client.print()
+        # the command budget is used up
+        with pytest.raises(RuntimeError):
+            client.restart()
+        assert octoprint.paths('POST') == ['/api/job']
+
+    def test_bypass(self, octoprint):
+        limiter = RateLimiter(command_rate=0.01, min_rate=0.01, timeout=0)
+        client = OctoClient(url=octoprint.url, apikey=APIKEY,
+                            limiter=limiter)
+        client.print()
+        client.pause()
+        client.cancel()
+        assert octoprint.paths('POST') == ['/api/job'] * 3
+
+    def test_server_errors_slow_down(self, octoprint):
+        limiter = RateLimiter(read_rate=100)
+        client = OctoClient(url=octoprint.url, apikey=APIKEY,
+                            limiter=limiter)
+        with pytest.raises(RuntimeError):
+            client.printer()
+        assert limiter.stats()[octoprint.url][READ] == 50
+        client.job_info()
+        assert limiter.stats()[octoprint.url][READ] > 50
+
+    @pytest.mark.parametrize('minify', (False, True))
+    def test_slow_upload_does_not_slow_down(self, octoprint, tmp_path,
+                                            minify):
+        def slow(handler, body):
+            time.sleep(0.2)
+            return {'done': True}
+
+        octoprint.routes[('POST', '/api/files/local')] = slow
+        path = tmp_path / 'cube.gcode'
+        path.write_bytes(b'G1 X1\n')
+        limiter = RateLimiter(latency_target=0.1)
+        client = OctoClient(url=octoprint.url, apikey=APIKEY,
+                            limiter=limiter)
+        client.upload(str(path), minify=minify)
+        assert limiter.bucket(octoprint.url, COMMAND).decreases == 0
+        octoprint.routes[('POST', '/api/job')] = slow
+        client.print()
+        assert limiter.bucket(octoprint.url, COMMAND).decreases == 1
+
+    def test_hooks(self, octoprint):
+        events = []
+        client = OctoClient(url=octoprint.url, apikey=APIKEY,
+                            limiter=RateLimiter(), hooks=[events.append])
+        client.job_info()
+        assert [(e.method, e.path, e.status) for e in events] == [
+            ('GET', '/api/version', 200), ('GET', '/api/job', 200)]
@@ -0,0 +1,139 @@
+import gzip
+import json
+import time
+
+from octoclient import WebSocketEventHandler, XHRStreamingGenerator
+from octoclient.metrics import StreamMetrics
+from octoclient.recording import Recorder, ReplayEventHandler, read_recording
+
+from _common import URL
+
+
+class FakeStreamingSession:
+    def __init__(self, lines):
+        self.lines = lines
+
+    def post(self, url, stream=False):
+        return self
+
+    def iter_lines(self):
+        return iter(self.lines)
+
+    def close(self):
+        pass
+
+
+def frames(n=3):
+    result = ['o', 'h']
+    for i in range(n):
+        current = {'current': {'progress': {'completion': i},
+                               'logs': ['Recv: ok\tT:210'],
+                               'state': {'text': 'Printing'}}}
+        result.append('a' + json.dumps([current, {'event': {'n': i}}]))
+    result.append('m' + json.dumps({'plugin': {'x': 1}}))
+    result.append('c[3000,"Go away!"]')
+    return result
+
+
+def write_recording(path, timed_frames):
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for timestamp, frame in timed_frames:
+            f.write('{!r}\t{}\n'.format(timestamp, frame))
+
+
+class Collector:
+    def __init__(self):
+        self.messages = []
+        self.events = []
+
+    def on_message(self, api, message):
+        self.messages.append(message)
+
+    def on_open(self, api):
+        self.events.append('open')
+
+    def on_close(self, api):
+        self.events.append('close')
+
+
+class TestRecorder:
+    def test_record_handler(self, tmp_path):
+        path = str(tmp_path / 'stream.gz')
+        with Recorder(path) as recorder:
+            handler = WebSocketEventHandler(URL, on_frame=recorder)
+            for frame in frames():
+                handler._dispatch(None, frame)
+        assert recorder.frames == len(frames())
+        recorded = list(read_recording(path))
+        assert [f for _, f in recorded] == frames()
+        timestamps = [t for t, _ in recorded]
+        assert timestamps == sorted(timestamps)
+        assert abs(timestamps[0] - time.time()) < 60
+
+    def test_record_generator(self, tmp_path):
+        path = str(tmp_path / 'stream.gz')
+        lines = [f.encode('utf-8') for f in frames()]
+        with Recorder(path) as recorder:
+            generator = XHRStreamingGenerator(
+                URL, session=FakeStreamingSession(lines), on_frame=recorder)
+            loop = generator.read_loop()
+            for _ in range(7):
+                next(loop)
+        # the generator is suspended in the m frame, c was not read yet
+        assert [f for _, f in read_recording(path)] == frames()[:6]
+
+    def test_append(self, tmp_path):
+        path = str(tmp_path / 'stream.gz')
+        for frame in ('o', 'h'):
+            with Recorder(path) as recorder:
+                recorder(frame)
+        assert [f for _, f in read_recording(path)] == ['o', 'h']
+
+
+class TestReplay:
+    def test_replay_dispatches(self, tmp_path):
+        path = str(tmp_path / 'stream.gz')
+        write_recording(path, enumerate(frames()))
+        collector = Collector()
+        metrics = StreamMetrics()
+        handler = ReplayEventHandler(
+            path, on_open=collector.on_open, on_close=collector.on_close,
+            on_message=collector.on_message, metrics=metrics, speed=None)
+        assert handler.play() == len(frames())
+        assert collector.events == ['open', 'close']
+        assert len(collector.messages) == 7
+        assert collector.messages[0]['current']['logs'] == ['Recv: ok\tT:210']
+        assert metrics.messages == {'current': 3, 'event': 3, 'plugin': 1}
+        assert metrics.frames == {'o': 1, 'h': 1, 'a': 3, 'm': 1, 'c': 1}
+
+    def test_replay_same_as_live(self, tmp_path):
+        path = str(tmp_path / 'stream.gz')
+        live = Collector()
+        with Recorder(path) as recorder:
+            handler = WebSocketEventHandler(URL, on_message=live.on_message,
+                                            on_frame=recorder)
+            for frame in frames(10):
+                handler._dispatch(None, frame)
+        replayed = Collector()
+        ReplayEventHandler(path, on_message=replayed.on_message,
+                           speed=None).play()
+        assert replayed.messages == live.messages
+
+    def test_speed(self, tmp_path):
+        path = str(tmp_path / 'stream.gz')
+        write_recording(path, [(100.0, 'o'), (100.2, 'h'), (100.4, 'h')])
+        start = time.monotonic()
+        ReplayEventHandler(path, speed=4).play()
+        elapsed = time.monotonic() - start
+        assert 0.1 <= elapsed < 0.5
+
+    def test_run_in_thread(self, tmp_path):
+        path = str(tmp_path / 'stream.gz')
+        write_recording(path, enumerate(frames()))
+        collector = Collector()
+        handler = ReplayEventHandler(path, on_message=collector.on_message,
+                                     speed=1000)
+        handler.run()
+        handler.wait()
+        assert handler.frames == len(frames())
+        assert len(collector.messages) == 7
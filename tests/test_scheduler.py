@@ -0,0 +1,173 @@
+import io
+
+import pytest
+
+from octoclient import OctoClient
+from octoclient.scheduler import Scheduler
+
+from _common import APIKEY
+from _fakeserver import FakeOctoPrint
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def fake_printer(server, profile, state='Operational'):
+    server.state = state
+
+    def connection(handler, body):
+        return {'current': {'state': server.state, 'port': '/dev/ttyACM0',
+                            'baudrate': 115200, 'printerProfile': profile}}
+
+    def upload(handler, body):
+        server.state = 'Printing'
+        return {'done': True, 'files': {'local': {'name': 'x.gcode'}}}
+
+    server.routes[('GET', '/api/connection')] = connection
+    server.routes[('POST', '/api/files/local')] = upload
+
+
+@pytest.fixture
+def farm():
+    with FakeOctoPrint() as a, FakeOctoPrint() as b, FakeOctoPrint() as c:
+        fake_printer(a, 'mk3')
+        fake_printer(b, 'mk3')
+        fake_printer(c, 'mini')
+        yield a, b, c
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def scheduler(farm, clock):
+    clients = [OctoClient(url=s.url, apikey=APIKEY) for s in farm]
+    scheduler = Scheduler(clients, clock=clock)
+    yield scheduler
+    scheduler.close()
+
+
+def job(name, size=100):
+    return (name, io.BytesIO(b'G1 X1\n' * size))
+
+
+def uploads(server):
+    return [r for r in server.requests if r[0] == 'POST']
+
+
+class TestScheduler:
+    def test_fills_idle_printers(self, scheduler, farm):
+        jobs = [scheduler.submit(job('{}.gcode'.format(n))) for n in range(5)]
+        started = scheduler.step()
+        scheduler.wait()
+        assert started == jobs[:3]
+        assert sorted(j.printer for j in started) == sorted(s.url
+                                                            for s in farm)
+        assert all(len(uploads(s)) == 1 for s in farm)
+        assert scheduler.pending == 2
+        body = uploads(farm[0])[0][2]
+        assert b'name="print"\r\n\r\ntrue' in body
+        assert b'name="select"\r\n\r\ntrue' in body
+
+    def test_busy_printers_get_nothing(self, scheduler, farm):
+        farm[0].state = 'Printing'
+        farm[1].state = 'Offline'
+        scheduler.submit(job('a.gcode'))
+        scheduler.submit(job('b.gcode'))
+        started = scheduler.step()
+        scheduler.wait()
+        assert [j.printer for j in started] == [farm[2].url]
+        assert not uploads(farm[0]) and not uploads(farm[1])
+
+    def test_profile_does_not_block_the_queue(self, scheduler, farm):
+        farm[2].state = 'Printing'
+        mini = scheduler.submit(job('mini.gcode'), profile='mini')
+        mk3 = scheduler.submit(job('mk3.gcode'), profile='mk3')
+        started = scheduler.step()
+        assert started == [mk3]
+        assert mk3.printer in (farm[0].url, farm[1].url)
+        assert list(scheduler.queue) == [mini]
+        scheduler.wait()
+
+        farm[2].state = 'Operational'
+        assert scheduler.step() == [mini]
+        scheduler.wait()
+        assert mini.printer == farm[2].url
+
+    def test_prefers_fast_upload(self, scheduler, farm):
+        scheduler.printers[farm[0].url].upload_rate = 1000
+        scheduler.printers[farm[1].url].upload_rate = 10 ** 9
+        scheduler.submit(job('a.gcode'), profile='mk3')
+        started = scheduler.step()
+        scheduler.wait()
+        assert [j.printer for j in started] == [farm[1].url]
+
+    def test_printer_not_reused_before_poll(self, scheduler, farm):
+        for n in range(4):
+            scheduler.submit(job('{}.gcode'.format(n)))
+        scheduler.step()
+        scheduler.wait()
+        # the upload leaves the printers starting, nothing else to assign
+        assert scheduler.step(poll=False) == []
+        farm[0].state = 'Operational'
+        assert [j.printer for j in scheduler.step()] == [farm[0].url]
+
+    def test_failed_upload(self, scheduler, farm):
+        farm[1].state = farm[2].state = 'Printing'
+        del farm[0].routes[('POST', '/api/files/local')]
+        broken = scheduler.submit(job('a.gcode'))
+        scheduler.step()
+        scheduler.wait()
+        assert scheduler.failed == [broken]
+        assert isinstance(broken.error, RuntimeError)
+        assert scheduler.stats()['failed'] == 1
+
+    def test_push_updates(self, scheduler, farm):
+        scheduler.step()  # learn the profiles
+        farm[0].state = farm[1].state = farm[2].state = 'Printing'
+        on_message = scheduler.on_message(farm[1].url)
+        on_message(None, {'current': {'state': {'text': 'Operational'}}})
+        for url in (farm[0].url, farm[2].url):
+            scheduler.update(url, 'Printing')
+        a = scheduler.submit(job('a.gcode'))
+        assert scheduler.step(poll=False) == [a]
+        scheduler.wait()
+        assert a.printer == farm[1].url
+
+    def test_stats(self, scheduler, farm, clock):
+        farm[2].state = 'Printing'
+        scheduler.step()
+        first = scheduler.submit(job('a.gcode'))
+        clock.now += 10
+        scheduler.step()
+        scheduler.wait()
+        clock.now += 30
+        scheduler.update(farm[0].url, 'Operational')
+        scheduler.update(farm[1].url, 'Operational')
+        clock.now += 60
+
+        stats = scheduler.stats()
+        assert stats['queued'] == 0
+        assert stats['started'] == 1
+        assert stats['queue_wait']['mean'] == first.wait == 10
+        printer = stats['printers'][first.printer]
+        assert printer['jobs'] == 1
+        assert printer['printing'] == 30
+        assert printer['utilization'] == pytest.approx(30 / 100)
+        assert stats['printers'][farm[2].url]['utilization'] == 1
+        assert stats['utilization'] == pytest.approx((30 + 100) / 300)
+
+    def test_run_until_empty(self, scheduler, farm):
+        for n in range(3):
+            scheduler.submit(job('{}.gcode'.format(n)))
+        scheduler.run(interval=0.01)
+        scheduler.wait()
+        assert scheduler.pending == 0
+        assert len(scheduler.started) == 3
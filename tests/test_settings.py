@@ -0,0 +1,145 @@
+import copy
+import json
+
+import pytest
+
+from octoclient import Fleet, OctoClient
+from octoclient.cache import MetadataCache
+
+from _common import APIKEY
+from _fakeserver import FakeOctoPrint
+
+
+SETTINGS = {
+    'appearance': {'name': 'Prusa', 'color': 'default'},
+    'feature': {'sdSupport': True, 'temperatureGraph': True},
+    'temperature': {'profiles': [{'name': 'PLA', 'extruder': 210}]},
+    'webcam': {'streamUrl': '/webcam/?action=stream', 'flipH': False},
+}
+
+
+def merge(tree, patch):
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(tree.get(key), dict):
+            merge(tree[key], value)
+        else:
+            tree[key] = value
+
+
+def settings_routes(server, broken=False):
+    server.settings = copy.deepcopy(SETTINGS)
+    server.posted = []
+
+    def post(handler, body):
+        patch = json.loads(body.decode('utf-8'))
+        server.posted.append(patch)
+        if not broken:
+            merge(server.settings, patch)
+        return (200, json.dumps(server.settings).encode('utf-8'),
+                {'Content-Type': 'application/json'})
+
+    server.routes[('GET', '/api/settings')] = \
+        lambda handler, body: (200, json.dumps(server.settings).encode(),
+                               {'Content-Type': 'application/json'})
+    server.routes[('POST', '/api/settings')] = post
+
+
+@pytest.fixture
+def octoprint(octoprint):
+    settings_routes(octoprint)
+    return octoprint
+
+
+class TestApplySettings:
+    def test_patch(self):
+        patch = OctoClient._settings_patch(SETTINGS, {
+            'appearance': {'name': 'Prusa', 'color': 'red'},
+            'feature': {'sdSupport': True},
+            'temperature': {'profiles': [{'name': 'PLA', 'extruder': 215}]},
+            'serial': {'port': '/dev/ttyACM0'},
+        })
+        assert patch == {
+            'appearance': {'color': 'red'},
+            'temperature': {'profiles': [{'name': 'PLA', 'extruder': 215}]},
+            'serial': {'port': '/dev/ttyACM0'},
+        }
+
+    def test_posts_difference(self, octoprint, client):
+        desired = copy.deepcopy(SETTINGS)
+        desired['webcam']['flipH'] = True
+        assert client.apply_settings(desired) == {'webcam': {'flipH': True}}
+        assert octoprint.posted == [{'webcam': {'flipH': True}}]
+        assert octoprint.settings['webcam']['flipH'] is True
+
+    def test_complies(self, octoprint, client):
+        assert client.apply_settings(SETTINGS) == {}
+        assert client.apply_settings({'feature': {'sdSupport': True}}) == {}
+        assert octoprint.posted == []
+
+    def test_dry_run(self, octoprint, client):
+        patch = client.apply_settings({'appearance': {'name': 'MK3'}},
+                                      dry_run=True)
+        assert patch == {'appearance': {'name': 'MK3'}}
+        assert octoprint.posted == []
+
+    def test_cached(self, octoprint, tmp_path):
+        cache = MetadataCache(str(tmp_path / 'cache.sqlite'), max_age=60)
+        client = OctoClient(url=octoprint.url, apikey=APIKEY, cache=cache)
+        client.apply_settings(SETTINGS)
+        client.apply_settings(SETTINGS)
+        assert octoprint.paths().count('/api/settings') == 1
+        client.apply_settings({'appearance': {'name': 'MK3'}})
+        # posting invalidated the cached settings
+        client.apply_settings({'appearance': {'name': 'MK3'}})
+        assert octoprint.paths().count('/api/settings') == 2
+        assert octoprint.posted == [{'appearance': {'name': 'MK3'}}]
+        cache.close()
+
+
+class TestFleetApplySettings:
+    @pytest.fixture
+    def servers(self):
+        servers = [FakeOctoPrint() for _ in range(4)]
+        for server in servers:
+            settings_routes(server)
+            server.__enter__()
+        yield servers
+        for server in servers:
+            server.__exit__(None, None, None)
+
+    def fleet(self, servers):
+        return Fleet(OctoClient(url=s.url, apikey=APIKEY) for s in servers)
+
+    def test_rollout(self, servers):
+        servers[1].settings['appearance']['name'] = 'MK3'
+        results = self.fleet(servers).apply_settings(
+            {'appearance': {'name': 'MK3'}})
+        assert results == {
+            servers[0].url: {'appearance': {'name': 'MK3'}},
+            servers[1].url: {},
+            servers[2].url: {'appearance': {'name': 'MK3'}},
+            servers[3].url: {'appearance': {'name': 'MK3'}},
+        }
+        assert [len(s.posted) for s in servers] == [1, 0, 1, 1]
+
+    def test_canary_fails(self, servers):
+        settings_routes(servers[0], broken=True)
+        results = self.fleet(servers).apply_settings(
+            {'appearance': {'name': 'MK3'}})
+        assert isinstance(results[servers[0].url], RuntimeError)
+        assert [results[s.url] for s in servers[1:]] == [None] * 3
+        assert [len(s.posted) for s in servers] == [1, 0, 0, 0]
+
+    def test_errors_after_canary(self, servers):
+        del servers[2].routes[('POST', '/api/settings')]
+        results = self.fleet(servers).apply_settings(
+            {'appearance': {'name': 'MK3'}}, canary=2)
+        assert isinstance(results[servers[2].url], RuntimeError)
+        assert results[servers[3].url] == {'appearance': {'name': 'MK3'}}
+
+    def test_dry_run(self, servers):
+        results = self.fleet(servers).apply_settings(
+            {'appearance': {'name': 'MK3'}}, dry_run=True)
+        assert all(r == {'appearance': {'name': 'MK3'}}
+                   for r in results.values())
+        assert [len(s.posted) for s in servers] == [0] * 4
@@ -0,0 +1,157 @@
+import pytest
+
+from octoclient import Fleet, OctoClient
+
+from _common import APIKEY
+
+
+JOB = {'job': {'file': {'name': 'homex.gcode'}},
+       'progress': {'completion': 42.0},
+       'state': 'Printing'}
+CONNECTION = {'current': {'state': 'Printing', 'port': '/dev/ttyACM0'}}
+PRINTER = {'sd': {'ready': False},
+           'state': {'text': 'Printing', 'flags': {'printing': True}},
+           'temperature': {'tool0': {'actual': 200.0, 'target': 200.0}}}
+
+
+def printer_route(handler, body):
+    excluded = []
+    if 'exclude=' in handler.path:
+        excluded = handler.path.split('exclude=')[1].split('%2C')
+    return {k: v for k, v in PRINTER.items() if k not in excluded}
+
+
+@pytest.fixture
+def octoprint(octoprint):
+    octoprint.routes[('GET', '/api/job')] = JOB
+    octoprint.routes[('GET', '/api/connection')] = CONNECTION
+    octoprint.routes[('GET', '/api/printer')] = printer_route
+    return octoprint
+
+
+class TestSnapshot:
+    def test_all_parts(self, client, octoprint):
+        snapshot = client.snapshot()
+        assert snapshot['job'] == JOB
+        assert snapshot['connection'] == CONNECTION
+        for part in 'sd', 'state', 'temperature':
+            assert snapshot[part] == PRINTER[part]
+        assert isinstance(snapshot['timestamp'], float)
+        assert sorted(octoprint.paths())[:3] == ['/api/connection',
+                                                 '/api/job',
+                                                 '/api/printer']
+
+    def test_printer_parts_are_excluded(self, client, octoprint):
+        snapshot = client.snapshot(['state'])
+        assert set(snapshot) == {'timestamp', 'state'}
+        assert octoprint.paths()[-1] == '/api/printer?exclude=sd%2Ctemperature'
+
+    def test_no_printer_request_when_not_needed(self, client, octoprint):
+        snapshot = client.snapshot(['job'])
+        assert set(snapshot) == {'timestamp', 'job'}
+        assert '/api/printer' not in octoprint.paths()
+
+    def test_connections_reused(self, client, octoprint):
+        for _ in range(20):
+            client.snapshot()
+        # at most one per part requested at the same time
+        assert octoprint.connections <= 3
+
+    def test_session_settings_apply_to_all_parts(self, client, octoprint):
+        client.session.headers['X-Dashboard'] = 'yes'
+        client.snapshot()
+        headers = [r[3] for r in octoprint.requests[1:]]
+        assert len(headers) == 3
+        assert all(h.get('X-Dashboard') == 'yes' for h in headers)
+
+    def test_close(self, client):
+        client.snapshot()
+        executor = client.executor
+        client.close()
+        assert executor._shutdown
+        # a closed client gets a new pool when used again
+        assert client.snapshot(['job', 'connection'])['job'] == JOB
+
+    def test_unknown_part_raises(self, client):
+        with pytest.raises(ValueError):
+            client.snapshot(['webcam'])
+
+
+class TestNotOperational:
+    @pytest.fixture
+    def offline(self, octoprint):
+        octoprint.routes[('GET', '/api/printer')] = \
+            lambda handler, body: (409, b'Printer is not operational')
+        octoprint.routes[('GET', '/api/connection')] = \
+            {'current': {'state': 'Closed', 'port': None}}
+        return octoprint
+
+    def test_other_parts_kept(self, client, offline):
+        snapshot = client.snapshot()
+        assert snapshot['job'] == JOB
+        assert snapshot['connection']['current']['state'] == 'Closed'
+        assert snapshot['state']['text'] == 'Closed'
+        assert snapshot['state']['flags']['operational'] is False
+        assert snapshot['sd'] is None
+        assert snapshot['temperature'] is None
+
+    def test_state_from_connection(self, client, offline):
+        snapshot = client.snapshot(['job', 'state', 'temperature'])
+        assert set(snapshot) == {'timestamp', 'job', 'state', 'temperature'}
+        assert snapshot['state']['text'] == 'Closed'
+        assert '/api/connection' in offline.paths()
+
+    def test_fetch(self, client, offline):
+        assert client.fetch(['state.text', 'temperature.tool0.actual']) == {
+            'state.text': 'Closed', 'temperature.tool0.actual': None}
+
+    def test_other_errors_raise(self, client, octoprint):
+        octoprint.routes[('GET', '/api/printer')] = \
+            lambda handler, body: (500, b'Internal error')
+        with pytest.raises(RuntimeError):
+            client.snapshot()
+
+    def test_fleet(self, client, offline):
+        table = Fleet([client]).snapshot()
+        assert 'error' not in table[client.url]
+        assert table[client.url]['state']['text'] == 'Closed'
+
+
+class TestFleetSnapshot:
+    def test_table(self, client, octoprint):
+        broken = OctoClient(url=octoprint.url, apikey=APIKEY)
+        broken.url = 'http://127.0.0.1:1'
+        table = Fleet([client, broken]).snapshot(['job'])
+        assert table[client.url]['job'] == JOB
+        assert table[broken.url]['error']
+        assert 'timestamp' in table[broken.url]
+
+
+class TestFetch:
+    def test_projection(self, client, octoprint):
+        values = client.fetch(['state.text', 'temperature.tool0.actual',
+                               'progress.completion', 'job.file.name'])
+        assert values == {'state.text': 'Printing',
+                          'temperature.tool0.actual': 200.0,
+                          'progress.completion': 42.0,
+                          'job.file.name': 'homex.gcode'}
+        assert sorted(octoprint.paths()[1:]) == [
+            '/api/job', '/api/printer?exclude=sd']
+
+    def test_single_endpoint(self, client, octoprint):
+        values = client.fetch(['connection.current.port'])
+        assert values == {'connection.current.port': '/dev/ttyACM0'}
+        assert octoprint.paths()[1:] == ['/api/connection']
+
+    def test_missing_fields_are_none(self, client):
+        values = client.fetch(['temperature.tool1.actual', 'state.text.x'])
+        assert values == {'temperature.tool1.actual': None,
+                          'state.text.x': None}
+
+    def test_unknown_root_raises(self, client):
+        with pytest.raises(ValueError):
+            client.fetch(['webcam.streamUrl'])
+
+    def test_no_fields(self, client, octoprint):
+        assert client.fetch([]) == {}
+        assert octoprint.paths() == ['/api/version']
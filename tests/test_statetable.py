@@ -0,0 +1,174 @@
+import math
+import multiprocessing
+import threading
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from octoclient.statetable import (OPERATIONAL, PAUSED,  # noqa: E402
+                                   PRINTING, STATES, UNKNOWN, StateTable,
+                                   state_code)
+
+
+URL = 'http://printer1.local'
+
+CURRENT = {
+    'state': {'text': 'Printing',
+              'flags': {'operational': True, 'printing': True,
+                        'paused': False, 'error': False}},
+    'progress': {'completion': 42.5},
+    'temps': [{'time': 1, 'tool0': {'actual': 200.0, 'target': 210.0},
+               'bed': {'actual': 59.0, 'target': 60.0}},
+              {'time': 2, 'tool0': {'actual': 205.0, 'target': 210.0},
+               'bed': {'actual': 60.0, 'target': 60.0}}],
+}
+
+
+@pytest.fixture
+def table():
+    table = StateTable.create(capacity=8)
+    yield table
+    table.close()
+
+
+def read_in_child(name, url, results):
+    table = StateTable.attach(name)
+    row = table.read(url)
+    results.put((int(row['state']), float(row['progress'])))
+    table.close()
+
+
+class TestStateCode:
+    @pytest.mark.parametrize(('flags', 'code'), (
+        ({'operational': True}, OPERATIONAL),
+        ({'operational': True, 'printing': True}, PRINTING),
+        ({'operational': True, 'paused': True}, PAUSED),
+        ({'operational': False, 'closedOrError': True}, STATES.index(
+            'offline')),
+        ({'error': True, 'closedOrError': True}, STATES.index('error')),
+    ))
+    def test_flags(self, flags, code):
+        assert state_code({'text': '', 'flags': flags}) == code
+
+    def test_no_flags(self):
+        assert state_code(None) == UNKNOWN
+        assert state_code({'text': 'Offline'}) == UNKNOWN
+
+
+class TestStateTable:
+    def test_update_current(self, table):
+        table.update_current(URL, CURRENT, timestamp=1000.0)
+        row = table.read(URL)
+        assert row['url'] == URL.encode()
+        assert row['state'] == PRINTING
+        assert row['progress'] == 42.5
+        assert row['tool_actual'] == 205.0
+        assert row['tool_target'] == 210.0
+        assert row['bed_actual'] == 60.0
+        assert row['updated'] == 1000.0
+        assert row['seq'] == 2
+
+    def test_rest(self, table):
+        table.update_printer(URL, {
+            'state': CURRENT['state'],
+            'temperature': {'tool0': {'actual': 25.0, 'target': None},
+                            'bed': {'actual': 24.0, 'target': 0.0}}})
+        row = table.read(URL)
+        assert row['state'] == PRINTING
+        assert math.isnan(row['progress'])
+        assert math.isnan(row['tool_target'])
+        table.update_job(URL, {'progress': {'completion': 10.0}})
+        row = table.read(URL)
+        assert row['progress'] == 10.0
+        assert row['bed_actual'] == 24.0
+        assert row['seq'] == 4
+
+    def test_on_message(self, table):
+        table.on_message(URL)(None, CURRENT)
+        table.on_message(URL)(None, {'current': CURRENT})
+        assert len(table) == 1
+        assert table.read(URL)['progress'] == 42.5
+
+    def test_rows_zero_copy(self, table):
+        table.update(URL, state=OPERATIONAL)
+        rows = table.rows
+        assert not rows.flags.owndata
+        table.update(URL, state=PRINTING)
+        assert rows['state'][0] == PRINTING
+
+    def test_reader(self, table):
+        table.update(URL, state=OPERATIONAL, progress=1.0)
+        reader = StateTable.attach(table.name)
+        try:
+            assert reader.read('http://unknown') is None
+            assert reader.read(URL)['state'] == OPERATIONAL
+            table.update('http://printer2.local', progress=5.0)
+            assert reader.read('http://printer2.local')['progress'] == 5.0
+            with pytest.raises(RuntimeError):
+                reader.update(URL, progress=2.0)
+            snapshot = reader.snapshot()
+            assert list(snapshot['url']) == [b'http://printer1.local',
+                                             b'http://printer2.local']
+        finally:
+            reader.close()
+
+    def test_torn_row(self, table):
+        table.update(URL, progress=1.0)
+        rows = table.rows
+        rows['seq'][0] += 1  # the writer died in the middle
+        with pytest.raises(RuntimeError):
+            table.read(URL, retries=3)
+        rows['seq'][0] += 1
+        assert table.read(URL)['progress'] == 1.0
+
+    def test_concurrent_reads_consistent(self, table):
+        stop = threading.Event()
+
+        def write():
+            i = 0
+            while not stop.is_set():
+                i += 1
+                table.update(URL, progress=float(i), tool=(i, i),
+                             bed=(i, i))
+
+        table.update(URL, progress=0.0, tool=(0, 0), bed=(0, 0))
+        thread = threading.Thread(target=write)
+        thread.start()
+        try:
+            for _ in range(2000):
+                row = table.read(URL)
+                assert row['progress'] == row['tool_actual'] == \
+                    row['bed_target']
+        finally:
+            stop.set()
+            thread.join()
+
+    def test_full(self, table):
+        for i in range(8):
+            table.update('http://p{}'.format(i), progress=0.0)
+        with pytest.raises(RuntimeError):
+            table.update('http://p8', progress=0.0)
+
+    def test_not_a_table(self):
+        from multiprocessing import shared_memory
+        memory = shared_memory.SharedMemory(create=True, size=1024)
+        try:
+            with pytest.raises(ValueError):
+                StateTable(memory)
+        finally:
+            memory.close()
+            memory.unlink()
+
+    def test_other_process(self, table):
+        table.update_current(URL, CURRENT)
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        process = context.Process(target=read_in_child,
+                                  args=(table.name, URL, results))
+        process.start()
+        assert results.get(timeout=30) == (PRINTING, 42.5)
+        process.join(30)
+        assert process.exitcode == 0
+        # the reader exiting did not destroy the table
+        assert table.read(URL)['progress'] == 42.5
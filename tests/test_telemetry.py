@@ -0,0 +1,213 @@
+import csv
+import glob
+import math
+import os
+import threading
+
+import pytest
+
+from octoclient.telemetry import TelemetrySink, columns, flatten
+
+
+def current(n, state='Printing'):
+    return {
+        'state': {'text': state,
+                  'flags': {'printing': state == 'Printing', 'error': False}},
+        'job': {'file': {'name': 'cube.gcode', 'size': 1234}},
+        'progress': {'completion': n / 10, 'printTimeLeft': None},
+        'temps': [{'time': 1, 'tool0': {'actual': 100, 'target': 210}},
+                  {'time': 2, 'tool0': {'actual': 200.5, 'target': 210},
+                   'bed': {'actual': 60, 'target': 60}}],
+        'logs': ['Recv: ok'],
+        'messages': ['ok'],
+        'busyFiles': [],
+        'serverTime': 1000.0 + n,
+    }
+
+
+class TestFlatten:
+    def test_flatten(self):
+        row = flatten(current(5))
+        assert row == {
+            'state.text': 'Printing',
+            'state.flags.printing': True,
+            'state.flags.error': False,
+            'job.file.name': 'cube.gcode',
+            'job.file.size': 1234,
+            'progress.completion': 0.5,
+            'progress.printTimeLeft': None,
+            'temps.time': 2,
+            'temps.tool0.actual': 200.5,
+            'temps.tool0.target': 210,
+            'temps.bed.actual': 60,
+            'temps.bed.target': 60,
+            'serverTime': 1005.0,
+        }
+
+    def test_columns_are_typed(self):
+        data = columns([{'a': 1, 'b': True, 'c': 'x'},
+                        {'a': 2.5, 'd': None},
+                        {'b': False, 'c': 3}])
+        assert data['a'][:2] == [1.0, 2.5] and math.isnan(data['a'][2])
+        assert data['b'] == [True, False, False]
+        assert data['c'] == ['x', '', '3']
+        assert all(math.isnan(v) for v in data['d'])
+
+    def test_schema_is_kept_across_batches(self):
+        schema = {}
+        columns([{'a': 1.5, 'b': True, 'c': 'x'}], schema)
+        data = columns([{'a': None, 'b': None, 'c': None, 'd': None}], schema)
+        assert math.isnan(data['a'][0])
+        assert data['b'] == [False]
+        assert data['c'] == ['']
+        assert math.isnan(data['d'][0])
+        assert 'd' not in schema  # no type yet
+        assert columns([{'a': 1, 'b': 2}], schema) == {
+            'a': [1.0], 'b': [2.0], 'c': ['']}
+        data = columns([{'a': 'n/a', 'd': 'x'}], schema)
+        assert math.isnan(data.pop('b')[0])
+        assert data == {'a': ['n/a'], 'c': [''], 'd': ['x']}
+        assert schema == {'a': str, 'b': float, 'c': str, 'd': str}
+
+
+class TestTelemetrySink:
+    def test_npz_batches(self, tmp_path):
+        np = pytest.importorskip('numpy')
+        with TelemetrySink(str(tmp_path), batch_size=4) as sink:
+            on_message = sink.on_message('prusa')
+            for n in range(10):
+                on_message(None, {'current': current(n)})
+                on_message(None, {'event': {'type': 'Connected'}})
+        files = sorted(glob.glob(str(tmp_path / 'telemetry-*.npz')))
+        assert [os.path.basename(f) for f in files] == [
+            'telemetry-000001.npz', 'telemetry-000002.npz',
+            'telemetry-000003.npz']
+        assert sink.rows_written == 10
+        assert sink.files_written == 3
+        with np.load(files[0]) as data:
+            assert data['progress.completion'].tolist() == [0, .1, .2, .3]
+            assert data['state.flags.printing'].dtype == bool
+            assert data['printer'].tolist() == ['prusa'] * 4
+            assert data['temps.tool0.actual'].dtype == np.float64
+            assert data['progress.printTimeLeft'].dtype == np.float64
+        with np.load(files[2]) as data:
+            assert len(data['serverTime']) == 2
+
+    def test_npz_column_types_are_stable(self, tmp_path):
+        np = pytest.importorskip('numpy')
+        with TelemetrySink(str(tmp_path), batch_size=1) as sink:
+            sink.add('a', {'job': {'user': 'me'}, 'temp': 20})
+            sink.add('a', {'job': {'user': None}, 'temp': None})
+        files = sorted(glob.glob(str(tmp_path / 'telemetry-*.npz')))
+        with np.load(files[1]) as data:
+            assert data['job.user'].tolist() == ['']
+            assert data['temp'].dtype == np.float64
+
+    def test_every_file_has_every_column(self, tmp_path):
+        np = pytest.importorskip('numpy')
+        with TelemetrySink(str(tmp_path), batch_size=1) as sink:
+            sink.add('a', {'job': {'user': 'me'}, 'busy': True}, 1.0)
+            sink.add('a', {'temp': 20}, 2.0)
+            sink.add('a', {}, 3.0)
+        files = sorted(glob.glob(str(tmp_path / 'telemetry-*.npz')))
+        with np.load(files[2]) as data:
+            assert sorted(data) == ['busy', 'job.user', 'printer',
+                                    'received', 'temp']
+            assert data['job.user'].tolist() == ['']
+            assert data['busy'].tolist() == [False]
+            assert np.isnan(data['temp']).all()
+        with np.load(files[1]) as data:
+            assert sorted(data) == ['busy', 'job.user', 'printer',
+                                    'received', 'temp']
+
+    def test_csv(self, tmp_path):
+        with TelemetrySink(str(tmp_path), format='csv') as sink:
+            sink.add('a', current(1))
+            sink.add('b', current(2, state='Operational'))
+        path, = glob.glob(str(tmp_path / '*.csv'))
+        with open(path) as f:
+            rows = list(csv.DictReader(f))
+        assert [r['printer'] for r in rows] == ['a', 'b']
+        assert [r['state.text'] for r in rows] == ['Printing', 'Operational']
+        assert rows[0]['state.flags.printing'] == 'True'
+
+    def test_parquet(self, tmp_path):
+        pq = pytest.importorskip('pyarrow.parquet')
+        with TelemetrySink(str(tmp_path), format='parquet') as sink:
+            sink.add('a', current(1))
+        path, = glob.glob(str(tmp_path / '*.parquet'))
+        assert pq.read_table(path).column('printer').to_pylist() == ['a']
+
+    def test_time_bounded_flush(self, tmp_path):
+        sink = TelemetrySink(str(tmp_path), format='csv', flush_interval=0.05)
+        sink.add('a', current(1))
+        assert sink.flush(timeout=5)
+        assert sink.rows_written == 1
+        assert 0 <= sink.flush_latency < 5
+        sink.close()
+
+    def test_flush(self, tmp_path):
+        sink = TelemetrySink(str(tmp_path), format='csv', batch_size=3,
+                             flush_interval=3600)
+        for n in range(7):
+            sink.add('a', current(n))
+        assert sink.flush(timeout=5)
+        assert sink.rows_written == 7
+        assert sink.files_written == 3
+        sink.close()
+
+    def test_drop_when_full(self, tmp_path):
+        sink = TelemetrySink(str(tmp_path), format='csv', max_pending=3,
+                             on_full='drop', flush_interval=3600)
+        results = [sink.add('a', current(n)) for n in range(5)]
+        assert results == [True, True, True, False, False]
+        assert sink.dropped == 2
+        sink.close()
+        assert sink.rows_written == 3
+
+    def test_block_when_full(self, tmp_path):
+        sink = TelemetrySink(str(tmp_path), format='csv', max_pending=2,
+                             batch_size=2, flush_interval=3600)
+        release = threading.Event()
+        write = sink._write
+
+        def slow_write(rows):
+            release.wait(5)
+            write(rows)
+
+        sink._write = slow_write
+        for n in range(4):  # 2 taken by the writer, 2 pending
+            assert sink.add('a', current(n))
+        added = []
+        thread = threading.Thread(
+            target=lambda: added.append(sink.add('a', current(9))))
+        thread.start()
+        thread.join(0.1)
+        assert thread.is_alive()  # blocked by backpressure
+        release.set()
+        thread.join(5)
+        assert added == [True]
+        sink.close()
+        assert sink.rows_written == 5
+
+    def test_rotation(self, tmp_path):
+        with TelemetrySink(str(tmp_path), format='csv', batch_size=1,
+                           max_files=2) as sink:
+            for n in range(5):
+                sink.add('a', current(n))
+        files = sorted(os.listdir(str(tmp_path)))
+        assert files == ['telemetry-000004.csv', 'telemetry-000005.csv']
+        # numbering continues after a restart
+        with TelemetrySink(str(tmp_path), format='csv') as sink:
+            sink.add('a', current(1))
+        assert 'telemetry-000006.csv' in os.listdir(str(tmp_path))
+
+    def test_unknown_format(self, tmp_path):
+        with pytest.raises(ValueError):
+            TelemetrySink(str(tmp_path), format='xls')
+
+    def test_closed(self, tmp_path):
+        sink = TelemetrySink(str(tmp_path), format='csv')
+        sink.close()
+        with pytest.raises(RuntimeError):
+            sink.add('a', current(1))
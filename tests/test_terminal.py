@@ -0,0 +1,152 @@
+import random
+
+import pytest
+
+from octoclient.terminal import TerminalBuffer, TerminalLog, tokens
+
+
+def scan(buffer, token):
+    return [(seq, line) for seq, line in reversed(buffer.lines())
+            if token in tokens(line)]
+
+
+def check_index(buffer):
+    for token, postings in buffer.index.items():
+        assert list(postings) == sorted(postings)
+        assert postings[0] >= buffer.first
+        assert [seq for seq, _ in scan(buffer, token)] == \
+            list(reversed(postings))
+
+
+class TestTokens:
+    def test_temperature(self):
+        assert tokens('Recv: T:210.0 /210.0 B:60.0 /60.0') == \
+            {'Recv:', 'T:', 'B:'}
+
+    def test_command(self):
+        assert tokens('Send: N12 M105*38') == {'Send:', 'M105'}
+        assert tokens('Send: N13 G1 X10*91') == {'Send:', 'G1'}
+        assert tokens('M105') == {'M105'}
+        assert tokens('G1 X10 Y20 F3000') == {'G1'}
+
+    def test_words(self):
+        assert tokens('ok') == {'ok'}
+        assert tokens('Error: Thermal Runaway') == \
+            {'Error:', 'Thermal', 'Runaway'}
+
+
+class TestTerminalBuffer:
+    def test_append(self):
+        buffer = TerminalBuffer(capacity=1024, max_lines=16)
+        assert buffer.append('Send: M105') == 0
+        assert buffer.append('Recv: ok T:210.0') == 1
+        assert len(buffer) == 2
+        assert buffer.lines() == [(0, 'Send: M105'),
+                                  (1, 'Recv: ok T:210.0')]
+        assert buffer.lines(since=1) == [(1, 'Recv: ok T:210.0')]
+
+    def test_max_lines(self):
+        buffer = TerminalBuffer(capacity=1024, max_lines=4)
+        buffer.extend('line {} ok'.format(i) for i in range(10))
+        assert len(buffer) == 4
+        assert buffer.first == 6
+        assert [line for _, line in buffer.lines()] == \
+            ['line {} ok'.format(i) for i in range(6, 10)]
+        assert list(buffer.index['ok']) == [6, 7, 8, 9]
+
+    def test_arena_wraps(self):
+        buffer = TerminalBuffer(capacity=64, max_lines=100)
+        buffer.extend('Recv: T:{}.0 ok'.format(i) for i in range(100))
+        lines = buffer.lines()
+        assert lines[-1] == (99, 'Recv: T:99.0 ok')
+        assert sum(len(line) for _, line in lines) <= 64
+        assert [line for _, line in lines] == \
+            ['Recv: T:{}.0 ok'.format(seq) for seq, _ in lines]
+        check_index(buffer)
+
+    def test_long_line(self):
+        buffer = TerminalBuffer(capacity=16, max_lines=4)
+        buffer.append('ok')
+        buffer.append('Error: ' + 'x' * 100)
+        assert buffer.lines() == [(1, 'Error: ' + 'x' * 9)]
+        assert sorted(buffer.index) == ['Error:', 'x' * 9]
+
+    def test_search(self):
+        buffer = TerminalBuffer()
+        buffer.extend(['Send: M105', 'Recv: ok T:210.0',
+                       'Recv: Error: Heating failed', 'Send: M104 S200',
+                       'Recv: ok T:200.0', 'Recv: Error: Printer halted'])
+        assert buffer.search('Error:') == [
+            (5, 'Recv: Error: Printer halted'),
+            (2, 'Recv: Error: Heating failed')]
+        assert buffer.search('Error:', contains='Heating') == [
+            (2, 'Recv: Error: Heating failed')]
+        assert buffer.search('ok', limit=1) == [(4, 'Recv: ok T:200.0')]
+        assert buffer.search('M104') == [(3, 'Send: M104 S200')]
+        assert buffer.search('M140') == []
+
+    @pytest.mark.parametrize('token', ('T:210.0', 'Heating failed', '210'))
+    def test_search_not_token(self, token):
+        with pytest.raises(ValueError):
+            TerminalBuffer().search(token)
+
+    def test_search_checksummed(self):
+        buffer = TerminalBuffer()
+        buffer.extend(['Send: N10 M105*37', 'Recv: ok T:210.0',
+                       'Send: N11 M110 N0*125'])
+        assert buffer.search('M105') == [(0, 'Send: N10 M105*37')]
+        assert buffer.search('M110') == [(2, 'Send: N11 M110 N0*125')]
+
+    def test_grep(self):
+        buffer = TerminalBuffer()
+        buffer.extend(['Recv: T:210.0', 'Recv: T:205.5', 'Recv: T:210.0'])
+        assert buffer.grep('210.0') == [(2, 'Recv: T:210.0'),
+                                        (0, 'Recv: T:210.0')]
+        assert buffer.grep('210.0', limit=1) == [(2, 'Recv: T:210.0')]
+
+    def test_index_matches_scan(self):
+        rng = random.Random(42)
+        words = ['ok', 'Recv:', 'Send:', 'Error:', 'M105', 'G1', 'T:210.0',
+                 'X10', 'busy', 'echo:busy', 'processing', '12.5']
+        buffer = TerminalBuffer(capacity=512, max_lines=32)
+        for _ in range(2000):
+            buffer.append(' '.join(rng.choice(words)
+                                   for _ in range(rng.randint(0, 6))))
+        check_index(buffer)
+        for token in ('ok', 'Error:', 'M105', 'echo:', 'T:'):
+            assert buffer.search(token) == scan(buffer, token)
+
+
+class TestTerminalLog:
+    def test_on_message(self):
+        log = TerminalLog(capacity=1024, max_lines=16)
+        log.on_message('a')(None, {'current': {
+            'logs': ['Send: M105', 'Recv: ok T:210.0']}})
+        log.on_message('b')(None, {'current': {
+            'logs': ['Recv: Error: Printer halted']}})
+        log.on_message('b')(None, {'current': {'logs': []}})
+        log.on_message('b')(None, {'event': {'type': 'Connected'}})
+        assert log.buffer('a').lines() == [(0, 'Send: M105'),
+                                           (1, 'Recv: ok T:210.0')]
+        assert log.search('Error:') == {
+            'a': [], 'b': [(0, 'Recv: Error: Printer halted')]}
+        assert log.grep('210') == {'a': [(1, 'Recv: ok T:210.0')], 'b': []}
+
+    def test_messages(self):
+        log = TerminalLog(capacity=1024, max_lines=16)
+        log.on_message('a')(None, {'current': {
+            'logs': ['Send: M105', 'Recv: ok T:210.0'],
+            'messages': ['ok T:210.0']}})
+        assert log.buffer('a', 'messages').lines() == [(0, 'ok T:210.0')]
+        assert log.search('T:', kind='messages') == {
+            'a': [(0, 'ok T:210.0')]}
+        assert log.grep('210', kind='messages') == {'a': [(0, 'ok T:210.0')]}
+        assert log.search('Send:') == {'a': [(0, 'Send: M105')]}
+
+    def test_kinds(self):
+        log = TerminalLog(capacity=1024, max_lines=16, kinds=['messages'])
+        log.on_message('a')(None, {'current': {'logs': ['Send: M105'],
+                                               'messages': ['ok']}})
+        assert list(log.buffers) == [('a', 'messages')]
+        with pytest.raises(ValueError):
+            TerminalLog(kinds=['temps'])
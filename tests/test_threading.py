@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+
+import pytest
+import requests
+
+from octoclient import OctoClient
+
+from _common import APIKEY
+
+
+THREADS = 16
+CALLS = 400
+
+
+def echo(handler, body):
+    return json.loads(body.decode('utf-8'))
+
+
+@pytest.fixture
+def octoprint(octoprint):
+    octoprint.routes[('POST', '/api/echo')] = echo
+    octoprint.routes[('GET', '/api/job')] = {'state': 'Operational'}
+    return octoprint
+
+
+class TestThreading:
+    def test_stress_get_and_post(self, client, octoprint):
+        def call(n):
+            if n % 2:
+                return n, client._get('/api/job')
+            return n, client._post('/api/echo', json={'n': n})
+
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            results = list(executor.map(call, range(CALLS)))
+
+        for n, result in results:
+            if n % 2:
+                assert result == {'state': 'Operational'}
+            else:
+                assert result == {'n': n}
+        keys = {r[3]['X-Api-Key'] for r in octoprint.requests}
+        assert keys == {APIKEY}
+        assert len(octoprint.requests) == CALLS + 1  # + version()
+
+    def test_session_shared_by_threads(self, client):
+        barrier = threading.Barrier(THREADS)
+        sessions = []
+
+        def grab():
+            barrier.wait()
+            sessions.append(client.session)
+
+        threads = [threading.Thread(target=grab) for _ in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert {id(s) for s in sessions} == {id(client.session)}
+        assert client.session.headers['X-Api-Key'] == APIKEY
+
+    def test_connections_reused(self, client, octoprint):
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            list(executor.map(lambda n: client._get('/api/job'),
+                              range(CALLS)))
+        assert octoprint.connections <= THREADS
+
+    def test_shared_session_is_used_by_all_threads(self, octoprint):
+        session = requests.Session()
+        client = OctoClient(url=octoprint.url, apikey=APIKEY, session=session)
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            results = list(executor.map(lambda n: client._get('/api/job'),
+                                        range(CALLS // 4)))
+        assert all(r == {'state': 'Operational'} for r in results)
+        assert client.session is session
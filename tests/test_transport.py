@@ -0,0 +1,163 @@
+import json
+import threading
+
+import pytest
+
+from octoclient import transport
+from octoclient.transport import (AutoEventHandler, choose_transport, probe,
+                                  WEBSOCKET, XHR_STREAMING)
+
+from _fakeserver import FakeOctoPrint
+
+
+CURRENT = {'current': {'state': {'text': 'Operational'}}}
+
+
+@pytest.fixture
+def octoprint():
+    handlers = []
+    with FakeOctoPrint() as server:
+        server.handlers = handlers
+        server.public.add('/sockjs/')
+        server.routes[('GET', '/sockjs/info')] = {'websocket': True}
+        done = threading.Event()
+        streams = []
+
+        def xhr_streaming(handler, body):
+            streams.append(handler.path)
+            if len(streams) > 1:
+                done.wait(5)
+                return 200, b'h\n', {'Connection': 'close'}
+            return 200, b'o\na' + json.dumps([CURRENT]).encode() + b'\n'
+
+        server.routes[('POST', '/sockjs/')] = xhr_streaming
+        server.streams = streams
+        yield server
+        for handler in handlers:
+            handler.close()
+        done.set()
+    # the handler threads end once the server is gone
+    for handler in handlers:
+        handler.thread.join(5)
+
+
+class Recorder:
+    def __init__(self):
+        self.opened = threading.Event()
+        self.received = threading.Event()
+        self.messages = []
+        self.closed = []
+
+    def on_open(self, api):
+        self.opened.set()
+
+    def on_close(self, api):
+        self.closed.append(api)
+
+    def on_message(self, api, message):
+        self.messages.append(message)
+        self.received.set()
+
+    def handler(self, server, **kwargs):
+        handler = AutoEventHandler(server.url, on_open=self.on_open,
+                                   on_close=self.on_close,
+                                   on_message=self.on_message, **kwargs)
+        server.handlers.append(handler)
+        return handler
+
+
+class TestProbe:
+    def test_websocket_disabled(self, octoprint):
+        octoprint.routes[('GET', '/sockjs/info')] = {'websocket': False}
+        probed = probe(octoprint.url)
+        assert probed['info'] == {'websocket': False}
+        assert probed['http_latency'] > 0
+        assert probed['websocket_latency'] is None
+        assert probed['websocket_error'] is None
+        assert choose_transport(probed) == XHR_STREAMING
+
+    def test_websocket_upgrade_fails(self, octoprint):
+        probed = probe(octoprint.url, timeout=2)
+        assert probed['websocket_latency'] is None
+        assert probed['websocket_error'] is not None
+        assert choose_transport(probed) == XHR_STREAMING
+
+    @pytest.mark.parametrize(('http', 'ws', 'transport'), (
+        (0.01, 0.02, WEBSOCKET),
+        (0.01, 0.5, XHR_STREAMING),
+        (0.0, 0.005, WEBSOCKET),
+        (0.01, None, XHR_STREAMING),
+    ))
+    def test_choose(self, http, ws, transport):
+        probed = {'http_latency': http, 'websocket_latency': ws}
+        assert choose_transport(probed) == transport
+
+
+class TestAutoEventHandler:
+    def test_probes_and_uses_xhr(self, octoprint):
+        recorder = Recorder()
+        handler = recorder.handler(octoprint, timeout=2)
+        handler.run()
+        assert recorder.received.wait(5)
+        assert recorder.opened.is_set()
+        assert recorder.messages[0] == CURRENT
+        assert handler.transport == XHR_STREAMING
+        assert handler.probed['websocket_error'] is not None
+        assert handler.fallbacks == 0
+
+    def test_falls_back_when_upgrade_fails(self, octoprint):
+        recorder = Recorder()
+        handler = recorder.handler(octoprint, transport=WEBSOCKET)
+        handler.run()
+        assert recorder.received.wait(5)
+        assert handler.transport == XHR_STREAMING
+        assert handler.fallbacks == 1
+        assert handler.probed is None
+        # the failed WebSocket never opened, so it is not reported closed
+        assert recorder.closed == []
+        assert recorder.messages == [CURRENT]
+
+    def test_backs_off_and_falls_back_when_dropped(self, monkeypatch):
+        attempts = []
+        waits = []
+
+        class Dropping:
+            """
+            Opens and is closed right away, like websocket-client does
+            """
+            def __init__(self, url, on_open, on_close, **kwargs):
+                self.on_open, self.on_close = on_open, on_close
+
+            def run(self):
+                attempts.append(WEBSOCKET)
+                self.on_open(self)
+                self.on_close(self, 1000, 'going away')
+
+            def wait(self):
+                pass
+
+        class Streaming(Dropping):
+            def run(self):
+                attempts.append(XHR_STREAMING)
+                self.on_open(self)
+
+            def wait(self):
+                handler.close()
+
+        class Stop(threading.Event):
+            def wait(self, timeout=None):
+                waits.append(timeout)
+
+        monkeypatch.setitem(transport.TRANSPORTS, WEBSOCKET, Dropping)
+        monkeypatch.setitem(transport.TRANSPORTS, XHR_STREAMING, Streaming)
+        recorder = Recorder()
+        handler = AutoEventHandler('http://printer.local',
+                                   on_open=recorder.on_open,
+                                   on_close=recorder.on_close,
+                                   transport=WEBSOCKET)
+        handler._stop = Stop()
+        handler._run()
+        assert attempts == [WEBSOCKET] * 3 + [XHR_STREAMING]
+        assert handler.fallbacks == 1
+        assert waits[:3] == [0.5, 1.0, 2.0]
+        assert len(recorder.closed) == 3
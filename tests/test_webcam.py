@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+
+import pytest
+
+from octoclient.webcam import MJPEGReader, SnapshotPoller, Webcam
+
+
+def jpeg(n, size=100):
+    body = bytes((n + i) % 0xff for i in range(size))
+    return b'\xff\xd8' + body + b'\xff\xd9'
+
+
+def mjpeg(frames):
+    parts = []
+    for frame in frames:
+        parts.append(b'--boundarydonotcross\r\nContent-Type: image/jpeg\r\n'
+                     b'Content-Length: ' + str(len(frame)).encode() +
+                     b'\r\n\r\n' + frame + b'\r\n')
+    return b''.join(parts)
+
+
+class Trickle:
+    '''
+    Stream returning at most step bytes per readinto()
+    '''
+    def __init__(self, data, step):
+        self.data = data
+        self.step = step
+        self.pos = 0
+
+    def readinto(self, buffer):
+        chunk = self.data[self.pos:self.pos + min(self.step, len(buffer))]
+        buffer[:len(chunk)] = chunk
+        self.pos += len(chunk)
+        return len(chunk)
+
+
+@pytest.fixture
+def octoprint(octoprint):
+    octoprint.routes[('GET', '/api/settings')] = {'webcam': {
+        'snapshotUrl': '/webcam/snapshot',
+        'streamUrl': '/webcam/stream'}}
+    octoprint.routes[('GET', '/webcam/snapshot')] = jpeg(1, 100000)
+    octoprint.routes[('GET', '/webcam/stream')] = mjpeg(
+        jpeg(n) for n in range(5))
+    octoprint.public.update(('/webcam/snapshot', '/webcam/stream'))
+    return octoprint
+
+
+class TestMJPEGReader:
+    @pytest.mark.parametrize('step', (1, 7, 64, 4096))
+    @pytest.mark.parametrize('buffer_size', (16, 300, 4096))
+    def test_frames(self, step, buffer_size):
+        frames = [jpeg(n, size=50 * n) for n in range(10)]
+        reader = MJPEGReader(Trickle(mjpeg(frames), step), buffer_size)
+        assert [bytes(f) for f in reader] == frames
+        assert reader.frames == 10
+
+    def test_no_copy(self):
+        frames = [jpeg(n) for n in range(3)]
+        reader = MJPEGReader(Trickle(mjpeg(frames), 4096), 4096)
+        first = next(reader)
+        assert first.obj is reader.buffer
+        second = next(reader)
+        assert second.obj is reader.buffer
+
+    def test_garbage_between_frames(self):
+        data = os.urandom(1000).replace(b'\xff', b'') + jpeg(1)
+        reader = MJPEGReader(Trickle(data, 33), 64)
+        assert [bytes(f) for f in reader] == [jpeg(1)]
+
+
+class TestWebcam:
+    def test_discovery(self, client):
+        webcam = Webcam(client)
+        assert webcam.snapshot_url == client.url + '/webcam/snapshot'
+        assert webcam.stream_url == client.url + '/webcam/stream'
+
+    def test_snapshot(self, client):
+        assert Webcam(client).snapshot() == jpeg(1, 100000)
+
+    def test_snapshot_into_buffer(self, client):
+        buffer = bytearray(1000)
+        frame = Webcam(client).snapshot(buffer)
+        assert frame.obj is buffer
+        assert bytes(frame) == jpeg(1, 100000)
+
+    def test_stream(self, client):
+        frames = [bytes(f) for f in Webcam(client).frames(buffer_size=64)]
+        assert frames == [jpeg(n) for n in range(5)]
+
+    def test_not_configured(self):
+        with pytest.raises(RuntimeError):
+            Webcam(snapshot_url=None).snapshot()
+
+
+class TestSnapshotPoller:
+    def test_frame_rate_cap(self, client):
+        counts = {'a': 0, 'b': 0}
+        lock = threading.Lock()
+
+        def on_frame(name, frame):
+            assert len(frame) == 100004
+            with lock:
+                counts[name] += 1
+
+        webcams = {'a': Webcam(client), 'b': Webcam(client)}
+        poller = SnapshotPoller(webcams, on_frame, fps=10, workers=2)
+        poller.start()
+        time.sleep(0.5)
+        poller.stop()
+        for count in counts.values():
+            assert 2 <= count <= 7
+
+    def test_errors(self):
+        errors = []
+        poller = SnapshotPoller({'x': Webcam(snapshot_url=None)},
+                                lambda n, f: None, fps=100,
+                                on_error=lambda n, e: errors.append(n))
+        poller.start()
+        time.sleep(0.1)
+        poller.stop()
+        assert errors and set(errors) == {'x'}